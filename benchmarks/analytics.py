@@ -0,0 +1,160 @@
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+
+import numpy as np
+from sqlalchemy import insert
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.server_utils.analytics import analyze, load_epochs
+from src.server_utils.archive import from_epoch, to_epoch
+from src.server_utils.config import get_config
+
+TARGET_MS = 50
+
+
+def generate(count: int, keys: int, start: datetime, end: datetime, seed: int = 0) -> dict:
+    """
+    Generate sorted random impression timestamps, split evenly between keys.
+
+    Args:
+        count: Total number of impressions
+        keys: Number of keys
+        start: Start of the range
+        end: End of the range
+        seed: Random seed
+
+    Returns:
+        dict: Sorted `to_epoch` arrays of each key, as returned by `load_epochs`
+    """
+    rng = np.random.default_rng(seed)
+    return {
+        key: [np.sort(rng.integers(to_epoch(start), to_epoch(end), count // keys, dtype=np.int64))]
+        for key in range(1, keys + 1)
+    }
+
+
+def seed(engine, sources: dict, start: datetime, end: datetime, batch_size: int = 50000) -> None:
+    """
+    Create one code per key and insert its impressions into the monthly partitions.
+
+    Args:
+        engine: Engine of a database with the schema and no codes
+        sources: Arrays of each key, as returned by `generate`
+        start: Start of the range
+        end: End of the range
+        batch_size: Rows inserted per statement
+    """
+    from src.server_utils.db import Association, Stats
+    from src.server_utils.partitions import create_partitions, impression_inserts, month_start, next_month
+
+    with engine.begin() as connection:
+        connection.execute(insert(Association), [{"id": key, "key": f"key{key}", "url": f"https://example.com/{key}"} for key in sources])
+        connection.execute(insert(Stats), [{"id": key, "key": f"key{key}", "association_id": key} for key in sources])
+
+    months = [month_start(start)]
+    while months[-1] < month_start(end):
+        months.append(next_month(months[-1]))
+    create_partitions(engine, months)
+
+    rows = [(key, from_epoch(value)) for key, arrays in sources.items() for value in arrays[0].tolist()]
+    for offset in range(0, len(rows), batch_size):
+        with engine.begin() as connection:
+            for stmt, params in impression_inserts(rows[offset:offset + batch_size], engine.dialect.name):
+                connection.execute(stmt, params)
+
+
+def measure(run: Callable[[], object], runs: int) -> dict:
+    """
+    Time a function.
+
+    Args:
+        run: Function to time
+        runs: Number of timed runs, after one warm-up run
+
+    Returns:
+        dict: Median and maximum time in milliseconds
+    """
+    run()
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": statistics.median(timings), "max_ms": max(timings)}
+
+
+def measure_loaded(sources: dict, start: datetime, end: datetime, runs: int) -> dict:
+    """
+    Time `load_epochs` followed by `analyze` on a temporary SQLite database holding the impressions.
+
+    Args:
+        sources: Arrays of each key, written to the database
+        start: Start of the analyzed range
+        end: End of the analyzed range
+        runs: Number of timed runs, after one warm-up run
+
+    Returns:
+        dict: Median and maximum time in milliseconds
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        os.environ.setdefault("SECRET_KEY", "bench")
+        # Archives of a local deployment must not be loaded with the seeded keys
+        get_config()["archive"]["directory"] = os.path.join(directory, "archive")
+
+        from src.server import create_app
+        from src.server_utils.shared import db
+
+        app = create_app(mode="admin")
+        logging.getLogger().setLevel(logging.WARNING)
+        with app.app_context():
+            seed(db.engine, sources, start, end)
+            stats_ids = list(sources)
+            result = measure(lambda: analyze(load_epochs(stats_ids, start, end), start, end), runs)
+            db.engine.dispose()
+        writer = app.extensions.get("sqlite_writer")
+        if writer is not None:
+            writer.engine.dispose()
+    return result
+
+
+def main() -> None:
+    """
+    Print analytics computation time for increasing numbers of impressions.
+
+    `analyze` alone is timed on arrays in memory; up to `--max-load-size`
+    impressions, loading them from a seeded SQLite database with
+    `load_epochs` is timed along with it.
+    """
+    parser = argparse.ArgumentParser(description="Analytics computation time versus number of impressions")
+    parser.add_argument("--sizes", default="100000,1000000,10000000", help="Comma-separated impression counts")
+    parser.add_argument("--keys", type=int, default=1, help="Number of keys the impressions are split between")
+    parser.add_argument("--days", type=int, default=365, help="Length of the analyzed range")
+    parser.add_argument("--runs", type=int, default=10, help="Timed runs per size")
+    parser.add_argument("--max-load-size", type=int, default=1000000,
+                        help="Largest size also timed with loading from a seeded SQLite database")
+    args = parser.parse_args()
+
+    end = datetime(2025, 1, 1)
+    start = end - timedelta(days=args.days)
+    for size in (int(value) for value in args.sizes.split(",")):
+        sources = generate(size, args.keys, start, end)
+        result = measure(lambda: analyze(sources, start, end), args.runs)
+        verdict = "ok" if result["median_ms"] < TARGET_MS else f"over the {TARGET_MS} ms target"
+        line = (f"{size:>9} impressions, {args.keys} keys, {args.days} days: "
+                f"analyze median {result['median_ms']:7.1f} ms, max {result['max_ms']:7.1f} ms ({verdict})")
+        if size <= args.max_load_size:
+            loaded = measure_loaded(sources, start, end, args.runs)
+            line += f"; load + analyze median {loaded['median_ms']:8.1f} ms, max {loaded['max_ms']:8.1f} ms"
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert, select, text
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.server_utils.db import Association, Stats
+from src.server_utils.shared import db
+
+KEY_INDEXES = ["ix_associations_key", "ix_stats_key"]
+
+
+def seed(engine, count: int, batch_size: int = 50000) -> None:
+    """
+    Insert `count` associations with their stats rows.
+
+    Args:
+        engine: SQLAlchemy engine of an empty database
+        count: Number of associations to create
+        batch_size: Number of rows inserted per statement
+    """
+    with engine.begin() as connection:
+        for start in range(0, count, batch_size):
+            ids = range(start + 1, min(start + batch_size, count) + 1)
+            connection.execute(insert(Association), [
+                {"id": i, "key": f"key{i:08d}", "url": f"example.com/{i}"} for i in ids
+            ])
+            connection.execute(insert(Stats), [
+                {"id": i, "key": f"key{i:08d}", "association_id": i} for i in ids
+            ])
+
+
+def measure(engine, count: int, lookups: int) -> dict:
+    """
+    Time the redirect's key resolution query for random existing keys.
+
+    Args:
+        engine: SQLAlchemy engine of a seeded database
+        count: Number of associations in the database
+        lookups: Number of queries to time
+
+    Returns:
+        dict: Median and p99 latency in microseconds
+    """
+    query = (
+        select(Association.url, Stats.id)
+        .outerjoin(Stats, Stats.key == Association.key)
+        .limit(1)
+    )
+    timings = []
+    with Session(engine) as session:
+        for _ in range(lookups):
+            key = f"key{random.randint(1, count):08d}"
+            started = time.perf_counter()
+            session.execute(query.where(Association.key == key)).first()
+            timings.append((time.perf_counter() - started) * 1e6)
+    timings.sort()
+    return {
+        "median_us": statistics.median(timings),
+        "p99_us": timings[int(len(timings) * 0.99) - 1],
+    }
+
+
+def main() -> None:
+    """
+    Print key lookup latency for increasing numbers of associations.
+    """
+    parser = argparse.ArgumentParser(description="Key lookup latency versus table size")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="Comma-separated association counts")
+    parser.add_argument("--lookups", type=int, default=2000, help="Lookups timed per size")
+    parser.add_argument("--no-index", action="store_true", help="Drop the key indexes to compare with the old schema")
+    args = parser.parse_args()
+
+    for size in (int(value) for value in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+            db.metadata.create_all(engine)
+            if args.no_index:
+                with engine.begin() as connection:
+                    for name in KEY_INDEXES:
+                        connection.execute(text(f"DROP INDEX {name}"))
+            seed(engine, size)
+            lookups = args.lookups if not args.no_index else min(args.lookups, 200)
+            result = measure(engine, size, lookups)
+            engine.dispose()
+        print(f"{size:>9} associations: median {result['median_us']:8.1f} us, p99 {result['p99_us']:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
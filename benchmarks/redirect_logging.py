@@ -0,0 +1,180 @@
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, insert
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = ("off", "sync", "queued")
+
+
+def seed(database_url: str, count: int) -> None:
+    """
+    Create the schema with `count` keys.
+
+    Args:
+        database_url: SQLite database URL
+        count: Number of keys to create
+    """
+    from src.server_utils.db import Association, Stats
+    from src.server_utils.shared import db
+
+    engine = create_engine(database_url)
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(Association), [{"id": i, "key": f"key{i}", "url": "example.com"} for i in range(1, count + 1)])
+        connection.execute(insert(Stats), [{"id": i, "key": f"key{i}", "association_id": i} for i in range(1, count + 1)])
+    engine.dispose()
+
+
+def redirects(database_url: str, directory: str, mode: str, output: str, sample_rate: float, sink_delay: float,
+              threads: int, duration: float, count: int, results) -> None:
+    """
+    Benchmark process: serve redirects of random keys from several threads through the WSGI app.
+
+    Logging is configured like the server, with the request log line of
+    `log_requests`, before the application is imported. Scans are buffered,
+    so the latency is that of the request and its log lines.
+
+    Args:
+        database_url: SQLite database URL
+        directory: Directory of the log file
+        mode: "off" (WARNING level), "sync" or "queued" logging at INFO level
+        output: "text" or "json"
+        sample_rate: `[logging] scan_sample_rate`
+        sink_delay: Seconds each log handler sleeps per record, simulating a slow console or disk
+        threads: Request threads
+        duration: Seconds to run for
+        count: Number of keys
+        results: Queue receiving the redirect latencies and dropped record count
+    """
+    # Console output goes nowhere, like a log collector that keeps up
+    sys.stderr = open(os.devnull, "w")
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ["DATABASE_URL"] = database_url
+    from src.server_utils.config import get_config
+
+    config = get_config()
+    config["logging"].update({
+        "filename": os.path.join(directory, "bench.log"),
+        "level": "WARNING" if mode == "off" else "INFO",
+        "queued": mode == "queued",
+        "output": output,
+        "scan_sample_rate": sample_rate,
+    })
+    config.setdefault("impressions", {})["buffered"] = True
+    from werkzeug.test import EnvironBuilder
+
+    from src.server import create_app
+    from src.server_utils.logs import BackgroundHandler, log_requests, logging_stats
+
+    if sink_delay:
+        import logging
+
+        for handler in logging.getLogger().handlers:
+            for target in handler.handlers if isinstance(handler, BackgroundHandler) else [handler]:
+                emit = target.emit
+                target.emit = lambda record, emit=emit: (time.sleep(sink_delay), emit(record))
+
+    app = create_app(mode="public")
+    log_requests(app)
+    environs = [EnvironBuilder(path=f"/qr/key{i}").get_environ() for i in range(1, count + 1)]
+    timings = []
+    deadline = time.monotonic() + duration
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    def work():
+        while time.monotonic() < deadline:
+            environ = dict(random.choice(environs))
+            started = time.perf_counter()
+            for _ in app.wsgi_app(environ, start_response):
+                pass
+            timings.append(time.perf_counter() - started)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    stats = logging_stats()
+    app.extensions["impression_buffer"].stop()
+    results.put((timings, stats["dropped"] if stats else 0))
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Get a percentile of a list of measurements.
+
+    Args:
+        values: Measurements
+        fraction: Percentile between 0 and 1
+
+    Returns:
+        float: The percentile, NaN without measurements
+    """
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[max(0, int(len(values) * fraction) - 1)]
+
+
+def run(mode: str, output: str, sample_rate: float, sink_delay: float, threads: int, duration: float,
+        count: int) -> dict:
+    """
+    Run the redirect process against a fresh database.
+
+    Returns:
+        dict: Redirect throughput, latency and dropped log records
+    """
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        seed(database_url, count)
+        results = context.Queue()
+        process = context.Process(target=redirects, args=(database_url, directory, mode, output, sample_rate,
+                                                          sink_delay, threads, duration, count, results))
+        process.start()
+        timings, dropped = results.get()
+        process.join()
+
+    return {
+        "redirects_per_second": len(timings) / duration,
+        "median_ms": percentile(timings, 0.5) * 1000,
+        "p99_ms": percentile(timings, 0.99) * 1000,
+        "dropped": dropped,
+    }
+
+
+def main() -> None:
+    """
+    Print redirect latency with logging off, written synchronously and written from the background thread.
+    """
+    parser = argparse.ArgumentParser(description="Redirect latency with and without logging")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma-separated logging modes: off, sync, queued")
+    parser.add_argument("--output", choices=("text", "json"), default="text", help="Log output format")
+    parser.add_argument("--scan-sample-rate", type=float, default=1.0, help="Share of the per-scan log lines written")
+    parser.add_argument("--sink-delay-ms", type=float, default=0, help="Delay per written record, simulating a slow console or disk")
+    parser.add_argument("--threads", type=int, default=8, help="Request threads")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds per run")
+    parser.add_argument("--keys", type=int, default=1000, help="Number of keys")
+    args = parser.parse_args()
+
+    for mode in args.modes.split(","):
+        result = run(mode, args.output, args.scan_sample_rate, args.sink_delay_ms / 1000, args.threads, args.duration, args.keys)
+        print(
+            f"{mode:>6}: {result['redirects_per_second']:8.0f} redirects/s, "
+            f"median {result['median_ms']:6.3f} ms, p99 {result['p99_ms']:6.3f} ms, "
+            f"{result['dropped']} log records dropped"
+        )
+
+
+if __name__ == "__main__":
+    main()
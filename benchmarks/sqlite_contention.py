@@ -0,0 +1,214 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCAN_STATS_ID = 1
+ADMIN_STATS_ID = 2
+
+
+def seed(database_url: str) -> None:
+    """
+    Create the schema with one key receiving scans and one key being reset.
+
+    Args:
+        database_url: SQLite database URL
+    """
+    from src.server_utils.db import Association, Stats
+    from src.server_utils.shared import db
+
+    engine = create_engine(database_url)
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for i in (SCAN_STATS_ID, ADMIN_STATS_ID):
+            connection.execute(insert(Association), [{"id": i, "key": f"key{i}", "url": "example.com"}])
+            connection.execute(insert(Stats), [{"id": i, "key": f"key{i}", "association_id": i}])
+    engine.dispose()
+
+
+def create_profiled_app(database_url: str, profile: bool):
+    """
+    Create the Flask app with the SQLite profile enabled or disabled.
+
+    Args:
+        database_url: SQLite database URL
+        profile: Whether `[database.sqlite] profile` is enabled
+
+    Returns:
+        Flask: Application of the benchmark process
+    """
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ["DATABASE_URL"] = database_url
+    from src.server_utils.config import get_config
+
+    get_config().setdefault("database", {}).setdefault("sqlite", {})["profile"] = profile
+    from src.server import create_app
+
+    return create_app(mode="public")
+
+
+def scanner(database_url: str, profile: bool, threads: int, duration: float, results) -> None:
+    """
+    Public process: look up a key and record a scan from several threads, like concurrent redirects.
+
+    The lookup bypasses the resolution cache, so each scan reads before it writes.
+
+    Args:
+        database_url: SQLite database URL
+        profile: Whether the SQLite profile is enabled
+        threads: Number of request threads
+        duration: Seconds to run for
+        results: Queue receiving the process's measurements
+    """
+    from src.server_utils.cache import resolution_query
+    from src.server_utils.impressions import write_impressions
+    from src.server_utils.shared import db
+
+    app = create_profiled_app(database_url, profile)
+    lookup_timings = []
+    timings = []
+    errors = []
+    deadline = time.monotonic() + duration
+
+    def work():
+        while time.monotonic() < deadline:
+            with app.app_context():
+                started = time.perf_counter()
+                try:
+                    db.session.execute(resolution_query(f"key{SCAN_STATS_ID}")).first()
+                    lookup_timings.append(time.perf_counter() - started)
+                    write_impressions([(SCAN_STATS_ID, datetime.now())])
+                    timings.append(time.perf_counter() - started)
+                except OperationalError:
+                    errors.append(1)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put(("scans", (timings, lookup_timings), len(errors)))
+
+
+def admin(database_url: str, profile: bool, duration: float, rows: int, pause: float, results) -> None:
+    """
+    Admin process: repeatedly fill a second key with impressions and reset it.
+
+    Args:
+        database_url: SQLite database URL
+        profile: Whether the SQLite profile is enabled
+        duration: Seconds to run for
+        rows: Impressions written before each reset
+        pause: Seconds between resets
+        results: Queue receiving the process's measurements
+    """
+    from src.server_utils.impressions import delete_impressions, write_impressions
+
+    app = create_profiled_app(database_url, profile)
+    resets = 0
+    errors = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        with app.app_context():
+            try:
+                now = datetime.now()
+                write_impressions([(ADMIN_STATS_ID, now)] * rows)
+                delete_impressions(ADMIN_STATS_ID, batch_size=1000)
+                resets += 1
+            except OperationalError:
+                errors += 1
+        time.sleep(pause)
+    results.put(("resets", resets, errors))
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Get a percentile of a list of measurements.
+
+    Args:
+        values: Measurements
+        fraction: Percentile between 0 and 1
+
+    Returns:
+        float: The percentile, NaN without measurements
+    """
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[max(0, int(len(values) * fraction) - 1)]
+
+
+def run(profile: bool, threads: int, duration: float, rows: int, pause: float) -> dict:
+    """
+    Run the scanner and admin processes against a fresh database.
+
+    Args:
+        profile: Whether the SQLite profile is enabled
+        threads: Scanner threads
+        duration: Seconds to run for
+        rows: Impressions written before each reset
+        pause: Seconds between resets
+
+    Returns:
+        dict: Scan throughput, latency, reset count and error counts
+    """
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        seed(database_url)
+        results = context.Queue()
+        processes = [
+            context.Process(target=scanner, args=(database_url, profile, threads, duration, results)),
+            context.Process(target=admin, args=(database_url, profile, duration, rows, pause, results)),
+        ]
+        for process in processes:
+            process.start()
+        measured = dict((name, (a, b)) for name, a, b in (results.get() for _ in processes))
+        for process in processes:
+            process.join()
+
+    (timings, lookup_timings), scan_errors = measured["scans"]
+    resets, reset_errors = measured["resets"]
+    return {
+        "scans_per_second": len(timings) / duration,
+        "median_ms": percentile(timings, 0.5) * 1000,
+        "p99_ms": percentile(timings, 0.99) * 1000,
+        "lookup_p99_ms": percentile(lookup_timings, 0.99) * 1000,
+        "scan_errors": scan_errors,
+        "resets": resets,
+        "reset_errors": reset_errors,
+    }
+
+
+def main() -> None:
+    """
+    Print scan throughput with concurrent resets, with and without the SQLite profile.
+    """
+    parser = argparse.ArgumentParser(description="Concurrent scan throughput on a shared SQLite database")
+    parser.add_argument("--threads", type=int, default=8, help="Scanner threads in the public process")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per run")
+    parser.add_argument("--rows", type=int, default=20000, help="Impressions written before each reset")
+    parser.add_argument("--pause", type=float, default=0.5, help="Seconds between resets")
+    args = parser.parse_args()
+
+    for profile in (False, True):
+        result = run(profile, args.threads, args.duration, args.rows, args.pause)
+        print(
+            f"profile {'on ' if profile else 'off'}: {result['scans_per_second']:8.1f} scans/s, "
+            f"median {result['median_ms']:7.2f} ms, p99 {result['p99_ms']:8.2f} ms, "
+            f"lookup p99 {result['lookup_p99_ms']:8.2f} ms, "
+            f"{result['scan_errors']} failed scans, {result['resets']} resets, {result['reset_errors']} failed resets"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event, func, insert, select, text
+from sqlalchemy.engine import Engine, make_url
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Path requested for a random key by each scenario, and the server answering it
+SCENARIOS = {
+    "redirect": ("public", "/qr/key{key}"),
+    "stats": ("admin", "/qr/key{key}/stats"),
+    "stats-data": ("admin", "/qr/key{key}/stats/data"),
+}
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+class BenchError(ValueError):
+    """
+    Invalid benchmark settings or database, or a failed client process.
+    """
+
+
+class QueryCounter:
+    """
+    Count the SQL statements executed by some engines, from any thread.
+    """
+
+    def __init__(self, engines: Sequence[Engine]) -> None:
+        self._count = 0
+        self._lock = threading.Lock()
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._executed)
+
+    def _executed(self, *args) -> None:
+        with self._lock:
+            self._count += 1
+
+    def take(self) -> int:
+        """
+        Get the number of statements executed since the previous call.
+
+        Returns:
+            int: Statements executed, an executemany counting once
+        """
+        with self._lock:
+            count, self._count = self._count, 0
+        return count
+
+
+def seed(engine: Engine, keys: int, impressions: int, days: int, batch_size: int = 50000) -> None:
+    """
+    Create `keys` codes "key1" to "key<keys>" and spread impressions uniformly over them and the last `days` days.
+
+    Impressions are written with their rollup counters, like scans, in
+    batches of `batch_size` rows each committed on its own.
+
+    Args:
+        engine: Engine of a database with the schema and no codes
+        keys: Number of codes
+        impressions: Number of impressions
+        days: Age in days of the oldest impression
+        batch_size: Rows inserted per statement
+    """
+    from src.server_utils.db import Association, Stats
+    from src.server_utils.partitions import create_partitions, impression_inserts, month_start, next_month
+    from src.server_utils.rollups import rollup_statements
+
+    for start in range(1, keys + 1, batch_size):
+        ids = range(start, min(start + batch_size, keys + 1))
+        with engine.begin() as connection:
+            connection.execute(insert(Association), [{"id": i, "key": f"key{i}", "url": f"https://example.com/{i}"} for i in ids])
+            connection.execute(insert(Stats), [{"id": i, "key": f"key{i}", "association_id": i} for i in ids])
+    if engine.dialect.name == "postgresql":
+        # Codes created afterwards must not reuse the seeded ids
+        with engine.begin() as connection:
+            for table in ("associations", "stats"):
+                connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), :last)"), {"last": keys})
+
+    now = datetime.now()
+    oldest = now - timedelta(days=days)
+    months = [month_start(oldest)]
+    while months[-1] < month_start(now):
+        months.append(next_month(months[-1]))
+    create_partitions(engine, months)
+
+    rng = random.Random(0)
+    span = (now - oldest).total_seconds()
+    for start in range(0, impressions, batch_size):
+        rows = [(rng.randint(1, keys), oldest + timedelta(seconds=rng.random() * span))
+                for _ in range(min(batch_size, impressions - start))]
+        with engine.begin() as connection:
+            for stmt, params in impression_inserts(rows, engine.dialect.name) + rollup_statements(rows, engine.dialect.name):
+                connection.execute(stmt, params)
+
+
+def drive(port: int, template: str, keys: int, threads: int, duration: float, results) -> None:
+    """
+    Client process: request the path of random keys from several threads, each over one keep-alive connection.
+
+    Args:
+        port: Port of the server on localhost
+        template: Path with a "{key}" placeholder for the key number
+        keys: Number of keys
+        threads: Client threads
+        duration: Seconds to run for
+        results: Queue receiving the latencies, the responses by status, the failed requests and the elapsed time
+    """
+    import http.client
+
+    outcomes = []
+    deadline = time.monotonic() + duration
+
+    def work(seed: int) -> None:
+        rng = random.Random(seed)
+        timings, statuses, failures = [], {}, 0
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        while time.monotonic() < deadline:
+            path = template.format(key=rng.randint(1, keys))
+            started = time.perf_counter()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                failures += 1
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                continue
+            timings.append(time.perf_counter() - started)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+        connection.close()
+        outcomes.append((timings, statuses, failures))
+
+    started = time.monotonic()
+    workers = [threading.Thread(target=work, args=(seed,)) for seed in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    timings, statuses, failures = [], {}, 0
+    for thread_timings, thread_statuses, thread_failures in outcomes:
+        timings.extend(thread_timings)
+        for status, count in thread_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+        failures += thread_failures
+    results.put((timings, statuses, failures, elapsed))
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Get a percentile of a list of measurements.
+
+    Args:
+        values: Measurements
+        fraction: Percentile between 0 and 1
+
+    Returns:
+        float: The percentile, NaN without measurements
+    """
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[max(0, int(len(values) * fraction) - 1)]
+
+
+def _run_client(port: int, template: str, keys: int, threads: int, duration: float) -> Tuple[List[float], Dict, int, float]:
+    """
+    Run `drive` in a separate process, so the client does not compete with the servers for the GIL.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=drive, args=(port, template, keys, threads, duration, results))
+    process.start()
+    while True:
+        # Checked before waiting, so a result put just before exiting is still read
+        alive = process.is_alive()
+        try:
+            outcome = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not alive:
+                raise BenchError(f"The client process exited with code {process.exitcode} without results")
+    process.join()
+    return outcome
+
+
+def _start_server(app, mode: str) -> Tuple[object, int]:
+    """
+    Serve an application on a free localhost port with the `[server.<mode>]` waitress settings.
+    """
+    from waitress import create_server
+
+    from src.server_utils.serving import waitress_options
+
+    server = create_server(app, host="127.0.0.1", port=0, **waitress_options(mode))
+    threading.Thread(target=server.run, daemon=True).start()
+    return server, server.effective_port
+
+
+def git_revision() -> Optional[Dict]:
+    """
+    Get the commit of the source tree, to tell apart the results of different commits.
+
+    Returns:
+        Optional[Dict]: Commit hash and whether tracked files are modified, or None outside a git checkout
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        changes = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return {"commit": commit, "dirty": bool(changes)}
+
+
+def run_suite(database_url: Optional[str] = None, keys: int = 1000, impressions: int = 100000, days: int = 30,
+              scenarios: Sequence[str] = tuple(SCENARIOS), threads: int = 16, duration: float = 10,
+              warmup: float = 2, reuse: bool = False) -> Dict:
+    """
+    Seed a database, serve it like `qr-tracker run --mode both` and measure each scenario in turn.
+
+    The public and admin applications are served by waitress in this process,
+    with the settings of config.toml, and requested by a client process over
+    HTTP. Statements executed by both applications during a scenario are
+    counted, including buffered impression writes flushed meanwhile. Logging
+    is raised to WARNING, see redirect_logging.py for its cost.
+
+    Args:
+        database_url: Database without codes, e.g. a local PostgreSQL; None for a temporary SQLite database
+        keys: Number of codes to seed
+        impressions: Number of impressions to seed
+        days: Age in days of the oldest seeded impression
+        scenarios: Names of the scenarios to run, see `SCENARIOS`
+        threads: Client threads, each with one keep-alive connection
+        duration: Measured seconds per scenario
+        warmup: Unmeasured seconds per scenario, filling the caches
+        reuse: Benchmark the codes of a database seeded by a previous run instead of requiring an empty one
+
+    Returns:
+        Dict: Settings, revision, seeding time and, per scenario, throughput, latency percentiles and statements per request
+    """
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        raise BenchError(f"Unknown scenarios: {', '.join(unknown)} (expected {', '.join(SCENARIOS)})")
+    if keys < 1 or impressions < 0 or days < 1 or threads < 1 or duration <= 0 or warmup < 0:
+        raise BenchError("keys, days, threads and duration must be positive, impressions and warmup not negative")
+
+    directory = None
+    if database_url is None:
+        directory = tempfile.mkdtemp(prefix="qr-tracker-bench-")
+        database_url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    environ = {name: os.environ.get(name) for name in ("DATABASE_URL", "SECRET_KEY")}
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("SECRET_KEY", "bench")
+    servers = []
+    try:
+        import logging
+
+        from src.server import create_app
+        from src.server_utils.db import Association
+        from src.server_utils.shared import db
+
+        public_app = create_app(mode="public")
+        admin_app = create_app(mode="admin")
+        logging.getLogger().setLevel(logging.WARNING)
+        # Requests queue for a free waitress thread whenever the clients outnumber them
+        logging.getLogger("waitress.queue").setLevel(logging.ERROR)
+        with public_app.app_context():
+            public_engine = db.engine
+        with admin_app.app_context():
+            admin_engine = db.engine
+
+        with admin_engine.connect() as connection:
+            existing = connection.execute(select(func.count()).select_from(Association)).scalar()
+        seed_seconds = None
+        if existing and not reuse:
+            raise BenchError(f"The database already holds {existing} codes; use an empty one, or reuse one seeded by a previous run")
+        if existing:
+            keys, impressions, days = existing, None, None
+        else:
+            started = time.perf_counter()
+            seed(admin_engine, keys, impressions, days)
+            seed_seconds = time.perf_counter() - started
+
+        counter = QueryCounter([public_engine, admin_engine])
+        ports = {}
+        for mode, app in (("public", public_app), ("admin", admin_app)):
+            server, ports[mode] = _start_server(app, mode)
+            servers.append(server)
+
+        results = {}
+        for name in scenarios:
+            mode, template = SCENARIOS[name]
+            if warmup:
+                _run_client(ports[mode], template, keys, threads, warmup)
+            counter.take()
+            timings, statuses, failures, elapsed = _run_client(ports[mode], template, keys, threads, duration)
+            queries = counter.take()
+            errors = failures + sum(count for status, count in statuses.items() if status >= 400)
+            results[name] = {
+                "requests": len(timings),
+                "errors": errors,
+                "statuses": {str(status): count for status, count in sorted(statuses.items())},
+                "requests_per_second": len(timings) / elapsed,
+                "p50_ms": percentile(timings, 0.5) * 1000,
+                "p95_ms": percentile(timings, 0.95) * 1000,
+                "p99_ms": percentile(timings, 0.99) * 1000,
+                "queries": queries,
+                "queries_per_request": queries / len(timings) if timings else None,
+            }
+
+        buffer = public_app.extensions.get("impression_buffer")
+        if buffer is not None:
+            buffer.stop()
+        return {
+            "revision": git_revision(),
+            "started": datetime.now().astimezone().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": {
+                "url": make_url(database_url).render_as_string(hide_password=True),
+                "backend": make_url(database_url).get_backend_name(),
+                "keys": keys,
+                "impressions": impressions,
+                "days": days,
+                "seed_seconds": seed_seconds,
+            },
+            "threads": threads,
+            "duration": duration,
+            "warmup": warmup,
+            "scenarios": results,
+        }
+    finally:
+        for server in servers:
+            server.close()
+        for name, value in environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def default_output(results: Dict) -> str:
+    """
+    Get the path results are saved to by default: benchmarks/results/<time>-<commit>.json.
+
+    Args:
+        results: Results of `run_suite`
+
+    Returns:
+        str: Path of the JSON file
+    """
+    revision = results["revision"]
+    commit = revision["commit"][:10] + ("-dirty" if revision["dirty"] else "") if revision else "unknown"
+    stamp = datetime.fromisoformat(results["started"]).strftime("%Y%m%d-%H%M%S")
+    return os.path.join(RESULTS_DIR, f"{stamp}-{commit}.json")
+
+
+def save_results(results: Dict, path: str) -> None:
+    """
+    Write results as JSON, creating the directory if needed.
+
+    Args:
+        results: Results of `run_suite`
+        path: Path of the JSON file
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+        file.write("\n")
+
+
+def summary(results: Dict, baseline: Optional[Dict] = None) -> List[str]:
+    """
+    Describe results in one line per scenario, with the change from a previous run when given.
+
+    Args:
+        results: Results of `run_suite`
+        baseline: Results of an earlier run, e.g. of another commit
+
+    Returns:
+        List[str]: Lines to print
+    """
+    database = results["database"]
+    lines = [f"{database['backend']}: {database['keys']} codes, "
+             + (f"{database['impressions']} impressions over {database['days']} days" if database["impressions"] is not None else "reused")
+             + f", {results['threads']} client threads"]
+    previous = (baseline or {}).get("scenarios", {})
+    for name, result in results["scenarios"].items():
+        queries = result["queries_per_request"]
+        line = (f"{name:>10}: {result['requests_per_second']:8.0f} req/s, p50 {result['p50_ms']:7.2f} ms, "
+                f"p95 {result['p95_ms']:7.2f} ms, p99 {result['p99_ms']:7.2f} ms, "
+                f"{queries if queries is not None else float('nan'):5.2f} queries/req, {result['errors']} errors")
+        before = previous.get(name)
+        if before:
+            def change(key: str) -> str:
+                return f"{(result[key] / before[key] - 1) * 100:+.1f}%" if before[key] else "n/a"
+
+            line += f" (req/s {change('requests_per_second')}, p99 {change('p99_ms')})"
+        lines.append(line)
+    return lines
+
+
+def main() -> None:
+    """
+    Seed a database, measure the redirect and stats endpoints and save the results as JSON.
+    """
+    parser = argparse.ArgumentParser(description="Throughput, latency and queries of the redirect and stats endpoints")
+    parser.add_argument("--database-url", default=None, help="Database without codes, e.g. a local PostgreSQL (default: temporary SQLite)")
+    parser.add_argument("--keys", type=int, default=1000, help="Number of codes to seed")
+    parser.add_argument("--impressions", type=int, default=100000, help="Number of impressions to seed")
+    parser.add_argument("--days", type=int, default=30, help="Age in days of the oldest impression")
+    parser.add_argument("--reuse", action="store_true", help="Benchmark a database seeded by a previous run")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios: " + ", ".join(SCENARIOS))
+    parser.add_argument("--threads", type=int, default=16, help="Client threads")
+    parser.add_argument("--duration", type=float, default=10, help="Measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2, help="Unmeasured seconds per scenario")
+    parser.add_argument("--output", default=None, help="JSON file for the results (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", default=None, help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    try:
+        results = run_suite(args.database_url, args.keys, args.impressions, args.days, args.scenarios.split(","),
+                            args.threads, args.duration, args.warmup, args.reuse)
+    except BenchError as e:
+        parser.error(str(e))
+    output = args.output or default_output(results)
+    save_results(results, output)
+    for line in summary(results, baseline):
+        print(line)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
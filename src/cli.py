@@ -1,3 +1,5 @@
+import csv
+import json
 import os
 import sys
 import threading
@@ -7,6 +9,9 @@ from dotenv import load_dotenv
 
 from src.server import create_app
 from src.server_utils.config import get_config
+from src.server_utils.retention import start_retention_sweeper
+from src.server_utils.serving import serve_app, serve_asgi
+from src.server_utils.workers import serve_workers
 
 load_dotenv()
 
@@ -24,9 +29,28 @@ def main():
 @click.option("--port", default=None, type=int, help="Port to bind to")
 @click.option("--debug/--no-debug", default=None, help="Enable/disable debug mode")
 @click.option("--mode", type=click.Choice(["public", "admin", "both"], case_sensitive=False), default="both", help="Server mode: public (redirect only), admin (management only), or both (default)")
-def run(host, port, debug, mode):
+@click.option("--threads", default=None, type=int, help="Waitress worker threads (overrides [server.<mode>] threads)")
+@click.option("--connection-limit", default=None, type=int, help="Maximum simultaneous connections (overrides [server.<mode>] connection_limit)")
+@click.option("--backlog", default=None, type=int, help="Listen socket backlog (overrides [server.<mode>] backlog)")
+@click.option("--channel-timeout", default=None, type=int, help="Seconds before an inactive connection is closed (overrides [server.<mode>] channel_timeout)")
+@click.option("--asyncore-loop-timeout", default=None, type=int, help="Seconds the waitress event loop waits for socket activity (overrides [server.<mode>] asyncore_loop_timeout)")
+@click.option("--asyncore-use-poll/--no-asyncore-use-poll", default=None, help="Use poll() instead of select() in the waitress event loop (overrides [server.<mode>] asyncore_use_poll)")
+@click.option("--workers", default=None, type=int, help="Worker processes for --mode public (overrides [server.public] workers)")
+@click.option("--asgi", is_flag=True, default=False, help="Serve --mode public with the async redirect app on uvicorn instead of Flask on waitress")
+@click.option("--pool-size", default=None, type=int, help="Database connections kept open (overrides [database.pool.<mode>] pool_size)")
+@click.option("--max-overflow", default=None, type=int, help="Database connections opened beyond the pool size under load (overrides [database.pool.<mode>] max_overflow)")
+@click.option("--pool-timeout", default=None, type=float, help="Seconds to wait for a free database connection (overrides [database.pool.<mode>] pool_timeout)")
+@click.option("--pool-recycle", default=None, type=int, help="Seconds after which database connections are replaced, -1 to never (overrides [database.pool.<mode>] pool_recycle)")
+@click.option("--pool-pre-ping/--no-pool-pre-ping", default=None, help="Check database connections before use (overrides [database.pool.<mode>] pool_pre_ping)")
+def run(host, port, debug, mode, threads, connection_limit, backlog, channel_timeout, asyncore_loop_timeout,
+        asyncore_use_poll, workers, asgi, pool_size, max_overflow, pool_timeout, pool_recycle, pool_pre_ping):
     """
     Run the QR code tracker server.
+
+    Waitress and connection pool options given on the command line apply to
+    every server started, i.e. to both the public and admin servers with
+    --mode both. Multiple worker processes are only supported for the public
+    server. Pool options have no effect on SQLite databases.
     """
     if "SECRET_KEY" not in os.environ:
         click.echo("Error: SECRET_KEY environment variable must be set", err=True)
@@ -42,6 +66,38 @@ def run(host, port, debug, mode):
         host = server_config["host"]
     if debug is None:
         debug = int(os.environ.get("FLASK_DEBUG", "1")) == 1
+    overrides = {
+        "threads": threads,
+        "connection_limit": connection_limit,
+        "backlog": backlog,
+        "channel_timeout": channel_timeout,
+        "asyncore_loop_timeout": asyncore_loop_timeout,
+        "asyncore_use_poll": asyncore_use_poll,
+    }
+    pool_overrides = {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+        "pool_recycle": pool_recycle,
+        "pool_pre_ping": pool_pre_ping,
+    }
+    if workers is None:
+        workers = server_config.get("public", {}).get("workers", 1) if mode == "public" else 1
+    if workers < 1:
+        click.echo("Error: --workers must be at least 1", err=True)
+        sys.exit(1)
+    if workers > 1 and mode != "public":
+        click.echo("Error: --workers is only supported with --mode public; run the admin server separately", err=True)
+        sys.exit(1)
+    if workers > 1 and debug:
+        click.echo("Error: --workers requires --no-debug (FLASK_DEBUG=0)", err=True)
+        sys.exit(1)
+    if asgi and mode != "public":
+        click.echo("Error: --asgi is only supported with --mode public", err=True)
+        sys.exit(1)
+    if asgi and any(value is not None for value in pool_overrides.values()):
+        click.echo("Error: pool options are not supported with --asgi; set them in [database.pool.public]", err=True)
+        sys.exit(1)
 
     if mode == "both":
         public_port = server_config.get("public_port", 8082)
@@ -51,20 +107,19 @@ def run(host, port, debug, mode):
             click.echo("Warning: --port option ignored when --mode=both. Using public_port and admin_port from config.", err=True)
         
         def run_public():
-            app_public = create_app(mode="public")
+            app_public = create_app(mode="public", debug=debug, pool_overrides=pool_overrides)
             if debug:
                 app_public.run(debug=False, host=host, port=public_port, use_reloader=False)
             else:
-                from waitress import serve
-                serve(app_public, host=host, port=public_port)
+                serve_app(app_public, host, public_port, "public", overrides)
         
         def run_admin():
-            app_admin = create_app(mode="admin")
+            app_admin = create_app(mode="admin", debug=debug, pool_overrides=pool_overrides)
+            start_retention_sweeper(app_admin)
             if debug:
                 app_admin.run(debug=debug, host=host, port=admin_port, use_reloader=False)
             else:
-                from waitress import serve
-                serve(app_admin, host=host, port=admin_port)
+                serve_app(app_admin, host, admin_port, "admin", overrides)
         
         click.echo(f"Starting public server on port {public_port}...")
         click.echo(f"Starting admin server on port {admin_port}...")
@@ -81,8 +136,18 @@ def run(host, port, debug, mode):
         except KeyboardInterrupt:
             click.echo("\nShutting down servers...")
             sys.exit(0)
+    elif asgi:
+        if port is None:
+            port = server_config.get("public_port", 8082)
+        serve_asgi(host, port, workers, overrides)
+    elif workers > 1:
+        if port is None:
+            port = server_config.get("public_port", 8082)
+        serve_workers(host, port, workers, overrides, pool_overrides)
     else:
-        app = create_app(mode=mode)
+        app = create_app(mode=mode, debug=debug, pool_overrides=pool_overrides)
+        if mode != "public":
+            start_retention_sweeper(app)
         
         if port is None:
             if mode == "public":
@@ -93,8 +158,176 @@ def run(host, port, debug, mode):
         if debug:
             app.run(debug=True, host=host, port=port)
         else:
-            from waitress import serve
-            serve(app, host=host, port=port)
+            serve_app(app, host, port, mode, overrides)
+
+
+@main.command()
+@click.argument("key")
+@click.option("--format", "export_format", type=click.Choice(["ndjson", "csv"], case_sensitive=False), default="ndjson", help="Output format")
+@click.option("--output", "-o", type=click.File("w"), default="-", help="File to write to (default: stdout)")
+@click.option("--from", "start", default=None, help="Inclusive ISO 8601 start of the range")
+@click.option("--to", "end", default=None, help="Exclusive ISO 8601 end of the range")
+@click.option("--page-size", default=10000, type=int, help="Number of impressions read from the database at a time")
+def export(key, export_format, output, start, end, page_size):
+    """
+    Export the raw impressions of a QR code as NDJSON or CSV.
+    """
+    if "DATABASE_URL" not in os.environ:
+        click.echo("Error: DATABASE_URL environment variable must be set", err=True)
+        sys.exit(1)
+
+    app = create_app(mode="admin")
+    from src.server_utils.db import Stats
+    from src.server_utils.export import iter_export
+    from src.server_utils.series import SeriesError, parse_timestamp
+
+    with app.app_context():
+        stats = Stats.query.filter_by(key=key).first()
+        if stats is None:
+            click.echo(f"Error: no QR code with key {key}", err=True)
+            sys.exit(1)
+        try:
+            start = parse_timestamp(start, None)
+            end = parse_timestamp(end, None)
+        except SeriesError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+
+        for chunk in iter_export(stats.id, export_format.lower(), start=start, end=end, page_size=page_size):
+            output.write(chunk)
+
+
+@main.command("bulk-create")
+@click.argument("input_file", type=click.File("r", encoding="utf-8-sig"))
+@click.option("--format", "data_format", type=click.Choice(["csv", "json"], case_sensitive=False), default=None, help="Input format (default: from the file extension)")
+@click.option("--output", "-o", type=click.File("w"), default="-", help="CSV file for the key -> stats URL mapping (default: stdout)")
+def bulk_create(input_file, data_format, output):
+    """
+    Create many QR codes from a CSV or JSON file.
+
+    Each code needs a url and may set key, password and QR style options.
+    """
+    if "DATABASE_URL" not in os.environ:
+        click.echo("Error: DATABASE_URL environment variable must be set", err=True)
+        sys.exit(1)
+
+    if data_format is None:
+        data_format = "json" if input_file.name.lower().endswith(".json") else "csv"
+
+    app = create_app(mode="admin")
+    from flask import url_for
+    from src.server_utils.provisioning import ProvisioningError, bulk_create, parse_items
+
+    with app.test_request_context():
+        try:
+            items = parse_items(input_file.read(), data_format.lower())
+            created = bulk_create(items, lambda key: url_for("admin.stats", id=key))
+        except ProvisioningError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+
+    writer = csv.writer(output)
+    writer.writerow(["key", "url", "stats_url"])
+    for code in created:
+        writer.writerow([code["key"], code["url"], code["stats_url"]])
+    click.echo(f"Created {len(created)} QR codes", err=True)
+
+
+@main.command("render")
+@click.argument("keys", nargs=-1)
+@click.option("--filter", "search", default=None, help="Render the codes whose key or URL contains this text")
+@click.option("--all", "all_codes", is_flag=True, default=False, help="Render every code")
+@click.option("--format", "image_format", type=click.Choice(["png", "svg", "pdf"], case_sensitive=False), default="png", help="Image format of the ZIP archive entries")
+@click.option("--sheet", is_flag=True, default=False, help="Write a PDF print sheet with a grid of codes per page instead of a ZIP archive")
+@click.option("--columns", default=3, type=int, help="Codes per row of a print sheet")
+@click.option("--rows", default=4, type=int, help="Rows per page of a print sheet")
+@click.option("--page-size", type=click.Choice(["a4", "letter"], case_sensitive=False), default="a4", help="Page size of a print sheet")
+@click.option("--workers", default=None, type=int, help="Render processes (overrides [render] workers)")
+@click.option("--base-url", default=None, help="Public base URL the codes point to (default: BASE_URL environment variable)")
+@click.option("--output", "-o", type=click.File("wb"), default="-", help="File to write to (default: stdout)")
+def render(keys, search, all_codes, image_format, sheet, columns, rows, page_size, workers, base_url, output):
+    """
+    Render the QR codes of many keys into a ZIP archive or a PDF print sheet.
+
+    Select codes by KEYS, --filter or --all. Images are rendered in parallel
+    and written as they complete, reusing the image cache of the server.
+    """
+    if "DATABASE_URL" not in os.environ:
+        click.echo("Error: DATABASE_URL environment variable must be set", err=True)
+        sys.exit(1)
+    base_url = (base_url or os.environ.get("BASE_URL", "")).strip().rstrip("/")
+    if not base_url:
+        click.echo("Error: --base-url or the BASE_URL environment variable must be set", err=True)
+        sys.exit(1)
+    if not keys and search is None and not all_codes:
+        click.echo("Error: give keys, --filter or --all", err=True)
+        sys.exit(1)
+
+    app = create_app(mode="admin")
+    from src.server_utils.batch import BatchError, render_batch
+
+    with app.app_context():
+        try:
+            chunks = render_batch(
+                f"{base_url}/qr/", keys=list(keys) or None, search=search or None,
+                image_format=image_format.lower(), layout="sheet" if sheet else "zip",
+                columns=columns, rows=rows, page_size=page_size.lower(), workers=workers,
+            )
+        except (BatchError, RuntimeError) as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+
+        for chunk in chunks:
+            output.write(chunk)
+
+
+@main.command()
+@click.option("--database-url", default=None, help="Database without codes to seed, e.g. a local PostgreSQL (default: a temporary SQLite database)")
+@click.option("--keys", default=1000, type=int, help="Number of codes to seed")
+@click.option("--impressions", default=100000, type=int, help="Number of impressions to seed, spread over the codes")
+@click.option("--days", default=30, type=int, help="Age in days of the oldest seeded impression")
+@click.option("--reuse", is_flag=True, default=False, help="Benchmark the codes of a database seeded by a previous run")
+@click.option("--scenario", "scenarios", multiple=True, type=click.Choice(["redirect", "stats", "stats-data"]), help="Scenario to run, repeatable (default: all)")
+@click.option("--threads", default=16, type=int, help="Client threads, each with one keep-alive connection")
+@click.option("--duration", default=10, type=float, help="Measured seconds per scenario")
+@click.option("--warmup", default=2, type=float, help="Unmeasured seconds per scenario")
+@click.option("--output", "-o", default=None, type=click.Path(dir_okay=False), help="JSON file for the results (default: benchmarks/results/<time>-<commit>.json)")
+@click.option("--compare", default=None, type=click.File("r"), help="JSON results of an earlier run to compare with")
+def bench(database_url, keys, impressions, days, reuse, scenarios, threads, duration, warmup, output, compare):
+    """
+    Benchmark the redirect and stats endpoints against synthetic data.
+
+    Seeds codes and impressions, serves them like --mode both with the
+    settings of config.toml and requests /qr/<id>, /qr/<id>/stats and
+    /qr/<id>/stats/data of random codes from a local client. Prints the
+    throughput, p50/p95/p99 latencies and SQL statements per request, and
+    saves them as JSON with the current commit so runs can be compared.
+    Requires a source checkout, which contains the benchmarks.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    try:
+        from benchmarks.suite import SCENARIOS, BenchError, default_output, run_suite, save_results, summary
+    except ImportError:
+        click.echo("Error: the benchmarks are only available from a source checkout", err=True)
+        sys.exit(1)
+
+    baseline = json.load(compare) if compare is not None else None
+    click.echo(f"Seeding {keys} codes and {impressions} impressions..." if not reuse else "Benchmarking the seeded database...")
+    try:
+        results = run_suite(database_url, keys=keys, impressions=impressions, days=days,
+                            scenarios=list(scenarios) or list(SCENARIOS), threads=threads,
+                            duration=duration, warmup=warmup, reuse=reuse)
+    except BenchError as e:
+        click.echo(f"Error: {e}", err=True)
+        sys.exit(1)
+
+    output = output or default_output(results)
+    save_results(results, output)
+    for line in summary(results, baseline):
+        click.echo(line)
+    click.echo(f"Results saved to {output}")
 
 
 @main.group()
@@ -162,5 +395,52 @@ def upgrade():
         click.echo(f"Applied migrations for {db_type}")
 
 
+@db.command("backfill-rollups")
+@click.option("--batch-size", default=10000, type=int, help="Number of impressions read from the database at a time")
+@click.option("--all", "rebuild_all", is_flag=True, default=False, help="Rebuild from all raw impressions, even with a retention period (drops the counters of removed impressions)")
+def backfill_rollups(batch_size, rebuild_all):
+    """
+    Rebuild the hourly/daily impression rollups from the impressions table.
+
+    With a [retention] raw_impression_days period, only the months whose raw
+    impressions are still kept are rebuilt, unless --all is given or expired
+    impressions are archived ([retention] action = "archive").
+    """
+    load_dotenv()
+    if "DATABASE_URL" not in os.environ:
+        click.echo("Error: DATABASE_URL environment variable must be set", err=True)
+        sys.exit(1)
+
+    app = create_app()
+    from src.server_utils.retention import raw_retention_start, retention_action
+    from src.server_utils.rollups import backfill_rollups
+
+    since = None if rebuild_all or retention_action() == "archive" else raw_retention_start()
+    with app.app_context():
+        processed = backfill_rollups(batch_size=batch_size, since=since)
+        click.echo(f"Rebuilt rollups from {processed} impressions" + (f" since {since}" if since else ""))
+
+
+@db.command("sweep-impressions")
+def sweep_impressions():
+    """
+    Create upcoming impression partitions and drop or archive raw impressions past [retention] raw_impression_days.
+
+    The admin server runs this every [retention] sweep_interval_minutes.
+    """
+    load_dotenv()
+    if "DATABASE_URL" not in os.environ:
+        click.echo("Error: DATABASE_URL environment variable must be set", err=True)
+        sys.exit(1)
+
+    app = create_app(mode="admin")
+    from src.server_utils.retention import sweep_impressions
+
+    with app.app_context():
+        result = sweep_impressions()
+    click.echo(f"Created {len(result['created'])} partitions, dropped {len(result['dropped'])} partitions, "
+               f"deleted {result['deleted']} impressions, archived {result['archived']} impressions")
+
+
 if __name__ == "__main__":
     main()
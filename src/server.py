@@ -1,61 +1,35 @@
 import logging
 import os
-from logging.config import dictConfig
 
 from dotenv import load_dotenv
-from flask import Flask, request, session
+from flask import Flask
 from flask_migrate import Migrate, init, migrate, upgrade
+from sqlalchemy.engine import make_url
 
 from src.server_utils.config import get_config
 from src.server_utils.home import home_pages, public_pages, admin_pages
+from src.server_utils.logs import configure_logging, log_requests
+from src.server_utils.partitions import ensure_partitions
+from src.server_utils.pool import TimedQueuePool, pool_options
 
 load_dotenv()
 
 config = get_config()
 log_config = config["logging"]
 
-dictConfig(
-    {
-        "version": 1,
-        "formatters": {
-            "default": {
-                "format": log_config["format"],
-                "datefmt": log_config["date_format"],
-            },
-        },
-        "handlers": {
-            "console": {
-                "class": "logging.StreamHandler",
-                "formatter": "default",
-            },
-            "file": {
-                "class": "logging.FileHandler",
-                "filename": log_config["filename"],
-                "formatter": "default",
-            },
-        },
-        "root": {"level": log_config["level"], "handlers": ["console", "file"]},
-    }
-)
-
-
-def create_app(mode="both"):
+configure_logging(log_config)
+
+
+def resolve_database_url(database_url):
     """
-    Create and configure the Flask application.
+    Make a relative SQLite database path absolute and create its directory.
     
     Args:
-        mode: Server mode - "public" (only redirect endpoint), "admin" (only management endpoints), or "both" (all endpoints, default for backward compatibility)
+        database_url: Database URL, typically the DATABASE_URL environment variable
     
     Returns:
-        Flask: Configured Flask application instance
+        str: Database URL to connect to
     """
-    assert "SECRET_KEY" in os.environ
-
-    app = Flask(__name__)
-
-    app.config['DEBUG'] = True
-    database_url = os.environ.get('DATABASE_URL')
-    
     if database_url and database_url.startswith('sqlite:///'):
         db_path = database_url.replace('sqlite:///', '')
         if not os.path.isabs(db_path):
@@ -65,18 +39,87 @@ def create_app(mode="both"):
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)
         database_url = f'sqlite:///{db_path}'
+    return database_url
+
+
+def configure_sqlite(app):
+    """
+    Apply the `[database.sqlite]` profile to the SQLite engine of an application.
+    
+    Must be called in an application context before the engine is first used.
+    
+    Args:
+        app: Flask application using a SQLite database
+    """
+    from sqlalchemy import create_engine
+
+    from src.server_utils.shared import db
+    from src.server_utils.sqlite import SQLiteWriter, apply_sqlite_profile, sqlite_pragmas
+
+    sqlite_config = config.get("database", {}).get("sqlite", {})
+    if not sqlite_config.get("profile", True):
+        return
+
+    apply_sqlite_profile(db.engine, sqlite_config)
+    if sqlite_config.get("single_writer", True):
+        if db.engine.url.database in (None, "", ":memory:"):
+            # An in-memory database is private to its connection, so it cannot have a writer of its own
+            logging.warning("SQLite single_writer is not supported for in-memory databases")
+        elif str(sqlite_pragmas(sqlite_config)["journal_mode"]).lower() == "wal":
+            write_engine = create_engine(db.engine.url, pool_size=1, max_overflow=0)
+            apply_sqlite_profile(write_engine, sqlite_config, immediate=True)
+            app.extensions["sqlite_writer"] = SQLiteWriter(app, write_engine)
+        else:
+            # Outside WAL, readers block the writer thread while waiting on it
+            logging.warning("SQLite single_writer requires journal_mode = \"wal\", writing from request threads")
+    logging.info(f"Applied SQLite profile: {sqlite_pragmas(sqlite_config)}")
+
+
+def create_app(mode="both", debug=False, pool_overrides=None):
+    """
+    Create and configure the Flask application.
     
-    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    Args:
+        mode: Server mode - "public" (only redirect endpoint), "admin" (only management endpoints), or "both" (all endpoints, default for backward compatibility)
+        debug: Enable Flask debug mode
+        pool_overrides: Connection pool option name to value mapping overriding config.toml
+    
+    Returns:
+        Flask: Configured Flask application instance
+    """
+    assert "SECRET_KEY" in os.environ
+
+    app = Flask(__name__)
+
+    app.config['DEBUG'] = debug
+    app.config['SQLALCHEMY_DATABASE_URI'] = resolve_database_url(os.environ.get('DATABASE_URL'))
+    if make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name() != "sqlite":
+        # SQLite is configured by its profile instead, see configure_sqlite
+        pool_mode = "public" if mode == "public" else "admin"
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            "poolclass": TimedQueuePool,
+            **pool_options(pool_mode, pool_overrides),
+        }
     app.config["SECRET_KEY"] = os.environ.get('SECRET_KEY', 'dev')
 
     from src.server_utils.shared import db
 
     db.init_app(app)
     with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            configure_sqlite(app)
         db.create_all()
+        ensure_partitions(db.engine)
 
     migrate = Migrate(app, db)
 
+    if mode != "admin" and config.get("impressions", {}).get("buffered", False):
+        from src.server_utils.impressions import ImpressionBuffer
+
+        impression_buffer = ImpressionBuffer.from_config(app)
+        impression_buffer.start()
+        app.extensions["impression_buffer"] = impression_buffer
+
     if mode == "public":
         app.register_blueprint(public_pages)
     elif mode == "admin":
@@ -91,7 +134,8 @@ if __name__ == '__main__':
     assert "FLASK_DEBUG" in os.environ
 
     mode = os.environ.get("SERVER_MODE", "both")
-    app = create_app(mode=mode)
+    debug = bool(int(os.environ.get("FLASK_DEBUG", "1")))
+    app = create_app(mode=mode, debug=debug)
 
     if "MIGRATE_CMD" in os.environ:
         command = os.environ["MIGRATE_CMD"]
@@ -111,35 +155,7 @@ if __name__ == '__main__':
             else:
                 raise ValueError(f"Unknown migration command: {command}")
 
-    @app.before_request
-    def log_before_request():
-        """
-        Log request details before processing.
-        """
-        app.logger.info(
-            f"path: {request.path} | method: {request.method} | session: {session}"
-        )
-
-    @app.after_request
-    def log_after_request(response):
-        """
-        Log response details after processing.
-        
-        Args:
-            response: Flask response object
-            
-        Returns:
-            Response: The response object
-        """
-        app.logger.info(
-            f"path: {request.path} | "
-            f"method: {request.method} | "
-            f"status: {response.status} | "
-            f"size:{response.content_length} | "
-            f"session: {session}",
-        )
-
-        return response
+    log_requests(app)
 
     server_config = config["server"]
     if mode == "public":
@@ -149,8 +165,12 @@ if __name__ == '__main__':
     else:
         port = server_config.get("admin_port", 6063)
     
-    if int(os.environ.get("FLASK_DEBUG", "1")):
+    if mode != "public":
+        from src.server_utils.retention import start_retention_sweeper
+        start_retention_sweeper(app)
+
+    if debug:
         app.run(debug=True, host=server_config["host"], port=port)
     else:
-        from waitress import serve
-        serve(app, host=server_config["host"], port=port)
+        from src.server_utils.serving import serve_app
+        serve_app(app, server_config["host"], port, "public" if mode == "public" else "admin")
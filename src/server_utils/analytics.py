@@ -0,0 +1,322 @@
+import itertools
+from datetime import datetime, timedelta, tzinfo
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import BigInteger, cast, func, select
+
+from src.server_utils.archive import EPOCH, archive_path, from_epoch, to_epoch
+from src.server_utils.partitions import impression_partitions
+from src.server_utils.shared import db
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MINUTE = 60 * 1000 * 1000
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# Without an explicit start, analytics cover the last 30 days
+DEFAULT_RANGE = timedelta(days=30)
+
+# 1970-01-01 was a Thursday; weekdays are numbered from Monday = 0
+EPOCH_WEEKDAY = 3
+
+# Counting resolution, in minutes dividing an hour: the finest one giving at most MAX_BUCKETS buckets is used
+RESOLUTIONS = (1, 2, 3, 4, 5, 6, 10, 12, 15, 20, 30, 60)
+MAX_BUCKETS = 100000
+
+# Maximum number of points of the rolling rate series, which is sampled for long ranges
+MAX_RATE_POINTS = 1000
+
+
+class AnalyticsError(ValueError):
+    """
+    Raised when analytics parameters are invalid.
+    """
+
+
+def require_numpy() -> None:
+    """
+    Check that the optional NumPy dependency is installed.
+
+    Raises:
+        RuntimeError: If NumPy is missing
+    """
+    if np is None:
+        raise RuntimeError("Analytics require NumPy, install the 'analytics' extra: pip install 'qr-code-tracker[analytics]'")
+
+
+def _epoch_expression(column, dialect_name: str):
+    """
+    Build a SQL expression converting a naive timestamp column to `to_epoch` microseconds.
+    """
+    if dialect_name == "postgresql":
+        # Timestamps without time zone are converted as if they were UTC, like to_epoch
+        return cast(func.extract("epoch", column) * 1000000, BigInteger)
+    # julianday is exact to a few dozen microseconds over the supported range
+    return cast(func.round((func.julianday(column) - 2440587.5) * 86400000000), BigInteger)
+
+
+def _archived_epochs(stats_id: int, start: int, end: int) -> "np.ndarray":
+    """
+    Memory-map the archived timestamps of a key within [start, end) without copying them.
+    """
+    try:
+        archived = np.load(archive_path(stats_id), mmap_mode="r")
+    except FileNotFoundError:
+        return np.empty(0, dtype=np.int64)
+    lower, upper = np.searchsorted(archived, [start, end])
+    return archived[lower:upper]
+
+
+def load_epochs(stats_ids: Sequence[int], start: datetime, end: datetime) -> Dict[int, List["np.ndarray"]]:
+    """
+    Load the impression timestamps of some keys as sorted int64 `to_epoch` arrays.
+
+    Archived impressions are memory-mapped from the archive files, and live
+    impressions of all keys are read in one query per partition covering the
+    range. Each key gets one sorted array per source; the sources never
+    overlap in time.
+
+    Args:
+        stats_ids: Stats rows to load
+        start: Inclusive naive server-local start
+        end: Exclusive naive server-local end
+
+    Returns:
+        Dict[int, List[np.ndarray]]: Arrays of each stats row
+    """
+    require_numpy()
+    lower, upper = to_epoch(start), to_epoch(end)
+    sources = {stats_id: [_archived_epochs(stats_id, lower, upper)] for stats_id in stats_ids}
+
+    with db.engine.connect() as connection:
+        dialect_name = connection.dialect.name
+        for partition in impression_partitions(connection, start, end):
+            table = partition.table
+            query = select(table.c.stats_id, _epoch_expression(table.c.datetime, dialect_name)).where(
+                table.c.stats_id.in_(list(stats_ids)), table.c.datetime >= start, table.c.datetime < end,
+            )
+            # Flattened, as np.array probes every Row for the array protocol, which costs
+            # several failed attribute lookups per row
+            rows = np.fromiter(itertools.chain.from_iterable(connection.execute(query)), dtype=np.int64).reshape(-1, 2)
+            # Sort by key, then time, and split into one array per key
+            rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+            ids, boundaries = np.unique(rows[:, 0], return_index=True)
+            for stats_id, values in zip(ids.tolist(), np.split(rows[:, 1], boundaries[1:])):
+                sources[stats_id].append(values)
+    return sources
+
+
+def bucket_counts(sources: Sequence["np.ndarray"], start: int, step: int, buckets: int) -> "np.ndarray":
+    """
+    Count impressions per fixed-size bucket from sorted timestamp arrays.
+
+    Bucket boundaries are located with binary searches, so the cost grows with
+    the number of buckets rather than the number of impressions, and only the
+    pages of memory-mapped arrays around each boundary are read.
+
+    Args:
+        sources: Sorted `to_epoch` arrays
+        start: `to_epoch` start of the first bucket
+        step: Bucket length in microseconds
+        buckets: Number of buckets
+
+    Returns:
+        np.ndarray: int64 count of each bucket
+    """
+    edges = start + step * np.arange(buckets + 1, dtype=np.int64)
+    counts = np.zeros(buckets, dtype=np.int64)
+    for values in sources:
+        if len(values):
+            counts += np.diff(np.searchsorted(values, edges))
+    return counts
+
+
+def _count_between(sources: Sequence["np.ndarray"], start: int, end: int) -> int:
+    """
+    Count the timestamps in [start, end) of sorted arrays.
+    """
+    return int(sum(np.searchsorted(values, end) - np.searchsorted(values, start) for values in sources))
+
+
+def _utc_offset_hours(hour: int, tz: tzinfo) -> int:
+    """
+    Get the offset of `tz` from server time at a `to_epoch` hour, rounded down to whole hours.
+    """
+    server = from_epoch(hour * HOUR)
+    return int((server.astimezone(tz).replace(tzinfo=None) - server).total_seconds() // 3600)
+
+
+def _hour_of_week(start: int, hours: int, tz: Optional[tzinfo]) -> "np.ndarray":
+    """
+    Get the weekday * 24 + hour index of consecutive server-local hours.
+
+    With a time zone, offsets are looked up once per day, and for every hour
+    of the days where they change, so daylight saving changes are followed;
+    offsets that are not whole hours are rounded down to the hour, as for the
+    stats data API.
+    """
+    absolute = start // HOUR + np.arange(hours, dtype=np.int64)
+    if tz is not None:
+        first = int(absolute[0]) if hours else 0
+        days = np.array([_utc_offset_hours(first + day * 24, tz) for day in range(hours // 24 + 2)], dtype=np.int64)
+        offsets = np.repeat(days[:-1], 24)[:hours]
+        for day in np.flatnonzero(days[1:] != days[:-1]).tolist():
+            for hour in range(day * 24, min(day * 24 + 24, hours)):
+                offsets[hour] = _utc_offset_hours(first + hour, tz)
+        absolute = absolute + offsets
+    weekday = (absolute // 24 + EPOCH_WEEKDAY) % 7
+    return weekday * 24 + absolute % 24
+
+
+def _top_windows(sums: "np.ndarray", width: int, count: int) -> List[int]:
+    """
+    Pick the start indexes of up to `count` non-overlapping windows with the largest sums.
+    """
+    sums = sums.astype(np.float64)
+    starts = []
+    for _ in range(count):
+        index = int(np.argmax(sums)) if len(sums) else 0
+        if not len(sums) or sums[index] <= 0:
+            break
+        starts.append(index)
+        sums[max(0, index - width + 1):index + width] = -1
+    return starts
+
+
+def _format(value: datetime, tz: Optional[tzinfo]) -> str:
+    """
+    Format a naive server-local timestamp, converted to `tz` if given.
+    """
+    return (value.astimezone(tz) if tz is not None else value).isoformat()
+
+
+def analyze(sources: Dict[int, Sequence["np.ndarray"]], start: datetime, end: datetime,
+            window_hours: int = 24, peak_minutes: int = 60, peaks: int = 3, period_days: int = 7,
+            tz: Optional[tzinfo] = None) -> Dict[int, Dict]:
+    """
+    Compute scan analytics of one or more keys over a range.
+
+    The range is widened to whole hours. Impressions of every key are counted
+    per bucket of `resolution_minutes` (see `bucket_counts`): one minute, or
+    the finest divisor of an hour keeping at most MAX_BUCKETS buckets for long
+    ranges. All further results are derived from that (keys x buckets) matrix
+    with array operations:
+
+    - heatmap: scans per weekday (Monday first) and hour, with weekday and hour totals
+    - rolling_rate: scans per hour averaged over the preceding `window_hours`,
+      at each hour, or at evenly spaced hours for ranges of over MAX_RATE_POINTS hours
+    - peaks: the busiest non-overlapping windows of `peak_minutes`, rounded to the resolution
+    - growth: scans in the last `period_days` before `end` compared to the period before
+
+    Args:
+        sources: Sorted `to_epoch` arrays of each stats row, see `load_epochs`
+        start: Inclusive naive server-local start
+        end: Exclusive naive server-local end
+        window_hours: Length of the rolling rate window
+        peak_minutes: Length of the peak windows
+        peaks: Maximum number of peak windows
+        period_days: Length of the growth periods
+        tz: Time zone of heatmap hours and returned timestamps, or None for server time
+
+    Returns:
+        Dict[int, Dict]: JSON serializable analytics of each stats row
+    """
+    require_numpy()
+    if start >= end:
+        raise AnalyticsError("'from' must be before 'to'")
+    if min(window_hours, peak_minutes, period_days) < 1 or peaks < 0:
+        raise AnalyticsError("Window, peak and period lengths must be positive")
+
+    lower = to_epoch(start) // HOUR * HOUR
+    upper = -(-to_epoch(end) // HOUR) * HOUR
+    hours = (upper - lower) // HOUR
+    stats_ids = list(sources)
+
+    resolution = next((minutes for minutes in RESOLUTIONS if hours * 60 // minutes <= MAX_BUCKETS), 60)
+    per_hour = 60 // resolution
+    counts = np.stack([bucket_counts(sources[stats_id], lower, resolution * MINUTE, hours * per_hour) for stats_id in stats_ids]) \
+        if stats_ids else np.zeros((0, hours * per_hour), dtype=np.int64)
+    hourly = counts.reshape(len(stats_ids), hours, per_hour).sum(axis=2)
+
+    # One bincount over (key, hour of week) pairs builds every key's heatmap
+    slots = np.arange(len(stats_ids), dtype=np.int64)[:, None] * 168 + _hour_of_week(lower, hours, tz)[None, :]
+    heatmaps = np.bincount(slots.ravel(), weights=hourly.ravel(), minlength=len(stats_ids) * 168) \
+        .astype(np.int64).reshape(len(stats_ids), 7, 24)
+
+    hourly_totals = np.concatenate([np.zeros((len(stats_ids), 1), dtype=np.int64), hourly.cumsum(axis=1)], axis=1)
+    rate_indexes = np.arange(window_hours, hours + 1, max(1, -(-(hours - window_hours + 1) // MAX_RATE_POINTS)))
+    rates = (hourly_totals[:, rate_indexes] - hourly_totals[:, rate_indexes - window_hours]) / window_hours
+    rate_ends = [from_epoch(lower + int(index) * HOUR) for index in rate_indexes]
+
+    peak_width = max(1, round(peak_minutes / resolution))
+    bucket_totals = np.concatenate([np.zeros((len(stats_ids), 1), dtype=np.int64), counts.cumsum(axis=1)], axis=1)
+    window_sums = bucket_totals[:, peak_width:] - bucket_totals[:, :-peak_width] \
+        if counts.shape[1] >= peak_width else np.zeros((len(stats_ids), 0), dtype=np.int64)
+
+    period = period_days * DAY
+    growth_end = to_epoch(end)
+
+    results = {}
+    for row, stats_id in enumerate(stats_ids):
+        current = _count_between(sources[stats_id], growth_end - period, growth_end)
+        previous = _count_between(sources[stats_id], growth_end - 2 * period, growth_end - period)
+        results[stats_id] = {
+            "from": _format(from_epoch(lower), tz),
+            "to": _format(from_epoch(upper), tz),
+            "count": int(hourly_totals[row, -1]),
+            "resolution_minutes": resolution,
+            "heatmap": {
+                "counts": heatmaps[row].tolist(),
+                "weekdays": heatmaps[row].sum(axis=1).tolist(),
+                "hours": heatmaps[row].sum(axis=0).tolist(),
+            },
+            "rolling_rate": {
+                "window_hours": window_hours,
+                "series": [
+                    {"bucket_end": _format(bucket_end, tz), "rate": float(rate)}
+                    for bucket_end, rate in zip(rate_ends, rates[row])
+                ],
+            },
+            "peaks": [
+                {
+                    "start": _format(from_epoch(lower + index * resolution * MINUTE), tz),
+                    "end": _format(from_epoch(lower + (index + peak_width) * resolution * MINUTE), tz),
+                    "count": int(window_sums[row, index]),
+                }
+                for index in _top_windows(window_sums[row], peak_width, peaks)
+            ],
+            "growth": {
+                "period_days": period_days,
+                "current": current,
+                "previous": previous,
+                "change": (current - previous) / previous if previous else None,
+            },
+        }
+    return results
+
+
+def key_analytics(stats_ids: Sequence[int], start: Optional[datetime] = None, end: Optional[datetime] = None,
+                  period_days: int = 7, **options) -> Dict[int, Dict]:
+    """
+    Load impressions and compute analytics of one or more keys, see `analyze`.
+
+    Args:
+        stats_ids: Stats rows to analyze
+        start: Inclusive naive server-local start, defaults to 30 days before `end`
+        end: Exclusive naive server-local end, defaults to now
+        period_days: Length of the growth periods
+        **options: Other keyword arguments of `analyze`
+
+    Returns:
+        Dict[int, Dict]: JSON serializable analytics of each stats row
+    """
+    end = end or datetime.now()
+    start = start or end - DEFAULT_RANGE
+    # Growth compares the two periods before `end`, which may start before the range
+    loaded_start = min(start, end - timedelta(days=2 * period_days), end)
+    sources = load_epochs(stats_ids, max(loaded_start, EPOCH), end)
+    return analyze(sources, start, end, period_days=period_days, **options)
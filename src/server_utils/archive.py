@@ -0,0 +1,314 @@
+import ast
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from src.server_utils.config import get_config
+from src.server_utils.partitions import Partition
+from src.server_utils.shared import db
+
+config = get_config()
+archive_config = config.get("archive", {})
+
+# Archived timestamps are naive server-local times stored as microseconds since this instant
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# .npy format version 1.0, see numpy.lib.format
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+NPY_DESCR = "<i8"
+
+# Serializes archive file replacement within a process (sweeps, resets and deletes)
+_lock = threading.Lock()
+
+
+def archive_directory() -> str:
+    """
+    Get the directory holding the archive files, from `[archive] directory`.
+
+    Relative paths are resolved from the project root, like SQLite database paths.
+
+    Returns:
+        str: Absolute directory path
+    """
+    directory = archive_config.get("directory", "data/archive")
+    if not os.path.isabs(directory):
+        directory = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), directory)
+    return directory
+
+
+def archive_path(stats_id: int) -> str:
+    """
+    Get the archive file of a key.
+
+    Args:
+        stats_id: Stats row of the key
+
+    Returns:
+        str: Path of its .npy file, which may not exist
+    """
+    return os.path.join(archive_directory(), f"{stats_id}.npy")
+
+
+def to_epoch(when: datetime) -> int:
+    """
+    Encode a naive timestamp as archived.
+
+    Args:
+        when: Naive server-local timestamp
+
+    Returns:
+        int: Microseconds since EPOCH
+    """
+    return (when - EPOCH) // MICROSECOND
+
+
+def from_epoch(value: int) -> datetime:
+    """
+    Decode an archived timestamp.
+
+    Args:
+        value: Microseconds since EPOCH
+
+    Returns:
+        datetime: Naive server-local timestamp
+    """
+    return EPOCH + timedelta(microseconds=value)
+
+
+def _npy_header(count: int) -> bytes:
+    """
+    Build the .npy header of a one-dimensional little-endian int64 array.
+    """
+    header = f"{{'descr': '{NPY_DESCR}', 'fortran_order': False, 'shape': ({count},), }}"
+    # Magic, version and length take 10 bytes; the data starts 64-byte aligned
+    padding = -(len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + " " * padding + "\n").encode("latin-1")
+    return NPY_MAGIC + struct.pack("<H", len(header)) + header
+
+
+class ArchiveFile:
+    """
+    Read-only, memory-mapped view of the sorted timestamps archived for a key.
+
+    The file is a standard .npy array of int64 microseconds (see `to_epoch`)
+    in ascending order, so a time range is located with two binary searches
+    and only the pages it covers are read from disk. Use as a context manager.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Open and map an archive file.
+
+        Args:
+            path: Path of the .npy file
+        """
+        self._file = open(path, "rb")
+        prefix = self._file.read(len(NPY_MAGIC) + 2)
+        if prefix[:len(NPY_MAGIC)] != NPY_MAGIC:
+            self._file.close()
+            raise ValueError(f"Not a version 1.0 .npy file: {path}")
+        header_length = struct.unpack("<H", prefix[len(NPY_MAGIC):])[0]
+        header = ast.literal_eval(self._file.read(header_length).decode("latin-1"))
+        if header["descr"] != NPY_DESCR or len(header["shape"]) != 1:
+            self._file.close()
+            raise ValueError(f"Unexpected archive array {header} in {path}")
+        offset = len(prefix) + header_length
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        data = memoryview(self._mmap)[offset:offset + header["shape"][0] * 8]
+        if sys.byteorder == "little":
+            self.values = data.cast("q")
+        else:
+            self.values = array("q", data.tobytes())
+            self.values.byteswap()
+            data.release()
+
+    def __enter__(self) -> "ArchiveFile":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def range(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[int, int]:
+        """
+        Locate the timestamps in [start, end) with binary searches.
+
+        Args:
+            start: Inclusive naive server-local start, or None
+            end: Exclusive naive server-local end, or None
+
+        Returns:
+            Tuple[int, int]: Start and end indexes of the range in `values`
+        """
+        lower = bisect_left(self.values, to_epoch(start)) if start is not None else 0
+        upper = bisect_left(self.values, to_epoch(end), lower) if end is not None else len(self.values)
+        return lower, upper
+
+    def close(self) -> None:
+        """
+        Unmap and close the file.
+        """
+        if isinstance(self.values, memoryview):
+            self.values.release()
+        self._mmap.close()
+        self._file.close()
+
+
+def open_archive(stats_id: int) -> Optional[ArchiveFile]:
+    """
+    Open the archive of a key.
+
+    Args:
+        stats_id: Stats row of the key
+
+    Returns:
+        Optional[ArchiveFile]: The mapped archive, or None if nothing is archived for the key
+    """
+    try:
+        return ArchiveFile(archive_path(stats_id))
+    except FileNotFoundError:
+        return None
+
+
+def iter_archive_pages(stats_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                       page_size: int = 10000) -> Iterator[List[datetime]]:
+    """
+    Read the archived timestamps of a key in [start, end), oldest first, one page at a time.
+
+    Args:
+        stats_id: Stats row of the key
+        start: Inclusive naive server-local start, or None
+        end: Exclusive naive server-local end, or None
+        page_size: Maximum number of timestamps per page
+
+    Yields:
+        List[datetime]: Timestamps of one page
+    """
+    archive = open_archive(stats_id)
+    if archive is None:
+        return
+    with archive:
+        lower, upper = archive.range(start, end)
+        for page_start in range(lower, upper, page_size):
+            yield [from_epoch(value) for value in archive.values[page_start:min(page_start + page_size, upper)]]
+
+
+def _write_archive(stats_id: int, values: array) -> None:
+    """
+    Atomically replace the archive of a key, removing it if there are no values.
+
+    Readers that mapped the previous file keep reading it until they close it.
+    """
+    path = archive_path(stats_id)
+    if not values:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return
+    if sys.byteorder != "little":
+        values = array("q", values)
+        values.byteswap()
+    directory = archive_directory()
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix=".npy.tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_npy_header(len(values)))
+            values.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def replace_archive_range(stats_id: int, lower: datetime, upper: datetime, values: List[int]) -> None:
+    """
+    Set the archived timestamps of a key in [lower, upper), keeping the others.
+
+    Replacing rather than appending makes archiving a month idempotent: if it is
+    interrupted before the month's partition is dropped, archiving the month
+    again overwrites what was written the first time.
+
+    Args:
+        stats_id: Stats row of the key
+        lower: Inclusive start of the range
+        upper: Exclusive end of the range
+        values: Sorted `to_epoch` timestamps, all within the range
+    """
+    with _lock:
+        merged = array("q")
+        archive = open_archive(stats_id)
+        if archive is not None:
+            with archive:
+                start, end = archive.range(lower, upper)
+                merged.frombytes(archive.values[:start].tobytes())
+                merged.extend(values)
+                merged.frombytes(archive.values[end:].tobytes())
+        else:
+            merged.extend(values)
+        _write_archive(stats_id, merged)
+
+
+def delete_archive(stats_id: int) -> int:
+    """
+    Remove everything archived for a key.
+
+    Args:
+        stats_id: Stats row of the key
+
+    Returns:
+        int: Number of archived impressions removed
+    """
+    with _lock:
+        archive = open_archive(stats_id)
+        if archive is None:
+            return 0
+        with archive:
+            count = len(archive)
+        _write_archive(stats_id, array("q"))
+        return count
+
+
+def archive_partition(partition: Partition, batch_size: int = 10000) -> int:
+    """
+    Copy the impressions of a monthly partition into the archive files of their keys.
+
+    Rows are streamed in (stats_id, datetime) order, so memory use is bounded
+    by the impressions of one key in the month. The partition is left in place;
+    the caller drops it once every key has been archived.
+
+    Args:
+        partition: Monthly partition to archive
+        batch_size: Number of impressions fetched from the database at a time
+
+    Returns:
+        int: Number of impressions archived
+    """
+    table = partition.table
+    query = select(table.c.stats_id, table.c.datetime).order_by(table.c.stats_id, table.c.datetime)
+    archived = 0
+    with db.engine.connect() as connection:
+        rows = connection.execution_options(yield_per=batch_size).execute(query)
+        for stats_id, group in groupby(rows, key=lambda row: row.stats_id):
+            values = [to_epoch(row.datetime) for row in group]
+            replace_archive_range(stats_id, partition.lower, partition.upper, values)
+            archived += len(values)
+    logging.info(f"Archived {archived} impressions of {table.name}")
+    return archived
@@ -0,0 +1,374 @@
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from sqlalchemy.engine import make_url
+from werkzeug.security import safe_join
+from werkzeug.utils import redirect
+
+from src.server_utils.cache import resolution_cache, resolution_query, store_resolution
+from src.server_utils.config import get_config
+from src.server_utils.impressions import drop_deleted_keys
+from src.server_utils.logs import SCAN_LOGGER, logging_stats
+from src.server_utils.partitions import ensure_partitions, impression_inserts, prepare_partitions
+from src.server_utils.pool import TimedAsyncAdaptedQueuePool, pool_options, pool_stats
+from src.server_utils.rollups import rollup_statements
+from src.server_utils.shared import db, redirect_target
+from src.server_utils.sqlite import apply_sqlite_profile
+
+config = get_config()
+impression_config = config.get("impressions", {})
+
+SRC_DIR = os.path.dirname(os.path.dirname(__file__))
+TEMPLATE_DIR = os.path.join(SRC_DIR, "templates")
+STATIC_DIR = os.path.join(SRC_DIR, "static")
+
+# Async driver used for each database backend
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+_UNRESOLVED = object()
+
+# aiosqlite logs every operation it runs on its thread at DEBUG level
+logging.getLogger("aiosqlite").setLevel(logging.INFO)
+
+scan_logger = logging.getLogger(SCAN_LOGGER)
+
+
+def async_database_url(database_url: str) -> str:
+    """
+    Rewrite a database URL to use the async driver of its backend.
+
+    Args:
+        database_url: Database URL as used by the Flask app
+
+    Returns:
+        str: Equivalent URL for `create_async_engine`
+    """
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for database backend: {backend}. Expected one of {', '.join(ASYNC_DRIVERS)}")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+class AsyncImpressionWriter:
+    """
+    Bounded asyncio queue of scans that a background task bulk-inserts.
+
+    The async counterpart of ImpressionBuffer: requests only enqueue, and scans
+    are written every `flush_interval` seconds or as soon as `batch_size` rows
+    are waiting. When the queue is full, the scan is written by its own task.
+    """
+
+    def __init__(self, engine, max_size: int = 10000, flush_interval: float = 0.5, batch_size: int = 500) -> None:
+        """
+        Initialize the writer without starting its task.
+
+        Args:
+            engine: AsyncEngine impressions are written with
+            max_size: Maximum number of scans waiting in the queue
+            flush_interval: Maximum time in seconds a scan waits before being written
+            batch_size: Number of queued scans that triggers an immediate flush
+        """
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: "asyncio.Queue[Tuple[int, datetime]]" = asyncio.Queue(maxsize=max_size)
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._overflow: Set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        """
+        Start the background flusher on the running event loop.
+        """
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def put(self, stats_id: int, when: datetime) -> None:
+        """
+        Queue a scan without waiting for it to be written.
+
+        Args:
+            stats_id: Stats row the impression belongs to
+            when: Timestamp of the scan
+        """
+        try:
+            self._queue.put_nowait((stats_id, when))
+        except asyncio.QueueFull:
+            logging.warning("Impression queue full, writing scan on its own")
+            task = asyncio.get_running_loop().create_task(self._write([(stats_id, when)]))
+            # Keep a reference until done, the event loop only holds weak ones
+            self._overflow.add(task)
+            task.add_done_callback(self._overflow.discard)
+
+    async def stop(self) -> None:
+        """
+        Stop the flusher and write any scans still queued or in flight.
+        """
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        if self._overflow:
+            await asyncio.gather(*self._overflow)
+        await self._write(self._drain())
+
+    def _drain(self, limit: Optional[int] = None) -> List[Tuple[int, datetime]]:
+        """
+        Take queued scans without waiting.
+
+        Args:
+            limit: Maximum number of scans to take, or None for all
+
+        Returns:
+            List[Tuple[int, datetime]]: The scans removed from the queue
+        """
+        rows = []
+        while (limit is None or len(rows) < limit) and not self._queue.empty():
+            rows.append(self._queue.get_nowait())
+        return rows
+
+    async def _run(self) -> None:
+        """
+        Flusher loop: collect up to `batch_size` scans or wait `flush_interval`, then write.
+        """
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            rows = []
+            deadline = loop.time() + self.flush_interval
+            while len(rows) < self.batch_size and not self._stopping.is_set():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+                rows.extend(self._drain(self.batch_size - len(rows)))
+            await self._write(rows)
+
+    async def _write(self, rows: List[Tuple[int, datetime]]) -> None:
+        """
+        Insert a batch of scans and update the rollup counters in one transaction, logging on failure.
+
+        Args:
+            rows: List of (stats_id, datetime) tuples to record
+        """
+        if not rows:
+            return
+        for attempt in range(2):
+            try:
+                async with self.engine.begin() as connection:
+                    kept = await connection.run_sync(drop_deleted_keys, rows)
+                    if not kept:
+                        return
+                    await connection.run_sync(prepare_partitions, kept)
+                    for stmt, params in impression_inserts(kept, self.engine.dialect.name):
+                        await connection.execute(stmt, params)
+                    for stmt, params in rollup_statements(kept, self.engine.dialect.name):
+                        await connection.execute(stmt, params)
+                return
+            except Exception:
+                # Retried once, as a key of the batch may have been deleted
+                # between the check for deleted keys and the insert
+                if attempt:
+                    logging.exception(f"Failed to write {len(rows)} impressions")
+
+
+def _static_url(endpoint: str, filename: str) -> str:
+    """
+    Minimal `url_for` for templates rendered outside Flask, which only link static files.
+    """
+    if endpoint != "static":
+        raise ValueError(f"Cannot build URL for endpoint {endpoint} outside the Flask app")
+    return f"/static/{filename}"
+
+
+class RedirectApp:
+    """
+    ASGI application serving the public redirect without Flask.
+
+    Handles `/qr/<id>` like the Flask `get` view (same resolution cache, error
+    page and https:// prefixing), plus `/metrics` and `/static/`. Scans are
+    queued on an AsyncImpressionWriter, so a request never waits on a write,
+    and lookups use an async engine, so the event loop can hold many idle
+    scanner connections at once.
+    """
+
+    def __init__(self, database_url: str) -> None:
+        """
+        Initialize the application; the engine is created on lifespan startup.
+
+        Args:
+            database_url: Database URL as used by the Flask app
+        """
+        self.database_url = async_database_url(database_url)
+        self.engine = None
+        self.writer: Optional[AsyncImpressionWriter] = None
+        self.templates = Environment(
+            loader=FileSystemLoader(TEMPLATE_DIR),
+            autoescape=select_autoescape(["html"]),
+        )
+        self.templates.globals["url_for"] = _static_url
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._handle(scope, send)
+
+    async def startup(self) -> None:
+        """
+        Create the async engine and tables and start the impression writer.
+        """
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from sqlalchemy.util import greenlet_spawn
+
+        if make_url(self.database_url).get_backend_name() == "sqlite":
+            self.engine = create_async_engine(self.database_url)
+        else:
+            self.engine = create_async_engine(
+                self.database_url,
+                poolclass=TimedAsyncAdaptedQueuePool,
+                **pool_options("public"),
+            )
+        sqlite_config = config.get("database", {}).get("sqlite", {})
+        if self.engine.dialect.name == "sqlite" and sqlite_config.get("profile", True):
+            # Writes already happen on one task, so there is no writer thread
+            apply_sqlite_profile(self.engine.sync_engine, sqlite_config)
+        async with self.engine.begin() as connection:
+            await connection.run_sync(db.metadata.create_all)
+        # Partition DDL runs in transactions of its own, on the sync facade of the async engine
+        await greenlet_spawn(ensure_partitions, self.engine.sync_engine)
+        self.writer = AsyncImpressionWriter(
+            self.engine,
+            max_size=impression_config.get("queue_size", 10000),
+            flush_interval=impression_config.get("flush_interval_ms", 500) / 1000,
+            batch_size=impression_config.get("flush_batch_size", 500),
+        )
+        self.writer.start()
+        logging.info(f"ASGI redirect app started on {self.engine.url.get_backend_name()}")
+
+    async def shutdown(self) -> None:
+        """
+        Flush queued scans and close the database connections.
+        """
+        if self.writer is not None:
+            await self.writer.stop()
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    async def _lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logging.exception("ASGI redirect app failed to start")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _handle(self, scope: Dict, send: Callable) -> None:
+        """
+        Route a request to the matching handler.
+        """
+        path = scope["path"]
+        if scope["method"] not in ("GET", "HEAD"):
+            status, headers, body = 405, [("Content-Type", "text/plain; charset=utf-8"), ("Allow", "GET, HEAD")], b"Method Not Allowed"
+        elif path.startswith("/qr/") and len(path) > 4 and "/" not in path[4:]:
+            status, headers, body = await self.get(path[4:])
+        elif path == "/metrics":
+            status, headers, body = 200, [("Content-Type", "application/json")], json.dumps({
+                "resolution_cache": resolution_cache.stats(),
+                "database_pool": pool_stats(self.engine.sync_engine),
+                "logging": logging_stats(),
+            }).encode()
+        elif path.startswith("/static/"):
+            status, headers, body = await self.static(path[len("/static/"):])
+        else:
+            status, headers, body = 404, [("Content-Type", "text/plain; charset=utf-8")], b"Not Found"
+
+        headers.append(("Content-Length", str(len(body))))
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+        })
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else body})
+
+    async def get(self, id: str) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        """
+        Handle QR code redirect and record impression.
+
+        Args:
+            id: QR code key identifier
+
+        Returns:
+            Tuple[int, List[Tuple[str, str]], bytes]: Status, headers and body of the
+            error page if not found, of a redirect to the target URL otherwise
+        """
+        resolution = resolution_cache.get(id, _UNRESOLVED)
+        if resolution is _UNRESOLVED:
+            async with self.engine.connect() as connection:
+                row = (await connection.execute(resolution_query(id))).first()
+            resolution = store_resolution(id, row)
+
+        if resolution is None:
+            body = self.templates.get_template("error.html").render(id=id).encode()
+            return 200, [("Content-Type", "text/html; charset=utf-8")], body
+
+        self.writer.put(resolution.stats_id, datetime.now())
+
+        scan_logger.info("Recorded impression for key %s, stats_id: %s", id, resolution.stats_id)
+
+        response = redirect(redirect_target(resolution.url))
+        return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+
+    async def static(self, filename: str) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        """
+        Serve a file from the static folder.
+
+        Args:
+            filename: Path relative to the static folder
+
+        Returns:
+            Tuple[int, List[Tuple[str, str]], bytes]: Status, headers and body
+        """
+        path = safe_join(STATIC_DIR, filename)
+        if path is None or not os.path.isfile(path):
+            return 404, [("Content-Type", "text/plain; charset=utf-8")], b"Not Found"
+
+        def read() -> bytes:
+            with open(path, "rb") as f:
+                return f.read()
+
+        body = await asyncio.get_running_loop().run_in_executor(None, read)
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return 200, [("Content-Type", content_type)], body
+
+
+def create_asgi_app() -> RedirectApp:
+    """
+    Create the ASGI redirect application from the DATABASE_URL environment variable.
+
+    Returns:
+        RedirectApp: Application to pass to an ASGI server
+    """
+    from src.server import resolve_database_url
+
+    return RedirectApp(resolve_database_url(os.environ["DATABASE_URL"]))
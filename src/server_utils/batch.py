@@ -0,0 +1,397 @@
+import io
+import logging
+import multiprocessing
+import os
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+
+from src.server_utils.dashboard import search_filter
+from src.server_utils.db import Association, Stats
+from src.server_utils.render import (
+    RENDER_FORMATS,
+    render_config,
+    render_qr,
+    require_pillow,
+    require_segno,
+)
+from src.server_utils.shared import db
+from src.server_utils.styles import style_config
+
+LAYOUTS = ("zip", "sheet")
+
+# Page sizes of print sheets, in PDF points (1/72 inch)
+PAGE_SIZES = {"a4": (595.28, 841.89), "letter": (612.0, 792.0)}
+
+MAX_GRID = 20
+
+# Keys read from the database at a time
+PAGE_SIZE = 500
+
+
+class BatchError(ValueError):
+    """
+    Raised when the requested keys, filter or layout are invalid.
+    """
+
+
+class _ChunkBuffer:
+    """
+    Unseekable file collecting written bytes until they are drained.
+
+    `zipfile` writes to it like to a pipe, with data descriptors instead of
+    seeking back to fill in sizes.
+    """
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class _PdfWriter:
+    """
+    Minimal PDF writer emitting each page as soon as it is added.
+
+    Every page is one full-page image, so only the page being drawn is ever
+    held in memory; the page tree and cross-reference table come at the end.
+    """
+
+    def __init__(self, file, page_width: float, page_height: float) -> None:
+        self._file = file
+        self._page_width = page_width
+        self._page_height = page_height
+        self._position = 0
+        self._offsets: Dict[int, int] = {}
+        self._pages: List[int] = []
+        # 1 is the catalog and 2 the page tree, written once all pages are known
+        self._next_object = 3
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+    def _write(self, data: bytes) -> None:
+        self._file.write(data)
+        self._position += len(data)
+
+    def _object(self, number: int, body: bytes, stream: Optional[bytes] = None) -> None:
+        self._offsets[number] = self._position
+        self._write(b"%d 0 obj\n" % number + body)
+        if stream is not None:
+            self._write(b"\nstream\n" + stream + b"\nendstream")
+        self._write(b"\nendobj\n")
+
+    def _allocate(self) -> int:
+        number = self._next_object
+        self._next_object += 1
+        return number
+
+    def add_page(self, image) -> None:
+        """
+        Add a page showing an RGB or grayscale image stretched over the whole page.
+        """
+        image_object, content_object, page_object = self._allocate(), self._allocate(), self._allocate()
+        color_space = b"/DeviceGray" if image.mode == "L" else b"/DeviceRGB"
+        # Level 3 is twice as fast as the default and within 2% of its size on QR pages
+        data = zlib.compress(image.tobytes(), 3)
+        self._object(
+            image_object,
+            b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s "
+            b"/BitsPerComponent 8 /Filter /FlateDecode /Length %d >>" % (image.width, image.height, color_space, len(data)),
+            data,
+        )
+        content = b"q %.2f 0 0 %.2f 0 0 cm /Im0 Do Q" % (self._page_width, self._page_height)
+        self._object(content_object, b"<< /Length %d >>" % len(content), content)
+        self._object(
+            page_object,
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] /Resources << /XObject << /Im0 %d 0 R >> >> "
+            b"/Contents %d 0 R >>" % (self._page_width, self._page_height, image_object, content_object),
+        )
+        self._pages.append(page_object)
+
+    def close(self) -> None:
+        """
+        Write the page tree and the cross-reference table.
+        """
+        kids = b" ".join(b"%d 0 R" % page for page in self._pages)
+        self._object(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._pages)))
+        xref = self._position
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % self._next_object)
+        self._write(b"".join(b"%010d 00000 n \n" % self._offsets[number] for number in range(1, self._next_object)))
+        self._write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (self._next_object, xref))
+
+
+def _iter_codes(keys: Optional[Sequence[str]], search: Optional[str]) -> Iterator[Tuple[str, Dict]]:
+    """
+    Read the key and merged style of the selected codes, PAGE_SIZE keys at a time.
+
+    Explicit keys are returned in the given order; codes matching a filter, or
+    all codes when there is neither, are read in key order with keyset
+    pagination. The session is closed after each page, so no connection is
+    held while the page renders.
+    """
+    if keys is not None:
+        for position in range(0, len(keys), PAGE_SIZE):
+            chunk = keys[position:position + PAGE_SIZE]
+            styles = dict(db.session.execute(
+                select(Association.key, Association.qr_style_config).where(Association.key.in_(chunk))
+            ).tuples())
+            codes = [(key, style_config(styles[key])._asdict()) for key in chunk if key in styles]
+            db.session.close()
+            yield from codes
+        return
+
+    last_key = None
+    while True:
+        query = select(Association.key, Association.qr_style_config).order_by(Association.key).limit(PAGE_SIZE)
+        if search:
+            query = query.join(Stats, Stats.key == Association.key).where(search_filter(search))
+        if last_key is not None:
+            query = query.where(Association.key > last_key)
+        codes = [(row.key, style_config(row.qr_style_config)._asdict()) for row in db.session.execute(query)]
+        db.session.close()
+        yield from codes
+        if len(codes) < PAGE_SIZE:
+            return
+        last_key = codes[-1][0]
+
+
+def _render_code(data: str, style: Dict, image_format: str) -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Render one code, in a worker process of the pool.
+
+    Returns:
+        Tuple[Optional[bytes], Optional[str]]: Image content, or None and the
+        error of an invalid style
+    """
+    try:
+        return render_qr(data, style, image_format)[1], None
+    except ValueError as e:
+        return None, str(e)
+
+
+def _render_all(codes: Iterator[Tuple[str, Dict]], url_prefix: str, image_format: str,
+                workers: int) -> Iterator[Tuple[str, Optional[bytes], Optional[str]]]:
+    """
+    Render codes in a process pool, yielding them in order as they complete.
+
+    At most four renders per worker are queued at once, so neither the
+    selection nor the rendered images pile up in memory when the consumer
+    is slower than the pool. With one worker, codes are rendered inline.
+    """
+    if workers <= 1:
+        for key, style in codes:
+            yield (key, *_render_code(url_prefix + key, style, image_format))
+        return
+
+    pending: Deque[Tuple[str, Future]] = deque()
+    # Spawned workers start clean instead of inheriting the server's threads and connections
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        try:
+            for key, style in codes:
+                pending.append((key, pool.submit(_render_code, url_prefix + key, style, image_format)))
+                if len(pending) >= workers * 4:
+                    key, future = pending.popleft()
+                    yield (key, *future.result())
+            while pending:
+                key, future = pending.popleft()
+                yield (key, *future.result())
+        finally:
+            # The consumer went away, e.g. a client disconnected: drop the queued renders
+            for _, future in pending:
+                future.cancel()
+
+
+def _archive_name(key: str, image_format: str) -> str:
+    return f"{key.replace('/', '_').replace(chr(92), '_')}.{image_format}"
+
+
+def _stream_zip(renders: Iterator[Tuple[str, Optional[bytes], Optional[str]]], image_format: str) -> Iterator[bytes]:
+    """
+    Write rendered images into a ZIP archive, yielding it as it is written.
+
+    PNG and PDF images are already compressed and are stored as is. Codes
+    whose style cannot be rendered are listed in an errors.txt entry.
+    """
+    buffer = _ChunkBuffer()
+    compression = zipfile.ZIP_DEFLATED if image_format == "svg" else zipfile.ZIP_STORED
+    date_time = datetime.now().timetuple()[:6]
+    errors = []
+    with zipfile.ZipFile(buffer, "w", allowZip64=True) as archive:
+        for key, content, error in renders:
+            if content is None:
+                logging.error(f"Could not render QR code {key}: {error}")
+                errors.append(f"{key}: {error}\n")
+                continue
+            info = zipfile.ZipInfo(_archive_name(key, image_format), date_time=date_time)
+            info.compress_type = compression
+            archive.writestr(info, content)
+            yield buffer.drain()
+        if errors:
+            archive.writestr(zipfile.ZipInfo("errors.txt", date_time=date_time), "".join(errors))
+    yield buffer.drain()
+
+
+def _label_font(size: int):
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has a fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def _stream_sheet(renders: Iterator[Tuple[str, Optional[bytes], Optional[str]]], sheet: Dict) -> Iterator[bytes]:
+    """
+    Lay rendered images out on print sheets, yielding the PDF page by page.
+
+    Each code is centered in its cell of the columns x rows grid, with its
+    key printed below. Codes whose style cannot be rendered leave their cell empty.
+    """
+    from PIL import Image, ImageDraw
+
+    buffer = _ChunkBuffer()
+    writer = _PdfWriter(buffer, *sheet["page_size"])
+    font = _label_font(sheet["label_size"])
+    per_page = sheet["columns"] * sheet["rows"]
+
+    page = None
+    position = 0
+    for key, content, error in renders:
+        if page is None:
+            page = Image.new("RGB", sheet["pixels"], "white")
+            draw = ImageDraw.Draw(page)
+        if content is None:
+            logging.error(f"Could not render QR code {key}: {error}")
+        else:
+            column, row = position % sheet["columns"], position // sheet["columns"]
+            left = sheet["margin"] + column * sheet["cell"][0]
+            top = sheet["margin"] + row * sheet["cell"][1]
+            with Image.open(io.BytesIO(content)) as image:
+                if image.mode == "RGBA":
+                    page.paste(image, (left + (sheet["cell"][0] - image.width) // 2, top + sheet["padding"]), image)
+                else:
+                    page.paste(image, (left + (sheet["cell"][0] - image.width) // 2, top + sheet["padding"]))
+            draw.text((left + sheet["cell"][0] // 2, top + sheet["padding"] + sheet["qr_size"] + sheet["padding"] // 2),
+                      key, fill="black", font=font, anchor="mt")
+        position += 1
+        if position == per_page:
+            writer.add_page(page)
+            page, position = None, 0
+            yield buffer.drain()
+    if page is not None:
+        writer.add_page(page)
+    writer.close()
+    yield buffer.drain()
+
+
+def _sheet_layout(columns: int, rows: int, page_size: str, dpi: int) -> Dict:
+    """
+    Compute the pixel geometry of a print sheet.
+    """
+    if page_size not in PAGE_SIZES:
+        raise BatchError(f"Invalid page size: {page_size}. Expected one of {', '.join(PAGE_SIZES)}")
+    if not 1 <= columns <= MAX_GRID or not 1 <= rows <= MAX_GRID:
+        raise BatchError(f"Invalid grid: {columns}x{rows}. Expected 1 to {MAX_GRID} columns and rows")
+
+    width, height = PAGE_SIZES[page_size]
+    # Half an inch of page margin, 6 point padding around each code and 10 point labels
+    margin, padding, label_size = dpi // 2, dpi * 6 // 72, dpi * 10 // 72
+    pixels = (round(width / 72 * dpi), round(height / 72 * dpi))
+    cell = ((pixels[0] - 2 * margin) // columns, (pixels[1] - 2 * margin) // rows)
+    qr_size = min(cell[0] - 2 * padding, cell[1] - 3 * padding - label_size)
+    if qr_size < 16:
+        raise BatchError(f"Grid {columns}x{rows} leaves no room for the codes on a {page_size} page")
+    return {
+        "columns": columns, "rows": rows, "page_size": (width, height), "pixels": pixels, "margin": margin,
+        "cell": cell, "padding": padding, "label_size": label_size, "qr_size": qr_size,
+    }
+
+
+def render_batch(url_prefix: str, keys: Optional[Sequence[str]] = None, search: Optional[str] = None,
+                 image_format: str = "png", layout: str = "zip", columns: int = 3, rows: int = 4,
+                 page_size: str = "a4", workers: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Render the QR codes of many keys into a ZIP archive or a PDF print sheet.
+
+    The request is validated right away; the returned iterator then reads the
+    codes PAGE_SIZE keys at a time, renders them in a pool of `workers`
+    processes (see `render_qr`, so already rendered images come from the
+    cache) and yields the output as it is written, so memory use does not grow
+    with the number of codes. Must be iterated in an application context.
+
+    Args:
+        url_prefix: Public URL of the redirects, to which each key is appended
+        keys: Keys to render, or None to select by `search`
+        search: Case-insensitive substring of the key or URL to filter on,
+            or None with no keys for all codes
+        image_format: One of RENDER_FORMATS, for the images of a ZIP archive
+        layout: "zip" for one image per code, "sheet" for a PDF with
+            columns x rows codes per page, printed at `[render] dpi`
+        columns: Codes per row of a sheet
+        rows: Rows per page of a sheet
+        page_size: One of PAGE_SIZES
+        workers: Render processes, defaults to `[render] workers` or the CPU count
+
+    Returns:
+        Iterator[bytes]: Chunks of the ZIP archive or PDF document
+
+    Raises:
+        BatchError: If the options are invalid, keys are unknown or nothing matches
+        RuntimeError: If the 'render' extra is not installed
+    """
+    if layout not in LAYOUTS:
+        raise BatchError(f"Invalid layout: {layout}. Expected one of {', '.join(LAYOUTS)}")
+    if image_format not in RENDER_FORMATS:
+        raise BatchError(f"Invalid format: {image_format}. Expected one of {', '.join(RENDER_FORMATS)}")
+    sheet = None
+    if layout == "sheet":
+        sheet = _sheet_layout(columns, rows, page_size.lower(), render_config.get("dpi", 300))
+        image_format = "png"
+    require_segno()
+    if image_format != "svg":
+        require_pillow()
+
+    if keys is not None:
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            raise BatchError("No keys given")
+        found = set()
+        for position in range(0, len(keys), PAGE_SIZE):
+            found.update(db.session.execute(
+                select(Association.key).where(Association.key.in_(keys[position:position + PAGE_SIZE]))
+            ).scalars())
+        missing = [key for key in keys if key not in found]
+        if missing:
+            raise BatchError(f"Unknown keys: {', '.join(missing[:20])}" + (" ..." if len(missing) > 20 else ""))
+    else:
+        query = select(Association.key).limit(1)
+        if search:
+            query = query.join(Stats, Stats.key == Association.key).where(search_filter(search))
+        if db.session.execute(query).first() is None:
+            raise BatchError("No QR codes match")
+    db.session.close()
+
+    workers = workers or render_config.get("workers", 0) or os.cpu_count() or 1
+    codes = _iter_codes(keys, search)
+    if sheet is not None:
+        codes = ((key, dict(style, size=sheet["qr_size"])) for key, style in codes)
+    renders = _render_all(codes, url_prefix, image_format, workers)
+    if sheet is not None:
+        return _stream_sheet(renders, sheet)
+    return _stream_zip(renders, image_format)
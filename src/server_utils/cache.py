@@ -0,0 +1,258 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Hashable, Iterable, NamedTuple, Optional, Tuple
+
+from sqlalchemy import Row, Select, select
+
+from src.server_utils.config import get_config
+from src.server_utils.db import Association, ImpressionTotal, Stats
+from src.server_utils.shared import db
+
+config = get_config()
+cache_config = config.get("cache", {})
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with a size bound and per-entry expiry.
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        """
+        Initialize an empty cache.
+
+        Args:
+            max_size: Maximum number of entries kept; 0 disables the cache
+            ttl: Default time in seconds an entry stays valid
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Look up an entry and mark it as recently used.
+
+        Args:
+            key: Cache key
+            default: Value returned when the key is absent or expired
+
+        Returns:
+            Any: The cached value, or `default`
+        """
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Store an entry, evicting the least recently used one if the cache is full.
+
+        Args:
+            key: Cache key
+            value: Value to store
+            ttl: Time in seconds the entry stays valid, defaults to the cache TTL
+        """
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Remove an entry if present.
+
+        Args:
+            key: Cache key
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Remove all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Get hit/miss counters and occupancy.
+
+        Returns:
+            dict: Counters suitable for JSON serialization
+        """
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "size": size,
+            "max_size": self.max_size,
+        }
+
+
+class Resolution(NamedTuple):
+    url: str
+    stats_id: int
+
+
+resolution_cache = LRUCache(
+    max_size=cache_config.get("resolution_size", 10000),
+    ttl=cache_config.get("resolution_ttl", 60),
+)
+negative_ttl = cache_config.get("negative_ttl", 10)
+
+
+def resolve_key(key: str) -> Optional[Resolution]:
+    """
+    Resolve a QR code key to its target URL and stats id, using the resolution cache.
+
+    Unknown keys are cached too (for `negative_ttl` seconds) so repeated scans of
+    a missing key do not reach the database.
+
+    Args:
+        key: QR code key identifier
+
+    Returns:
+        Optional[Resolution]: Target URL and stats id, or None if the key is unknown
+    """
+    resolution = resolution_cache.get(key, _MISSING)
+    if resolution is not _MISSING:
+        return resolution
+
+    row = db.session.execute(resolution_query(key)).first()
+    return store_resolution(key, row)
+
+
+def resolution_query(key: str) -> Select:
+    """
+    Build the query reading the target URL and stats id of a key in one round trip.
+
+    Args:
+        key: QR code key identifier
+
+    Returns:
+        Select: Query returning at most one (url, id) row
+    """
+    return (
+        select(Association.url, Stats.id)
+        .outerjoin(Stats, Stats.key == Association.key)
+        .where(Association.key == key)
+        .limit(1)
+    )
+
+
+def store_resolution(key: str, row: Optional[Row]) -> Optional[Resolution]:
+    """
+    Turn the result of `resolution_query` into a Resolution and cache it.
+
+    Args:
+        key: QR code key identifier
+        row: Row returned by `resolution_query`, or None
+
+    Returns:
+        Optional[Resolution]: Target URL and stats id, or None if the key is unknown
+    """
+    if row is None:
+        resolution = None
+    elif row.id is None:
+        logging.error(f"Stats not found for key: {key}")
+        resolution = None
+    else:
+        resolution = Resolution(url=row.url, stats_id=row.id)
+
+    resolution_cache.set(key, resolution, ttl=negative_ttl if resolution is None else None)
+    return resolution
+
+
+def invalidate_key(key: str) -> None:
+    """
+    Drop a key from the resolution cache after its association changed.
+
+    Only this process's cache is affected; other processes pick up the change
+    once their entry expires after `resolution_ttl` seconds.
+
+    Args:
+        key: QR code key identifier
+    """
+    resolution_cache.invalidate(key)
+
+
+class StatsVersion(NamedTuple):
+    count: int
+    last_seen: Optional[datetime]
+
+
+# Scan counts of keys and rendered stats responses, see `stats_version`
+stats_version_cache = LRUCache(
+    max_size=cache_config.get("response_size", 1000),
+    ttl=cache_config.get("response_ttl", 5),
+)
+response_cache = LRUCache(
+    max_size=cache_config.get("response_size", 1000),
+    ttl=cache_config.get("response_ttl", 5),
+)
+
+
+def stats_version(stats_id: int) -> StatsVersion:
+    """
+    Get the lifetime scan count and last scan time of a key, using the version cache.
+
+    Every recorded scan changes the pair and resetting the stats clears it, so
+    it identifies the state of the key's impressions. It is read from the
+    lifetime totals with one primary key lookup, never from the impressions.
+
+    Args:
+        stats_id: Stats row of the key
+
+    Returns:
+        StatsVersion: Scan count and last scan time, or (0, None) without scans
+    """
+    version = stats_version_cache.get(stats_id)
+    if version is not None:
+        return version
+
+    row = db.session.execute(
+        select(ImpressionTotal.count, ImpressionTotal.last_seen).where(ImpressionTotal.stats_id == stats_id)
+    ).first()
+    version = StatsVersion(row.count, row.last_seen) if row is not None else StatsVersion(0, None)
+    stats_version_cache.set(stats_id, version)
+    return version
+
+
+def invalidate_stats(stats_ids: Iterable[int]) -> None:
+    """
+    Drop keys from the version cache after their impressions changed.
+
+    Cached responses are keyed by version, so they are not served anymore
+    either. Only this process's cache is affected; other processes pick up the
+    change once their entry expires after `response_ttl` seconds.
+
+    Args:
+        stats_ids: Stats rows whose impressions changed
+    """
+    for stats_id in stats_ids:
+        stats_version_cache.invalidate(stats_id)
@@ -0,0 +1,184 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import and_, func, or_, select
+
+from src.server_utils.db import Association, ImpressionHourly, ImpressionTotal, Stats
+from src.server_utils.shared import db
+
+# Sort value of keys that were never scanned, below any real scan time
+NEVER = datetime(1970, 1, 1)
+
+SORTS = ("key", "url", "total", "last_scan", "scans_24h", "scans_7d")
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class DashboardError(ValueError):
+    """
+    Raised when the requested sort, filter or cursor is invalid.
+    """
+
+
+def _encode_cursor(value: Any, key: str) -> str:
+    """
+    Encode the sort value and key of the last row of a page as an opaque cursor.
+    """
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, key]).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort: str) -> tuple:
+    """
+    Decode a cursor returned by `dashboard_page` for the same sort.
+    """
+    try:
+        value, key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if sort == "last_scan":
+            value = datetime.fromisoformat(value)
+    except (binascii.Error, ValueError, TypeError):
+        raise DashboardError(f"Invalid cursor: {cursor}")
+    return value, key
+
+
+def _recent_scans(stats_id, since: datetime):
+    """
+    Build a scalar subquery summing the hourly rollups of a code from `since` on.
+
+    Each evaluation is a range scan on the (stats_id, bucket) primary key.
+    """
+    return (
+        select(func.coalesce(func.sum(ImpressionHourly.count), 0))
+        .where(ImpressionHourly.stats_id == stats_id, ImpressionHourly.bucket >= since)
+        .scalar_subquery()
+    )
+
+
+def search_filter(search: str):
+    """
+    Build the condition matching codes whose key or URL contains a
+    case-insensitive substring; the Association table must be joined.
+
+    Args:
+        search: Substring to look for, matched literally
+
+    Returns:
+        ColumnElement: Condition for a query's WHERE clause
+    """
+    escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    pattern = f"%{escaped}%"
+    return or_(Stats.key.ilike(pattern, escape="\\"), Association.url.ilike(pattern, escape="\\"))
+
+
+def dashboard_page(sort: str = "key", descending: bool = False, search: Optional[str] = None,
+                   cursor: Optional[str] = None, limit: int = DEFAULT_LIMIT,
+                   now: Optional[datetime] = None) -> Dict:
+    """
+    List QR codes with their scan counts, one page at a time.
+
+    Each page is a single query reading the lifetime totals and hourly
+    rollups, so no raw impression is read. An inner query ranks the codes on
+    the sort column alone and keeps the page's codes, using keyset pagination
+    on the sort column and the key so deep pages cost the same as the first
+    one; their URL, totals and 24 hour and 7 day counts are then looked up for
+    those codes only. Sorting by key only reads the codes of the page; other
+    sorts rank every code matching the filter. The 24 hour and 7 day counts
+    include the whole hour they start in.
+
+    Args:
+        sort: One of SORTS
+        descending: Sort in descending order
+        search: Case-insensitive substring of the key or URL to filter on
+        cursor: `next` value of the previous page, or None for the first page
+        limit: Maximum number of codes per page, at most MAX_LIMIT
+        now: Current time, defaults to `datetime.now()`
+
+    Returns:
+        Dict: "items" with the key, url, protected flag, total, last_scan,
+        scans_24h and scans_7d of each code, and "next", the cursor of the next
+        page or None on the last page
+    """
+    if sort not in SORTS:
+        raise DashboardError(f"Invalid sort: {sort}. Expected one of {', '.join(SORTS)}")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise DashboardError(f"Invalid limit: {limit}. Expected 1 to {MAX_LIMIT}")
+
+    now = now or datetime.now()
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    day_start, week_start = hour - timedelta(hours=23), hour - timedelta(hours=24 * 7 - 1)
+
+    order = {
+        "key": Stats.key,
+        "url": Association.url,
+        "total": func.coalesce(ImpressionTotal.count, 0),
+        "last_scan": func.coalesce(ImpressionTotal.last_seen, NEVER),
+        "scans_24h": _recent_scans(Stats.id, day_start),
+        "scans_7d": _recent_scans(Stats.id, week_start),
+    }[sort]
+    values = select(Stats.id, Stats.key, Stats.password, order.label("sort_value"))
+    if sort == "url" or search:
+        values = values.join(Association, Association.key == Stats.key)
+    if sort in ("total", "last_scan"):
+        values = values.outerjoin(ImpressionTotal, ImpressionTotal.stats_id == Stats.id)
+    if search:
+        values = values.where(search_filter(search))
+    # Computed in a subquery so the sort expression is evaluated once per code
+    values = values.subquery()
+
+    ranked = select(values)
+    if cursor:
+        value, key = _decode_cursor(cursor, sort)
+        if sort == "key":
+            ranked = ranked.where(values.c.key < key if descending else values.c.key > key)
+        elif descending:
+            ranked = ranked.where(or_(values.c.sort_value < value, and_(values.c.sort_value == value, values.c.key < key)))
+        else:
+            ranked = ranked.where(or_(values.c.sort_value > value, and_(values.c.sort_value == value, values.c.key > key)))
+    if descending:
+        ranked = ranked.order_by(values.c.sort_value.desc(), values.c.key.desc())
+    else:
+        ranked = ranked.order_by(values.c.sort_value, values.c.key)
+    ranked = ranked.limit(limit + 1).subquery()
+
+    query = (
+        select(
+            ranked.c.key,
+            Association.url,
+            ranked.c.password.is_not(None).label("protected"),
+            func.coalesce(ImpressionTotal.count, 0).label("total"),
+            ImpressionTotal.last_seen.label("last_scan"),
+            _recent_scans(ranked.c.id, day_start).label("scans_24h"),
+            _recent_scans(ranked.c.id, week_start).label("scans_7d"),
+            ranked.c.sort_value,
+        )
+        .join(Association, Association.key == ranked.c.key)
+        .outerjoin(ImpressionTotal, ImpressionTotal.stats_id == ranked.c.id)
+    )
+    if descending:
+        query = query.order_by(ranked.c.sort_value.desc(), ranked.c.key.desc())
+    else:
+        query = query.order_by(ranked.c.sort_value, ranked.c.key)
+
+    rows = db.session.execute(query).all()
+    items = [
+        {
+            "key": row.key,
+            "url": row.url,
+            "protected": bool(row.protected),
+            "total": int(row.total),
+            "last_scan": row.last_scan.astimezone().isoformat() if row.last_scan is not None else None,
+            "scans_24h": int(row.scans_24h),
+            "scans_7d": int(row.scans_7d),
+        }
+        for row in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = _encode_cursor(last.last_scan or NEVER if sort == "last_scan" else last.sort_value, last.key)
+    return {"items": items, "next": next_cursor}
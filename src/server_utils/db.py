@@ -6,7 +6,7 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import List, Optional
 
-from sqlalchemy import ForeignKey, Text
+from sqlalchemy import ForeignKey, Sequence, Text
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 from sqlalchemy.orm import relationship
@@ -19,7 +19,7 @@ class Association(db.Model):
     __tablename__ = "associations"
     id = db.Column("id", db.Integer, primary_key=True)
 
-    key: str = db.Column(db.String(1000))
+    key: str = db.Column(db.String(1000), unique=True, index=True)
     url: str = db.Column(db.String(1000))
     qr_style_config: Optional[str] = db.Column(Text, nullable=True)
 
@@ -58,7 +58,7 @@ class Stats(db.Model):
     __tablename__ = "stats"
     id = db.Column("id", db.Integer, primary_key=True)
 
-    key: str = db.Column(db.String(1000))
+    key: str = db.Column(db.String(1000), unique=True, index=True)
     password: str = db.Column(db.String(1000))
     impressions: Mapped[List["Impression"]] = relationship()
 
@@ -78,9 +78,16 @@ class Stats(db.Model):
 
 
 class Impression(db.Model):
+    # Partitioned by month, see partitions.py. On PostgreSQL this is the parent of
+    # the monthly partitions; on SQLite it only holds rows from before partitioning.
     __tablename__ = "impressions"
-    id: Mapped[int] = mapped_column(primary_key=True)
-    datetime = mapped_column(db.DateTime)
+    __table_args__ = (
+        db.Index("ix_impressions_stats_id_datetime", "stats_id", "datetime"),
+        {"postgresql_partition_by": "RANGE (datetime)"},
+    )
+    id: Mapped[int] = mapped_column(Sequence("impressions_id_seq"), primary_key=True)
+    # Part of the primary key as PostgreSQL requires it of partitioned tables
+    datetime = mapped_column(db.DateTime, primary_key=True)
 
     stats_id: Mapped[int] = mapped_column(ForeignKey("stats.id"))
     stats: Mapped["Stats"] = relationship(back_populates="impressions")
@@ -93,3 +100,32 @@ class Impression(db.Model):
             datetime: Timestamp when the QR code was scanned
         """
         self.datetime = datetime
+
+
+class ImpressionTotal(db.Model):
+    __tablename__ = "impression_totals"
+    stats_id: Mapped[int] = mapped_column(ForeignKey("stats.id"), primary_key=True)
+    count: Mapped[int] = mapped_column(db.Integer, default=0)
+    first_seen = mapped_column(db.DateTime)
+    last_seen = mapped_column(db.DateTime)
+
+
+class ImpressionHourly(db.Model):
+    __tablename__ = "impressions_hourly"
+    stats_id: Mapped[int] = mapped_column(ForeignKey("stats.id"), primary_key=True)
+    bucket = mapped_column(db.DateTime, primary_key=True)
+    count: Mapped[int] = mapped_column(db.Integer, default=0)
+
+
+class ImpressionDaily(db.Model):
+    __tablename__ = "impressions_daily"
+    stats_id: Mapped[int] = mapped_column(ForeignKey("stats.id"), primary_key=True)
+    bucket = mapped_column(db.DateTime, primary_key=True)
+    count: Mapped[int] = mapped_column(db.Integer, default=0)
+
+
+class KeySequence(db.Model):
+    __tablename__ = "key_sequences"
+    name: Mapped[str] = mapped_column(db.String(100), primary_key=True)
+    next_value: Mapped[int] = mapped_column(db.BigInteger, default=0)
+    secret: Mapped[str] = mapped_column(db.String(64))
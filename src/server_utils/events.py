@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+from datetime import datetime, tzinfo
+from typing import Iterable, Iterator, Optional
+
+from src.server_utils.cache import stats_version
+from src.server_utils.config import get_config
+from src.server_utils.series import incremental_series
+from src.server_utils.shared import db
+
+config = get_config()
+events_config = config.get("events", {})
+
+# Signalled whenever this process records or deletes impressions
+_scans = threading.Condition()
+_generation = 0
+
+# Each stream holds a server thread, so only a few may be open at once
+_streams = threading.BoundedSemaphore(max(events_config.get("max_streams", 2), 1))
+
+
+def publish_scans(stats_ids: Iterable[int]) -> None:
+    """
+    Wake the event streams of this process after impressions of some keys changed.
+
+    Streams of other processes notice the change when they poll, every
+    `[events] poll_interval_seconds`.
+
+    Args:
+        stats_ids: Stats rows whose impressions changed
+    """
+    global _generation
+    if not stats_ids:
+        return
+    with _scans:
+        _generation += 1
+        _scans.notify_all()
+
+
+def _wait_for_scans(generation: int, timeout: float) -> int:
+    """
+    Block until `publish_scans` is called after `generation`, or until the timeout.
+
+    Args:
+        generation: Generation returned by the previous call, or 0
+        timeout: Maximum time to wait in seconds
+
+    Returns:
+        int: Current generation
+    """
+    with _scans:
+        _scans.wait_for(lambda: _generation != generation, timeout)
+        return _generation
+
+
+def acquire_stream() -> bool:
+    """
+    Reserve one of the `[events] max_streams` event streams of this process.
+
+    Returns:
+        bool: True if reserved; release it with `release_stream`
+    """
+    return _streams.acquire(blocking=False)
+
+
+def release_stream() -> None:
+    """
+    Release an event stream reserved with `acquire_stream`.
+    """
+    _streams.release()
+
+
+def _event(name: str, data: dict, event_id: Optional[str] = None) -> str:
+    """
+    Format a Server-Sent Event.
+
+    Args:
+        name: Event type
+        data: JSON payload
+        event_id: Event id, sent back by reconnecting clients as Last-Event-ID
+
+    Returns:
+        str: Event in the text/event-stream format
+    """
+    lines = [f"event: {name}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def iter_series_events(stats_id: int, bucket: str = "hour", start: Optional[datetime] = None,
+                       end: Optional[datetime] = None, tz: Optional[tzinfo] = None,
+                       since: Optional[str] = None) -> Iterator[str]:
+    """
+    Stream the changes of a key's impression series as Server-Sent Events.
+
+    A "series" event with the output of `incremental_series` is sent right
+    away and then whenever the scan count of the key changes, each one
+    resuming from the cursor of the previous one; the cursor is also the event
+    id, so a reconnecting EventSource resumes where it stopped. A "reset"
+    event is sent and the stream ends when the key's impressions are deleted.
+    The stream ends after `[events] max_duration_seconds`, and clients
+    reconnect after `retry_ms`.
+
+    The scan count is checked from the version cache, without reading
+    impressions, whenever this process records scans and at least every
+    `poll_interval_seconds`. The database session is closed between checks.
+    Must be iterated in an application context.
+
+    Args:
+        stats_id: Stats row to follow
+        bucket: One of BUCKETS
+        start: Inclusive naive server-local start, or None for the first impression
+        end: Exclusive naive server-local end, or None for now
+        tz: Time zone of the returned bucket starts, or None for server time
+        since: Cursor to resume from, or None to start with the whole series
+
+    Yields:
+        str: Events and keep-alive comments in the text/event-stream format
+    """
+    poll_interval = events_config.get("poll_interval_seconds", 2)
+    heartbeat = events_config.get("heartbeat_seconds", 15)
+    deadline = time.monotonic() + events_config.get("max_duration_seconds", 300)
+
+    yield f"retry: {events_config.get('retry_ms', 2000)}\n\n"
+    version = None
+    generation = _generation
+    last_sent = time.monotonic()
+    while time.monotonic() < deadline:
+        try:
+            current = stats_version(stats_id)
+            if version is not None and current.count < version.count:
+                yield _event("reset", {"count": current.count})
+                return
+            if current != version:
+                payload = incremental_series(stats_id, bucket=bucket, start=start, end=end, tz=tz, since=since)
+                since = payload["cursor"]
+                version = current
+                last_sent = time.monotonic()
+                yield _event("series", payload, since)
+            elif time.monotonic() - last_sent >= heartbeat:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+        finally:
+            # Do not hold a pooled connection or a read snapshot while waiting
+            db.session.close()
+        generation = _wait_for_scans(generation, poll_interval)
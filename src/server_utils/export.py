@@ -0,0 +1,105 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, select
+
+from src.server_utils.archive import iter_archive_pages
+from src.server_utils.partitions import impression_partitions
+from src.server_utils.shared import db
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def iter_impression_pages(stats_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                          page_size: int = 10000) -> Iterator[List[Tuple[Optional[int], datetime]]]:
+    """
+    Read the impressions of a key in (datetime, id) order, one page at a time.
+
+    Partitions are read one after the other, oldest first, so a page query
+    never spans months. Within a partition, pages are fetched with keyset
+    pagination, each on its own short-lived connection and streamed with a
+    server-side cursor, so memory use and read transaction length do not grow
+    with the number of impressions. Archived impressions (see
+    `archive_partition`) come first, as they are older than every partition,
+    and have no id.
+
+    Args:
+        stats_id: Stats row whose impressions are read
+        start: Inclusive naive server-local start, or None
+        end: Exclusive naive server-local end, or None
+        page_size: Maximum number of impressions per page
+
+    Yields:
+        List[Tuple[Optional[int], datetime]]: (impression id, datetime) pairs of one page
+    """
+    for archived in iter_archive_pages(stats_id, start, end, page_size):
+        yield [(None, when) for when in archived]
+
+    with db.engine.connect() as connection:
+        partitions = impression_partitions(connection, start, end)
+
+    for partition in partitions:
+        table = partition.table
+        query = select(table.c.id, table.c.datetime).where(table.c.stats_id == stats_id)
+        if start is not None:
+            query = query.where(table.c.datetime >= start)
+        if end is not None:
+            query = query.where(table.c.datetime < end)
+        query = query.order_by(table.c.datetime, table.c.id).limit(page_size)
+
+        last = None
+        while True:
+            page_query = query
+            if last is not None:
+                last_id, last_datetime = last
+                page_query = page_query.where(or_(
+                    table.c.datetime > last_datetime,
+                    and_(table.c.datetime == last_datetime, table.c.id > last_id),
+                ))
+            with db.engine.connect() as connection:
+                result = connection.execution_options(yield_per=min(page_size, 1000)).execute(page_query)
+                page = [(row.id, row.datetime) for row in result]
+            if page:
+                yield page
+            if len(page) < page_size:
+                break
+            last = page[-1]
+
+
+def iter_export(stats_id: int, export_format: str = "ndjson", start: Optional[datetime] = None,
+                end: Optional[datetime] = None, page_size: int = 10000) -> Iterator[str]:
+    """
+    Serialize the impressions of a key incrementally.
+
+    Args:
+        stats_id: Stats row whose impressions are exported
+        export_format: One of EXPORT_FORMATS
+        start: Inclusive naive server-local start, or None
+        end: Exclusive naive server-local end, or None
+        page_size: Maximum number of impressions read and serialized at a time
+
+    Yields:
+        str: Chunks of NDJSON lines or CSV rows, starting with the CSV header
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid export format: {export_format}. Expected one of {', '.join(EXPORT_FORMATS)}")
+
+    if export_format == "csv":
+        yield "id,datetime\r\n"
+
+    for page in iter_impression_pages(stats_id, start=start, end=end, page_size=page_size):
+        if export_format == "ndjson":
+            yield "".join(
+                json.dumps({"id": impression_id, "datetime": when.isoformat()}) + "\n"
+                for impression_id, when in page
+            )
+        else:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows((impression_id, when.isoformat()) for impression_id, when in page)
+            yield buffer.getvalue()
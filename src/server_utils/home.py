@@ -1,20 +1,48 @@
+import hashlib
 import json
 import logging
 import os
-import random
-import string
 from datetime import datetime
-from typing import Union
+from typing import Callable, Dict, List, Optional, Union
 
-from flask import Blueprint, jsonify, render_template, redirect, request, url_for, Response
+from flask import Blueprint, jsonify, render_template, redirect, request, stream_with_context, url_for, Response
+from sqlalchemy import delete, select, update
+from werkzeug.http import is_resource_modified
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from src.server_utils.analytics import AnalyticsError, key_analytics
+from src.server_utils.batch import BatchError, render_batch
+from src.server_utils.cache import invalidate_key, resolution_cache, resolve_key, response_cache, stats_version
 from src.server_utils.config import get_config
-from src.server_utils.db import Association, Stats, Impression
-from src.server_utils.shared import db
+from src.server_utils.dashboard import DEFAULT_LIMIT, SORTS, DashboardError, dashboard_page
+from src.server_utils.db import Association, Stats
+from src.server_utils.events import acquire_stream, iter_series_events, release_stream
+from src.server_utils.export import EXPORT_FORMATS, iter_export
+from src.server_utils.impressions import delete_impressions, record_impression
+from src.server_utils.jobs import get_job, start_job
+from src.server_utils.keys import generate_unique_keys
+from src.server_utils.logs import SCAN_LOGGER, logging_stats
+from src.server_utils.pool import pool_stats
+from src.server_utils.provisioning import ProvisioningError, bulk_create, parse_items
+from src.server_utils.render import RENDER_FORMATS, RenderError, render_config, render_qr
+from src.server_utils.rollups import get_total
+from src.server_utils.series import (
+    SeriesError,
+    check_range,
+    incremental_series,
+    parse_cursor,
+    parse_timestamp,
+    parse_timezone,
+    truncate,
+)
+from src.server_utils.shared import db, redirect_target
+from src.server_utils.sqlite import run_write
+from src.server_utils.styles import parse_style_form, style_config
 
 config = get_config()
-key_config = config["key_generation"]
+maintenance_config = config.get("maintenance", {})
+
+scan_logger = logging.getLogger(SCAN_LOGGER)
 
 home_pages = Blueprint('home',
                        __name__,
@@ -57,57 +85,50 @@ def get(id: str) -> Union[str, Response]:
     Returns:
         Union[str, Response]: Error page if not found, redirect to target URL otherwise
     """
-    association = Association.query.filter_by(key=id).first()
-
-    if association is None:
-        return render_template("error.html", id=id)
+    resolution = resolve_key(id)
 
-    stats = Stats.query.filter_by(key=id).first()
-    
-    if stats is None:
-        logging.error(f"Stats not found for key: {id}")
+    if resolution is None:
         return render_template("error.html", id=id)
     
-    url = association.url
-    new_impression = Impression(datetime.now())
-    new_impression.stats_id = stats.id
-    stats.impressions.append(new_impression)
-    db.session.add(new_impression)
-    db.session.commit()
+    url = resolution.url
+    record_impression(resolution.stats_id)
     
-    logging.info(f"Recorded impression for key {id}, stats_id: {stats.id}, impression stats_id: {new_impression.stats_id}")
+    scan_logger.info("Recorded impression for key %s, stats_id: %s", id, resolution.stats_id)
 
-    if url.find("http://") != 0 and url.find("https://") != 0:
-        url = "https://" + url
+    return redirect(redirect_target(url))
 
-    return redirect(url)
 
+@public_pages.route("/metrics", methods=["GET"])
+@admin_pages.route("/metrics", methods=["GET"])
+@home_pages.route("/metrics", methods=["GET"])
+def metrics() -> Response:
+    """
+    API endpoint returning this process's cache and connection pool counters as JSON.
+    
+    Returns:
+        Response: JSON response with resolution and stats response cache hits,
+        misses and size, database pool occupancy and checkout wait times
+        (null for SQLite), and background log queue occupancy and dropped
+        records (null unless logging is queued)
+    """
+    return jsonify({
+        "resolution_cache": resolution_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "database_pool": pool_stats(db.engine),
+        "logging": logging_stats(),
+    })
 
-@admin_pages.route("/qr/<id>/stats", methods=["GET", "POST"])
-@home_pages.route("/qr/<id>/stats", methods=["GET", "POST"])
-def stats(id: str) -> str:
+
+def _public_qr_url(id: str) -> str:
     """
-    Display statistics page for a QR code.
+    Get the public URL a QR code encodes.
     
     Args:
         id: QR code key identifier
         
     Returns:
-        str: Rendered HTML template with statistics
+        str: URL of the public redirect of the key
     """
-    association = Association.query.filter_by(key=id).first()
-    stats = Stats.query.filter_by(key=id).first()
-
-    if association is None or stats is None:
-        return render_template("error.html", id=id)
-
-    has_password = stats.password is not None
-    received_password = request.form.get("password", None)
-    if has_password and received_password is None:
-        return render_template("password.html", id=id)
-    elif has_password and not check_password_hash(stats.password, received_password):
-        return render_template("generic_error.html", error_message="Incorrect password! Refresh the page to try again.")
-
     # Generate public QR code URL using BASE_URL from env if set, otherwise use request host
     base_url = os.environ.get("BASE_URL", "").strip()
     if base_url:
@@ -126,57 +147,443 @@ def stats(id: str) -> str:
         scheme = 'https' if request.is_secure else 'http'
         public_qr_url = f"{scheme}://{public_host}:{public_port}/qr/{id}"
         logging.info(f"Using request host for QR URL: {public_qr_url}")
+    return public_qr_url
 
-    url = association.url
-    counter = len(stats.impressions)
 
-    datetimes = [impression.datetime for impression in stats.impressions]
-    datetimes.sort()
+def _qr_style_config(association: Association) -> dict:
+    """
+    Get the effective QR style config of a key, see `style_config`.
+    
+    Args:
+        association: Association of the key
+        
+    Returns:
+        dict: `[qr_code]` defaults overridden by the stored values
+    """
+    return style_config(association.qr_style_config)._asdict()
 
-    # Merge stored QR style config with config.toml defaults
-    default_qr_config = config.get("qr_code", {})
-    stored_qr_config = association.get_qr_style_config()
+
+@admin_pages.route("/qr/<id>.<any(png, svg, pdf):image_format>", methods=["GET"])
+@home_pages.route("/qr/<id>.<any(png, svg, pdf):image_format>", methods=["GET"])
+def qr_image(id: str, image_format: str) -> Response:
+    """
+    Render the QR code of a key as a PNG, SVG or PDF image, with its stored style.
     
-    if stored_qr_config:
-        # Start with defaults and override with stored values
-        qr_config = default_qr_config.copy()
-        qr_config.update(stored_qr_config)
-    else:
-        # Use defaults only
-        qr_config = default_qr_config
+    Images are cached by a hash of the encoded URL and style (see `render_qr`),
+    which is also their strong ETag, so they are only rendered again after the
+    style changed.
+    
+    Args:
+        id: QR code key identifier
+        image_format: "png", "svg" or "pdf"
+        
+    Returns:
+        Response: The image, or an empty 304 response if the client's copy is current
+    """
+    association = Association.query.filter_by(key=id).first()
+
+    if association is None:
+        return jsonify({"error": "QR code not found"}), 404
+
+    try:
+        digest, content = render_qr(_public_qr_url(id), _qr_style_config(association), image_format)
+    except RenderError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 501
+
+    response = Response(content, mimetype=RENDER_FORMATS[image_format])
+    response.set_etag(digest)
+    response.cache_control.public = True
+    response.cache_control.max_age = render_config.get("max_age", 86400)
+    return response.make_conditional(request)
+
+
+@admin_pages.route("/qr/<id>/stats", methods=["GET", "POST"])
+@home_pages.route("/qr/<id>/stats", methods=["GET", "POST"])
+def stats(id: str) -> str:
+    """
+    Display statistics page for a QR code.
+    
+    Args:
+        id: QR code key identifier
+        
+    Returns:
+        str: Rendered HTML template with statistics
+    """
+    association = Association.query.filter_by(key=id).first()
+    stats = Stats.query.filter_by(key=id).first()
+
+    if association is None or stats is None:
+        return render_template("error.html", id=id)
+
+    has_password = stats.password is not None
+    received_password = request.form.get("password", None)
+    if has_password and received_password is None:
+        return render_template("password.html", id=id)
+    elif has_password and not check_password_hash(stats.password, received_password):
+        return render_template("generic_error.html", error_message="Incorrect password! Refresh the page to try again.")
+
+    public_qr_url = _public_qr_url(id)
+    url = association.url
+    total = get_total(stats.id)
+    counter = total.count if total is not None else 0
+    qr_config = _qr_style_config(association)
 
     if counter == 0:
         return render_template("stats.html", url=url, counter=counter, has_data=False, id=id, qr_config=qr_config, has_password=has_password, public_qr_url=public_qr_url)
     elif counter == 1:
-        return render_template("stats.html", url=url, counter=counter, has_data=False, date=datetimes[0], id=id, qr_config=qr_config, has_password=has_password, public_qr_url=public_qr_url)
+        return render_template("stats.html", url=url, counter=counter, has_data=False, date=total.first_seen, id=id, qr_config=qr_config, has_password=has_password, public_qr_url=public_qr_url)
+
+    return render_template("stats.html", url=url, counter=counter, has_data=True, id=id, qr_config=qr_config, has_password=has_password, public_qr_url=public_qr_url, first_seen=total.first_seen.astimezone().isoformat(), last_seen=total.last_seen.astimezone().isoformat())
+
+
+def _conditional_stats_response(stats_ids: List[int], compute: Callable[[], Dict],
+                                window: Optional[datetime] = None) -> Response:
+    """
+    Answer a stats request from its scan versions when possible, otherwise compute it.
+
+    The ETag is derived from the request and the scan count and last scan time
+    of each key (see `stats_version`), and Last-Modified is the last scan time.
+    A request whose If-None-Match or If-Modified-Since matches gets a 304
+    without reading any impression; identical requests within `[cache]
+    response_ttl` seconds are served from the response cache.
+
+    Args:
+        stats_ids: Stats rows the response is computed from
+        compute: Function returning the JSON payload
+        window: Start of a range that moves with the current time, or None
 
-    return render_template("stats.html", url=url, counter=counter, has_data=True, id=id, qr_config=qr_config, has_password=has_password, public_qr_url=public_qr_url)
+    Returns:
+        Response: JSON response, or an empty 304 response
+    """
+    versions = [stats_version(stats_id) for stats_id in stats_ids]
+    identity = [request.path, sorted(request.args.items(multi=True)), versions, window]
+    etag = hashlib.sha1(json.dumps(identity, default=str).encode()).hexdigest()
+    scanned = [version.last_seen for version in versions if version.last_seen is not None]
+    last_modified = max(scanned).astimezone() if scanned else None
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        body = response_cache.get(etag)
+        if body is None:
+            body = jsonify(compute()).get_data()
+            response_cache.set(etag, body)
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Let clients keep the response but revalidate it on every poll
+    response.cache_control.no_cache = True
+    return response
 
 
 @admin_pages.route("/qr/<id>/stats/data", methods=["GET"])
 @home_pages.route("/qr/<id>/stats/data", methods=["GET"])
 def stats_data(id: str) -> Response:
     """
-    API endpoint returning impression data as JSON.
+    API endpoint returning the impression count series as JSON.
+    
+    Query parameters:
+        bucket: Series resolution, one of minute, hour (default), day or week
+        from: Inclusive ISO 8601 start of the range (default: first scan, or one day back for minutes)
+        to: Exclusive ISO 8601 end of the range (default: now)
+        tz: IANA time zone for bucket boundaries and naive from/to values (default: server time)
+        since: `cursor` of a previous response with the same parameters; only
+            its last bucket and newer ones are returned
     
     Args:
         id: QR code key identifier
         
     Returns:
-        Response: JSON response with impression datetimes and count
+        Response: JSON response with the bucketed impression series, total count
+        in the range and the cursor of the next incremental request
     """
     stats = Stats.query.filter_by(key=id).first()
 
     if stats is None:
         return jsonify({"error": "Stats not found"}), 404
 
-    datetimes = [impression.datetime.isoformat() for impression in stats.impressions]
-    datetimes.sort()
+    bucket = request.args.get("bucket", "hour")
+    try:
+        tz = parse_timezone(request.args.get("tz"))
+        start = parse_timestamp(request.args.get("from"), tz)
+        end = parse_timestamp(request.args.get("to"), tz)
+    except SeriesError as e:
+        return jsonify({"error": str(e)}), 400
 
-    return jsonify({
-        "datetimes": datetimes,
-        "count": len(datetimes)
-    })
+    since = request.args.get("since")
+
+    def compute() -> Dict:
+        return {"bucket": bucket, **incremental_series(stats.id, bucket=bucket, start=start, end=end, tz=tz, since=since)}
+
+    # Without a start, minute buckets cover the last day, which moves every minute
+    window = truncate(datetime.now(), "minute") if bucket == "minute" and start is None and not since else None
+    try:
+        return _conditional_stats_response([stats.id], compute, window)
+    except SeriesError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@admin_pages.route("/qr/<id>/stats/events", methods=["GET"])
+@home_pages.route("/qr/<id>/stats/events", methods=["GET"])
+def stats_events(id: str) -> Response:
+    """
+    Server-Sent Events endpoint pushing the new points of the impression series as scans are recorded.
+    
+    Takes the query parameters of `stats_data`. `since`, or the Last-Event-ID
+    header sent by a reconnecting EventSource, resumes from a cursor.
+    
+    Args:
+        id: QR code key identifier
+        
+    Returns:
+        Response: text/event-stream response, see `iter_series_events`
+    """
+    stats = Stats.query.filter_by(key=id).first()
+
+    if stats is None:
+        return jsonify({"error": "Stats not found"}), 404
+
+    bucket = request.args.get("bucket", "hour")
+    since = request.headers.get("Last-Event-ID") or request.args.get("since")
+    try:
+        tz = parse_timezone(request.args.get("tz"))
+        start = parse_timestamp(request.args.get("from"), tz)
+        end = parse_timestamp(request.args.get("to"), tz)
+        # Validate the parameters before the stream starts
+        check_range(bucket, start, end)
+        if since:
+            parse_cursor(since, bucket)
+    except SeriesError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not acquire_stream():
+        return jsonify({"error": "Too many live streams, poll /stats/data instead"}), 503
+    response = Response(
+        stream_with_context(iter_series_events(stats.id, bucket=bucket, start=start, end=end, tz=tz, since=since)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(release_stream)
+    return response
+
+
+@admin_pages.route("/qr/<id>/stats/export", methods=["GET"])
+@home_pages.route("/qr/<id>/stats/export", methods=["GET"])
+def export_stats(id: str) -> Response:
+    """
+    API endpoint streaming the raw impressions of a QR code.
+    
+    Query parameters:
+        format: ndjson (default) or csv
+        from: Inclusive ISO 8601 start of the range
+        to: Exclusive ISO 8601 end of the range
+        tz: IANA time zone of from/to values without an offset (default: server time)
+    
+    Args:
+        id: QR code key identifier
+        
+    Returns:
+        Response: Streamed NDJSON or CSV of impression ids and datetimes, ordered by datetime
+    """
+    stats = Stats.query.filter_by(key=id).first()
+
+    if stats is None:
+        return jsonify({"error": "Stats not found"}), 404
+
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Invalid format: {export_format}. Expected one of {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        tz = parse_timezone(request.args.get("tz"))
+        start = parse_timestamp(request.args.get("from"), tz)
+        end = parse_timestamp(request.args.get("to"), tz)
+    except SeriesError as e:
+        return jsonify({"error": str(e)}), 400
+
+    logging.info(f"Exporting impressions for key {id} as {export_format}")
+    return Response(
+        stream_with_context(iter_export(stats.id, export_format, start=start, end=end)),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f"attachment; filename={id}-impressions.{export_format}"}
+    )
+
+
+def _request_analytics(stats_ids: list) -> dict:
+    """
+    Compute analytics of some stats rows with the options of the request, see `stats_analytics`.
+
+    Args:
+        stats_ids: Stats rows to analyze
+
+    Returns:
+        dict: Analytics of each stats row
+
+    Raises:
+        SeriesError, AnalyticsError: If an option is invalid
+        RuntimeError: If NumPy is not installed
+    """
+    tz = parse_timezone(request.args.get("tz"))
+    return key_analytics(
+        stats_ids,
+        start=parse_timestamp(request.args.get("from"), tz),
+        end=parse_timestamp(request.args.get("to"), tz),
+        tz=tz,
+        window_hours=request.args.get("window_hours", 24, type=int),
+        peak_minutes=request.args.get("peak_minutes", 60, type=int),
+        peaks=request.args.get("peaks", 3, type=int),
+        period_days=request.args.get("period_days", 7, type=int),
+    )
+
+
+def _analytics_window() -> Optional[datetime]:
+    """
+    Get the minute the analytics range of the request moves with, see `_conditional_stats_response`.
+
+    Returns:
+        Optional[datetime]: Current minute if the range ends now, None if it has a fixed end
+    """
+    return None if request.args.get("to") else truncate(datetime.now(), "minute")
+
+
+@admin_pages.route("/qr/<id>/stats/analytics", methods=["GET"])
+@home_pages.route("/qr/<id>/stats/analytics", methods=["GET"])
+def stats_analytics(id: str) -> Response:
+    """
+    API endpoint returning scan analytics of a QR code as JSON, computed with NumPy.
+    
+    Query parameters:
+        from: Inclusive ISO 8601 start of the range (default: 30 days before the end)
+        to: Exclusive ISO 8601 end of the range (default: now)
+        tz: IANA time zone for heatmap hours, returned timestamps and naive from/to values (default: server time)
+        window_hours: Rolling rate window (default: 24)
+        peak_minutes: Peak window length (default: 60)
+        peaks: Number of peak windows (default: 3)
+        period_days: Growth period length (default: 7)
+    
+    Args:
+        id: QR code key identifier
+        
+    Returns:
+        Response: JSON response with the heatmap, rolling rate, peak windows and growth of the key
+    """
+    stats = Stats.query.filter_by(key=id).first()
+
+    if stats is None:
+        return jsonify({"error": "Stats not found"}), 404
+
+    try:
+        return _conditional_stats_response(
+            [stats.id], lambda: _request_analytics([stats.id])[stats.id], _analytics_window()
+        )
+    except (SeriesError, AnalyticsError) as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 501
+
+
+@admin_pages.route("/api/analytics", methods=["GET"])
+@home_pages.route("/api/analytics", methods=["GET"])
+def analytics() -> Response:
+    """
+    API endpoint returning scan analytics of several QR codes at once.
+    
+    Query parameters:
+        keys: Comma-separated key identifiers
+        Other parameters are those of `stats_analytics`
+        
+    Returns:
+        Response: JSON object mapping each key to its analytics
+    """
+    keys = [key for key in request.args.get("keys", "").split(",") if key]
+    if not keys:
+        return jsonify({"error": "No keys given"}), 400
+    stats_ids = dict(db.session.execute(select(Stats.key, Stats.id).where(Stats.key.in_(keys))).all())
+    missing = [key for key in keys if key not in stats_ids]
+    if missing:
+        return jsonify({"error": f"Stats not found: {', '.join(missing)}"}), 404
+
+    def compute() -> Dict:
+        results = _request_analytics(list(stats_ids.values()))
+        return {key: results[stats_id] for key, stats_id in stats_ids.items()}
+
+    try:
+        return _conditional_stats_response(list(stats_ids.values()), compute, _analytics_window())
+    except (SeriesError, AnalyticsError) as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 501
+
+
+def _request_dashboard_page() -> dict:
+    """
+    Get the dashboard page selected by the request arguments, see `dashboard_api`.
+
+    Returns:
+        dict: Page of codes and cursor of the next page
+
+    Raises:
+        DashboardError: If an argument is invalid
+    """
+    return dashboard_page(
+        sort=request.args.get("sort", "key"),
+        descending=request.args.get("order", "asc") == "desc",
+        search=request.args.get("q", "").strip() or None,
+        cursor=request.args.get("cursor") or None,
+        limit=request.args.get("limit", DEFAULT_LIMIT, type=int),
+    )
+
+
+@admin_pages.route("/dashboard", methods=["GET"])
+@home_pages.route("/dashboard", methods=["GET"])
+def dashboard() -> str:
+    """
+    Render the list of all QR codes with their scan counts.
+    
+    Takes the query parameters of `dashboard_api`.
+    
+    Returns:
+        str: Rendered HTML template
+    """
+    try:
+        page = _request_dashboard_page()
+    except DashboardError as e:
+        return render_template("generic_error.html", error_message=str(e))
+
+    return render_template(
+        "dashboard.html",
+        page=page,
+        sorts=SORTS,
+        sort=request.args.get("sort", "key"),
+        order=request.args.get("order", "asc"),
+        search=request.args.get("q", ""),
+    )
+
+
+@admin_pages.route("/api/dashboard", methods=["GET"])
+@home_pages.route("/api/dashboard", methods=["GET"])
+def dashboard_api() -> Response:
+    """
+    API endpoint listing all QR codes with their scan counts, one page at a time.
+    
+    Query parameters:
+        sort: key (default), url, total, last_scan, scans_24h or scans_7d
+        order: asc (default) or desc
+        q: Case-insensitive substring of the key or URL
+        cursor: "next" value of the previous page
+        limit: Number of codes per page (default: 50, at most 500)
+        
+    Returns:
+        Response: JSON response with the codes of the page as "items" and the cursor of the next page as "next"
+    """
+    try:
+        page = _request_dashboard_page()
+    except DashboardError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(page)
 
 
 @admin_pages.route("/qr/<id>/stats/update-style", methods=["POST"])
@@ -209,93 +616,11 @@ def update_style(id: str) -> Union[str, Response]:
         elif not check_password_hash(stats.password, received_password):
             return render_template("generic_error.html", error_message="Incorrect password! Please try again.")
 
-    # Extract QR styling options from form (same logic as generate function)
-    qr_style_config = {}
-    
-    # Basic options - use size if provided, otherwise fall back to width/height for backward compatibility
-    if request.form.get("qr_style_size"):
-        try:
-            qr_style_config["size"] = int(request.form.get("qr_style_size"))
-        except ValueError:
-            pass
-    elif request.form.get("qr_style_width"):
-        try:
-            size_value = int(request.form.get("qr_style_width"))
-            qr_style_config["size"] = size_value
-        except ValueError:
-            pass
-    
-    if request.form.get("qr_style_color_dark"):
-        qr_style_config["color_dark"] = request.form.get("qr_style_color_dark")
-    
-    if request.form.get("qr_style_color_light"):
-        qr_style_config["color_light"] = request.form.get("qr_style_color_light")
-    
-    if request.form.get("qr_style_dot_type"):
-        qr_style_config["dot_type"] = request.form.get("qr_style_dot_type")
-    
-    if request.form.get("qr_style_margin"):
-        try:
-            qr_style_config["margin"] = int(request.form.get("qr_style_margin"))
-        except ValueError:
-            pass
-    
-    # Advanced options
-    if request.form.get("qr_style_corner_square_type"):
-        qr_style_config["corner_square_type"] = request.form.get("qr_style_corner_square_type")
-    
-    if request.form.get("qr_style_corner_dot_type"):
-        qr_style_config["corner_dot_type"] = request.form.get("qr_style_corner_dot_type")
-    
-    if request.form.get("qr_style_logo_image", "").strip():
-        qr_style_config["logo_image"] = request.form.get("qr_style_logo_image").strip()
-    
-    if request.form.get("qr_style_logo_size"):
-        try:
-            qr_style_config["logo_size"] = float(request.form.get("qr_style_logo_size"))
-        except ValueError:
-            pass
-    
-    if request.form.get("qr_style_logo_margin"):
-        try:
-            qr_style_config["logo_margin"] = int(request.form.get("qr_style_logo_margin"))
-        except ValueError:
-            pass
-    
-    if request.form.get("qr_style_gradient_type", "").strip():
-        qr_style_config["gradient_type"] = request.form.get("qr_style_gradient_type").strip()
-        if request.form.get("qr_style_gradient_color_start", "").strip():
-            qr_style_config["gradient_color_start"] = request.form.get("qr_style_gradient_color_start").strip()
-        if request.form.get("qr_style_gradient_color_end", "").strip():
-            qr_style_config["gradient_color_end"] = request.form.get("qr_style_gradient_color_end").strip()
-        if request.form.get("qr_style_gradient_rotation"):
-            try:
-                qr_style_config["gradient_rotation"] = int(request.form.get("qr_style_gradient_rotation"))
-            except ValueError:
-                pass
-    
-    if request.form.get("qr_style_background_gradient_type", "").strip():
-        qr_style_config["background_gradient_type"] = request.form.get("qr_style_background_gradient_type").strip()
-        if request.form.get("qr_style_background_gradient_color_start", "").strip():
-            qr_style_config["background_gradient_color_start"] = request.form.get("qr_style_background_gradient_color_start").strip()
-        if request.form.get("qr_style_background_gradient_color_end", "").strip():
-            qr_style_config["background_gradient_color_end"] = request.form.get("qr_style_background_gradient_color_end").strip()
-        if request.form.get("qr_style_background_gradient_rotation"):
-            try:
-                qr_style_config["background_gradient_rotation"] = int(request.form.get("qr_style_background_gradient_rotation"))
-            except ValueError:
-                pass
-    
-    if request.form.get("qr_style_correct_level"):
-        qr_style_config["correct_level"] = request.form.get("qr_style_correct_level")
+    qr_style_config = parse_style_form(request.form)
 
     # Update association with new style config
-    if qr_style_config:
-        association.qr_style_config = json.dumps(qr_style_config)
-    else:
-        association.qr_style_config = None
-    
-    db.session.commit()
+    run_write(_set_style_config, id, json.dumps(qr_style_config) if qr_style_config is not None else None)
+    invalidate_key(id)
     logging.info(f"Updated QR style config for key {id}")
 
     return redirect(url_for("admin.stats", id=id))
@@ -331,12 +656,15 @@ def reset_stats(id: str) -> Union[str, Response]:
         elif not check_password_hash(stats.password, received_password):
             return render_template("generic_error.html", error_message="Incorrect password! Please try again.")
 
-    # Delete all impressions
-    for impression in stats.impressions:
-        db.session.delete(impression)
-    
-    db.session.commit()
-    logging.info(f"Reset stats for key {id}")
+    stats_id = stats.id
+    if run_in_background(stats_id):
+        job = start_job(f"Reset stats for key {id}",
+                        lambda job: delete_impressions(stats_id, on_progress=job.update),
+                        total=get_impression_count(stats_id))
+        return render_template("job.html", job=job, next_url=url_for("admin.stats", id=id))
+
+    deleted = delete_impressions(stats_id)
+    logging.info(f"Reset stats for key {id}, deleted {deleted} impressions")
 
     return redirect(url_for("admin.stats", id=id))
 
@@ -371,20 +699,121 @@ def delete_entry(id: str) -> Union[str, Response]:
         elif not check_password_hash(stats.password, received_password):
             return render_template("generic_error.html", error_message="Incorrect password! Please try again.")
 
+    stats_id = stats.id
+    if run_in_background(stats_id):
+        job = start_job(f"Delete entry for key {id}",
+                        lambda job: _delete_entry(id, stats_id, on_progress=job.update),
+                        total=get_impression_count(stats_id))
+        return render_template("job.html", job=job, next_url=url_for("admin.index"))
+
+    _delete_entry(id, stats_id)
+
+    return redirect(url_for("admin.index"))
+
+
+def _delete_entry(id: str, stats_id: int, on_progress: Optional[Callable[[int], None]] = None) -> None:
+    """
+    Delete the impressions, stats and association of a QR code.
+    
+    Args:
+        id: QR code key identifier
+        stats_id: Stats row of the key
+        on_progress: Optional callback receiving the number of impressions deleted so far
+    """
     # Delete all impressions first (they reference stats)
-    for impression in stats.impressions:
-        db.session.delete(impression)
+    delete_impressions(stats_id, on_progress=on_progress)
+    
+    # Delete stats (it references association), then the association
+    run_write(_delete_stats_and_association, id, stats_id)
+    invalidate_key(id)
+    logging.info(f"Deleted entry for key {id}")
+
+
+def _delete_stats_and_association(id: str, stats_id: int) -> None:
+    """
+    Delete and commit the stats and association rows of a QR code.
     
-    # Delete stats (it references association)
-    db.session.delete(stats)
+    Args:
+        id: QR code key identifier
+        stats_id: Stats row of the key
+    """
+    db.session.execute(delete(Stats).where(Stats.id == stats_id))
+    db.session.execute(delete(Association).where(Association.key == id))
+    db.session.commit()
+
+
+def _set_style_config(id: str, qr_style_config: Optional[str]) -> None:
+    """
+    Store and commit the QR style configuration of a key.
     
-    # Delete association
-    db.session.delete(association)
+    Args:
+        id: QR code key identifier
+        qr_style_config: JSON encoded style configuration, or None for defaults
+    """
+    db.session.execute(update(Association).where(Association.key == id).values(qr_style_config=qr_style_config))
+    db.session.commit()
+
+
+def _add_and_commit(*objects) -> None:
+    """
+    Add new objects to the session and commit them.
     
+    Args:
+        *objects: Transient model instances
+    """
+    db.session.add_all(objects)
     db.session.commit()
-    logging.info(f"Deleted entry for key {id}")
 
-    return redirect(url_for("admin.index"))
+
+def get_impression_count(stats_id: int) -> int:
+    """
+    Get the lifetime number of impressions of a key from the rollups.
+    
+    Args:
+        stats_id: Stats row of the key
+        
+    Returns:
+        int: Number of impressions
+    """
+    total = get_total(stats_id)
+    return total.count if total is not None else 0
+
+
+def run_in_background(stats_id: int) -> bool:
+    """
+    Decide whether deleting a key's impressions should run as a background job.
+    
+    Jobs are used when the form asks for it with `async=1`, or when the key has at
+    least `[maintenance] async_threshold` impressions (0 disables the automatic switch).
+    
+    Args:
+        stats_id: Stats row of the key
+        
+    Returns:
+        bool: True to start a background job
+    """
+    if request.form.get("async") == "1":
+        return True
+    threshold = maintenance_config.get("async_threshold", 0)
+    return threshold > 0 and get_impression_count(stats_id) >= threshold
+
+
+@admin_pages.route("/jobs/<job_id>", methods=["GET"])
+@home_pages.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id: str) -> Response:
+    """
+    API endpoint returning the progress of a background job as JSON.
+    
+    Args:
+        job_id: Job identifier
+        
+    Returns:
+        Response: JSON response with job status and progress
+    """
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
 
 
 @admin_pages.route("/", methods=["POST"])
@@ -401,24 +830,9 @@ def generate() -> Union[str, Response]:
     password = request.form.get("password", None)
 
     if not key:
-        already_exists = True
-        valid_chars = key_config["valid_characters"]
-        char_set = ""
-        if "ascii_lowercase" in valid_chars:
-            char_set += string.ascii_lowercase
-        if "digits" in valid_chars:
-            char_set += string.digits
-        if "ascii_uppercase" in valid_chars:
-            char_set += string.ascii_uppercase
-        key_length = key_config["length"]
-        attempts = 0
-        max_attempts = 100
-        while already_exists and attempts < max_attempts:
-            key = "".join(random.choice(char_set) for i in range(key_length))
-            already_exists = Association.query.filter_by(key=key).first() is not None
-            attempts += 1
-        
-        if attempts >= max_attempts:
+        try:
+            key = generate_unique_keys(1)[0]
+        except RuntimeError:
             logging.error("Failed to generate unique key after maximum attempts")
             qr_config = config.get("qr_code", {})
             return render_template("index.html", error="Failed to generate unique key. Please try again.", url=url, qr_config=qr_config)
@@ -428,100 +842,93 @@ def generate() -> Union[str, Response]:
             qr_config = config.get("qr_code", {})
             return render_template("index.html", error="Key already exists.", url=url, qr_config=qr_config)
 
-    # Extract QR styling options from form
-    qr_style_config = {}
-    default_qr_config = config.get("qr_code", {})
-    
-    # Basic options - use size if provided, otherwise fall back to width/height for backward compatibility
-    if request.form.get("qr_style_size"):
-        try:
-            qr_style_config["size"] = int(request.form.get("qr_style_size"))
-        except ValueError:
-            pass
-    elif request.form.get("qr_style_width"):
-        try:
-            size_value = int(request.form.get("qr_style_width"))
-            qr_style_config["size"] = size_value
-        except ValueError:
-            pass
-    
-    if request.form.get("qr_style_color_dark"):
-        qr_style_config["color_dark"] = request.form.get("qr_style_color_dark")
-    
-    if request.form.get("qr_style_color_light"):
-        qr_style_config["color_light"] = request.form.get("qr_style_color_light")
-    
-    if request.form.get("qr_style_dot_type"):
-        qr_style_config["dot_type"] = request.form.get("qr_style_dot_type")
-    
-    if request.form.get("qr_style_margin"):
-        try:
-            qr_style_config["margin"] = int(request.form.get("qr_style_margin"))
-        except ValueError:
-            pass
-    
-    # Advanced options
-    if request.form.get("qr_style_corner_square_type"):
-        qr_style_config["corner_square_type"] = request.form.get("qr_style_corner_square_type")
-    
-    if request.form.get("qr_style_corner_dot_type"):
-        qr_style_config["corner_dot_type"] = request.form.get("qr_style_corner_dot_type")
-    
-    if request.form.get("qr_style_logo_image", "").strip():
-        qr_style_config["logo_image"] = request.form.get("qr_style_logo_image").strip()
-    
-    if request.form.get("qr_style_logo_size"):
-        try:
-            qr_style_config["logo_size"] = float(request.form.get("qr_style_logo_size"))
-        except ValueError:
-            pass
-    
-    if request.form.get("qr_style_logo_margin"):
-        try:
-            qr_style_config["logo_margin"] = int(request.form.get("qr_style_logo_margin"))
-        except ValueError:
-            pass
-    
-    if request.form.get("qr_style_gradient_type", "").strip():
-        qr_style_config["gradient_type"] = request.form.get("qr_style_gradient_type").strip()
-        if request.form.get("qr_style_gradient_color_start", "").strip():
-            qr_style_config["gradient_color_start"] = request.form.get("qr_style_gradient_color_start").strip()
-        if request.form.get("qr_style_gradient_color_end", "").strip():
-            qr_style_config["gradient_color_end"] = request.form.get("qr_style_gradient_color_end").strip()
-        if request.form.get("qr_style_gradient_rotation"):
-            try:
-                qr_style_config["gradient_rotation"] = int(request.form.get("qr_style_gradient_rotation"))
-            except ValueError:
-                pass
-    
-    if request.form.get("qr_style_background_gradient_type", "").strip():
-        qr_style_config["background_gradient_type"] = request.form.get("qr_style_background_gradient_type").strip()
-        if request.form.get("qr_style_background_gradient_color_start", "").strip():
-            qr_style_config["background_gradient_color_start"] = request.form.get("qr_style_background_gradient_color_start").strip()
-        if request.form.get("qr_style_background_gradient_color_end", "").strip():
-            qr_style_config["background_gradient_color_end"] = request.form.get("qr_style_background_gradient_color_end").strip()
-        if request.form.get("qr_style_background_gradient_rotation"):
-            try:
-                qr_style_config["background_gradient_rotation"] = int(request.form.get("qr_style_background_gradient_rotation"))
-            except ValueError:
-                pass
-    
-    if request.form.get("qr_style_correct_level"):
-        qr_style_config["correct_level"] = request.form.get("qr_style_correct_level")
-
-    # Only store non-empty config
-    qr_style_config_to_store = qr_style_config if qr_style_config else None
-
-    association = Association(key, url, qr_style_config_to_store)
+    association = Association(key, url, parse_style_form(request.form))
     stats = Stats(key, generate_password_hash(password) if password is not None else None)
     association.stats = stats
 
-    db.session.add(association)
-    db.session.add(stats)
-    db.session.commit()
+    run_write(_add_and_commit, association, stats)
+    invalidate_key(key)
 
     logging.info(f"Generated key {key} for url {url}.")
     
     stats_url = url_for("admin.stats", id=key)
     logging.info(f"Redirecting to: {stats_url}")
     return redirect(stats_url)
+
+
+@admin_pages.route("/api/bulk-create", methods=["POST"])
+@home_pages.route("/api/bulk-create", methods=["POST"])
+def bulk_create_codes() -> Response:
+    """
+    API endpoint creating many QR codes at once.
+    
+    The body is either JSON (a list of codes, or {"codes": [...]}) or CSV with a
+    header row, sent as the request body with a text/csv content type or as an
+    uploaded "file". Each code has a "url" and optional "key", "password" and
+    QR style options.
+    
+    Returns:
+        Response: JSON response mapping each created key to its URL and stats page
+    """
+    upload = request.files.get("file")
+    if upload is not None:
+        data = upload.read().decode("utf-8-sig")
+        data_format = "csv" if (upload.filename or "").lower().endswith(".csv") else "json"
+    else:
+        data = request.get_data(as_text=True)
+        data_format = "csv" if request.mimetype == "text/csv" else "json"
+
+    try:
+        items = parse_items(data, data_format)
+        created = bulk_create(items, lambda key: url_for("admin.stats", id=key, _external=True))
+    except ProvisioningError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"created": created}), 201
+
+
+@admin_pages.route("/api/render", methods=["POST"])
+@home_pages.route("/api/render", methods=["POST"])
+def render_codes() -> Response:
+    """
+    API endpoint rendering the QR codes of many keys into a ZIP archive or a PDF print sheet.
+    
+    Options come as a JSON object or as form fields: "keys" (a list, or
+    comma-separated in a form), or "q" to filter on a substring of the key or
+    URL, or "all"; "format" (png, svg or pdf) and "layout" ("zip" or "sheet",
+    with "columns", "rows" and "page_size"). The output is streamed while the
+    codes are rendered, see `render_batch`.
+    
+    Returns:
+        Response: The ZIP archive or PDF document
+    """
+    options = request.get_json(silent=True)
+    if not isinstance(options, dict):
+        options = request.values.to_dict()
+    keys = options.get("keys")
+    if isinstance(keys, str):
+        keys = [key.strip() for key in keys.replace("\n", ",").split(",") if key.strip()]
+    search = (options.get("q") or "").strip() or None
+    if keys is None and search is None and str(options.get("all", "")).lower() not in ("1", "true"):
+        return jsonify({"error": "Give keys, a filter (q) or all"}), 400
+    layout = str(options.get("layout", "zip")).lower()
+    image_format = str(options.get("format", "png")).lower()
+
+    try:
+        chunks = render_batch(
+            _public_qr_url(""), keys=keys, search=search, image_format=image_format, layout=layout,
+            columns=int(options.get("columns", 3)), rows=int(options.get("rows", 4)),
+            page_size=str(options.get("page_size", "a4")),
+        )
+    except (BatchError, TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 501
+
+    filename, mimetype = ("qr-codes.pdf", "application/pdf") if layout == "sheet" else ("qr-codes.zip", "application/zip")
+    logging.info(f"Rendering QR codes as {layout} ({image_format})")
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}", "X-Accel-Buffering": "no"},
+    )
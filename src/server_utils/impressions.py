@@ -0,0 +1,334 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from flask import Flask, current_app
+from sqlalchemy import Table, delete, select
+from sqlalchemy.engine import Connection
+
+from src.server_utils.archive import delete_archive
+from src.server_utils.cache import invalidate_stats
+from src.server_utils.config import get_config
+from src.server_utils.db import Stats
+from src.server_utils.events import publish_scans
+from src.server_utils.partitions import impression_inserts, impression_partitions, prepare_partitions
+from src.server_utils.rollups import apply_rollups, clear_rollups
+from src.server_utils.shared import db
+from src.server_utils.sqlite import run_batched_write, run_write
+
+config = get_config()
+impression_config = config.get("impressions", {})
+maintenance_config = config.get("maintenance", {})
+
+
+def write_impressions(rows: List[Tuple[int, datetime]]) -> None:
+    """
+    Insert a batch of impressions and update the rollup counters in one transaction.
+
+    Args:
+        rows: List of (stats_id, datetime) tuples to record
+    """
+    if rows:
+        run_batched_write(_write_impressions, rows)
+        stats_ids = {stats_id for stats_id, _ in rows}
+        invalidate_stats(stats_ids)
+        publish_scans(stats_ids)
+
+
+def drop_deleted_keys(connection: Connection, rows: List[Tuple[int, datetime]]) -> List[Tuple[int, datetime]]:
+    """
+    Remove the scans of keys whose stats entry no longer exists.
+
+    The public server resolves a deleted key from its cache for up to
+    `[cache] resolution_ttl`, so its scans keep arriving for a while; writing
+    them would fail the whole batch on PostgreSQL and leave orphan rows for a
+    later key reusing the id on SQLite. Call it in the write transaction.
+
+    Args:
+        connection: Connection of the write transaction
+        rows: List of (stats_id, datetime) tuples about to be written
+
+    Returns:
+        List[Tuple[int, datetime]]: The rows of existing stats entries
+    """
+    stats_ids = {stats_id for stats_id, _ in rows}
+    existing = set(connection.execute(select(Stats.id).where(Stats.id.in_(stats_ids))).scalars())
+    if len(existing) == len(stats_ids):
+        return rows
+    kept = [row for row in rows if row[0] in existing]
+    logging.info(f"Dropped {len(rows) - len(kept)} scans of deleted keys")
+    return kept
+
+
+def _write_impressions(rows: List[Tuple[int, datetime]]) -> None:
+    """
+    Write a batch of impressions with the current session, see `write_impressions`.
+
+    Args:
+        rows: List of (stats_id, datetime) tuples to record
+    """
+    rows = drop_deleted_keys(db.session.connection(), rows)
+    if not rows:
+        db.session.commit()
+        return
+    prepare_partitions(db.session.connection(), rows)
+    for stmt, params in impression_inserts(rows, db.session.get_bind().dialect.name):
+        db.session.execute(stmt, params)
+    apply_rollups(rows)
+    db.session.commit()
+
+
+def delete_impressions(stats_id: int, batch_size: Optional[int] = None,
+                       on_progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Delete all impressions of a key in batches, then its archive and rollup counters.
+
+    Each batch is a set-based DELETE committed on its own, so the write lock is
+    only held for one batch at a time and scans can be recorded in between.
+    The rollup counters are cleared together with the impressions recorded
+    meanwhile (see `_finish_delete`), so every scan left is still counted.
+
+    Args:
+        stats_id: Stats row whose impressions are deleted
+        batch_size: Number of impressions deleted per transaction, defaults to `[maintenance] delete_batch_size`
+        on_progress: Optional callback receiving the number of impressions deleted so far
+
+    Returns:
+        int: Number of impressions deleted
+    """
+    if batch_size is None:
+        batch_size = maintenance_config.get("delete_batch_size", 5000)
+
+    with db.engine.connect() as connection:
+        partitions = impression_partitions(connection)
+
+    deleted = 0
+    for partition in partitions:
+        while True:
+            rowcount = run_write(_delete_impression_batch, partition.table, stats_id, batch_size)
+            deleted += rowcount
+            if on_progress is not None:
+                on_progress(deleted)
+            if rowcount < batch_size:
+                break
+
+    deleted += delete_archive(stats_id)
+    deleted += run_write(_finish_delete, stats_id)
+    if on_progress is not None:
+        on_progress(deleted)
+    invalidate_stats([stats_id])
+    publish_scans([stats_id])
+    return deleted
+
+
+def _delete_impression_batch(table: Table, stats_id: int, batch_size: int) -> int:
+    """
+    Delete and commit up to `batch_size` impressions of a key from one partition.
+
+    Args:
+        table: Partition to delete from
+        stats_id: Stats row whose impressions are deleted
+        batch_size: Maximum number of impressions deleted
+
+    Returns:
+        int: Number of impressions deleted
+    """
+    batch = (
+        select(table.c.id)
+        .where(table.c.stats_id == stats_id)
+        .limit(batch_size)
+        .scalar_subquery()
+    )
+    result = db.session.execute(
+        delete(table).where(table.c.stats_id == stats_id, table.c.id.in_(batch))
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def _finish_delete(stats_id: int) -> int:
+    """
+    Clear the rollup counters of a key and delete its remaining impressions, then commit.
+
+    The counters are cleared first: a scan written concurrently is either
+    committed before the DELETE and removed with them, or waits for the
+    cleared counters and keeps both its impression and its count.
+
+    Args:
+        stats_id: Stats row whose impressions are deleted
+
+    Returns:
+        int: Number of impressions recorded since the batched delete and deleted
+    """
+    clear_rollups(stats_id)
+    deleted = 0
+    for partition in impression_partitions(db.session.connection()):
+        table = partition.table
+        deleted += db.session.execute(delete(table).where(table.c.stats_id == stats_id)).rowcount
+    db.session.commit()
+    return deleted
+
+
+class ImpressionBuffer:
+    """
+    Bounded in-process queue of scans that a background thread bulk-inserts.
+
+    Scans are flushed every `flush_interval` seconds or as soon as `batch_size`
+    rows are waiting, whichever comes first. When the queue is full, callers
+    block for up to `put_timeout` seconds before giving up.
+    """
+
+    def __init__(self, app: Flask, max_size: int = 10000, flush_interval: float = 0.5,
+                 batch_size: int = 500, put_timeout: float = 0.1) -> None:
+        """
+        Initialize the buffer without starting the flusher thread.
+
+        Args:
+            app: Flask application whose context is used to write to the database
+            max_size: Maximum number of scans waiting in the queue
+            flush_interval: Maximum time in seconds a scan waits before being written
+            batch_size: Number of queued scans that triggers an immediate flush
+            put_timeout: Time in seconds a producer blocks on a full queue
+        """
+        self.app = app
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self._queue: "queue.Queue[Tuple[int, datetime]]" = queue.Queue(maxsize=max_size)
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, app: Flask) -> "ImpressionBuffer":
+        """
+        Build a buffer from the `[impressions]` section of config.toml.
+
+        Args:
+            app: Flask application whose context is used to write to the database
+
+        Returns:
+            ImpressionBuffer: Configured, not yet started buffer
+        """
+        return cls(
+            app,
+            max_size=impression_config.get("queue_size", 10000),
+            flush_interval=impression_config.get("flush_interval_ms", 500) / 1000,
+            batch_size=impression_config.get("flush_batch_size", 500),
+            put_timeout=impression_config.get("put_timeout_ms", 100) / 1000,
+        )
+
+    def start(self) -> None:
+        """
+        Start the background flusher and register a flush at interpreter exit.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="impression-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def put(self, stats_id: int, when: datetime) -> bool:
+        """
+        Queue a scan for the next flush.
+
+        Args:
+            stats_id: Stats row the impression belongs to
+            when: Timestamp of the scan
+
+        Returns:
+            bool: True if queued, False if the queue stayed full or the buffer is stopped
+        """
+        if self._stopping.is_set():
+            return False
+        try:
+            self._queue.put((stats_id, when), timeout=self.put_timeout)
+        except queue.Full:
+            logging.warning("Impression buffer full, writing scan synchronously")
+            return False
+        return True
+
+    def stop(self) -> None:
+        """
+        Stop the flusher thread and write any scans still in the queue.
+        """
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._flush(self._drain())
+
+    def _drain(self, limit: Optional[int] = None) -> List[Tuple[int, datetime]]:
+        """
+        Take queued scans without blocking.
+
+        Args:
+            limit: Maximum number of scans to take, or None for all
+
+        Returns:
+            List[Tuple[int, datetime]]: The scans removed from the queue
+        """
+        rows = []
+        while limit is None or len(rows) < limit:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self) -> None:
+        """
+        Flusher loop: collect up to `batch_size` scans or wait `flush_interval`, then write.
+        """
+        while not self._stopping.is_set():
+            rows = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size and not self._stopping.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                rows.extend(self._drain(self.batch_size - len(rows)))
+            self._flush(rows)
+
+    def _flush(self, rows: List[Tuple[int, datetime]]) -> None:
+        """
+        Write a batch of scans, logging instead of raising on failure.
+
+        Args:
+            rows: List of (stats_id, datetime) tuples to record
+        """
+        if not rows:
+            return
+        with self.app.app_context():
+            for attempt in range(2):
+                try:
+                    write_impressions(rows)
+                    return
+                except Exception:
+                    db.session.rollback()
+                    # Retried once, as a key of the batch may have been deleted
+                    # between the check for deleted keys and the insert
+                    if attempt:
+                        logging.exception(f"Failed to flush {len(rows)} buffered impressions")
+
+
+def record_impression(stats_id: int) -> None:
+    """
+    Record a scan, through the impression buffer if one is running for this app.
+
+    Args:
+        stats_id: Stats row the impression belongs to
+    """
+    now = datetime.now()
+    buffer = current_app.extensions.get("impression_buffer")
+    if buffer is not None and buffer.put(stats_id, now):
+        return
+    write_impressions([(stats_id, now)])
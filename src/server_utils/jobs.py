@@ -0,0 +1,124 @@
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional
+
+from flask import current_app
+
+from src.server_utils.shared import db
+
+# Finished jobs are forgotten once more than this many jobs have been started
+MAX_JOBS = 100
+
+
+class Job:
+    """
+    Progress of a long-running admin operation executed on a background thread.
+    """
+
+    def __init__(self, description: str, total: Optional[int] = None) -> None:
+        """
+        Initialize a pending job.
+
+        Args:
+            description: Human readable description of the operation
+            total: Expected number of work items, if known
+        """
+        self.id = uuid.uuid4().hex
+        self.description = description
+        self.status = "pending"
+        self.done = 0
+        self.total = total
+        self.error: Optional[str] = None
+        self.created_at = datetime.now()
+        self.finished_at: Optional[datetime] = None
+
+    def update(self, done: int) -> None:
+        """
+        Record how many work items have been processed so far.
+
+        Args:
+            done: Number of processed work items
+        """
+        self.done = done
+
+    def to_dict(self) -> dict:
+        """
+        Get the job state as a JSON serializable dictionary.
+
+        Returns:
+            dict: Job state
+        """
+        return {
+            "id": self.id,
+            "description": self.description,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+_jobs: "OrderedDict[str, Job]" = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+def start_job(description: str, target: Callable[[Job], None], total: Optional[int] = None) -> Job:
+    """
+    Run a function on a background thread inside the current application's context.
+
+    Args:
+        description: Human readable description of the operation
+        target: Function receiving the Job, expected to call `job.update` as it progresses
+        total: Expected number of work items, if known
+
+    Returns:
+        Job: The started job
+    """
+    app = current_app._get_current_object()
+    job = Job(description, total=total)
+
+    def run():
+        with app.app_context():
+            job.status = "running"
+            try:
+                target(job)
+                job.status = "done"
+                logging.info(f"Job {job.id} finished: {description}")
+            except Exception as e:
+                db.session.rollback()
+                job.status = "failed"
+                job.error = str(e)
+                logging.exception(f"Job {job.id} failed: {description}")
+            finally:
+                job.finished_at = datetime.now()
+
+    with _jobs_lock:
+        _jobs[job.id] = job
+        while len(_jobs) > MAX_JOBS:
+            oldest = next(iter(_jobs.values()))
+            if oldest.finished_at is None:
+                break
+            _jobs.popitem(last=False)
+
+    threading.Thread(target=run, name=f"job-{job.id}", daemon=True).start()
+    logging.info(f"Started job {job.id}: {description}")
+    return job
+
+
+def get_job(job_id: str) -> Optional[Job]:
+    """
+    Look up a job started in this process.
+
+    Args:
+        job_id: Job identifier
+
+    Returns:
+        Optional[Job]: The job, or None if unknown or forgotten
+    """
+    with _jobs_lock:
+        return _jobs.get(job_id)
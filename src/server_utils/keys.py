@@ -0,0 +1,309 @@
+import hashlib
+import hmac
+import secrets
+import string
+import threading
+from abc import ABC, abstractmethod
+from typing import Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from src.server_utils.config import get_config
+from src.server_utils.db import Association, KeySequence
+from src.server_utils.shared import db
+from src.server_utils.sqlite import run_write
+
+config = get_config()
+key_config = config["key_generation"]
+
+# Keys checked per IN (...) query, kept below SQLite's bound parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+
+def key_charset() -> str:
+    """
+    Build the set of characters keys are generated from, per `[key_generation] valid_characters`.
+
+    Returns:
+        str: Allowed characters
+    """
+    valid_chars = key_config["valid_characters"]
+    char_set = ""
+    if "ascii_lowercase" in valid_chars:
+        char_set += string.ascii_lowercase
+    if "digits" in valid_chars:
+        char_set += string.digits
+    if "ascii_uppercase" in valid_chars:
+        char_set += string.ascii_uppercase
+    return char_set
+
+
+class KeyGenerator(ABC):
+    """
+    Strategy producing candidate keys of `[key_generation] length` characters.
+    """
+
+    def __init__(self, char_set: str, length: int) -> None:
+        """
+        Initialize the generator.
+
+        Args:
+            char_set: Characters keys are made of
+            length: Number of characters per key
+        """
+        self.char_set = char_set
+        self.length = length
+
+    @abstractmethod
+    def candidates(self, count: int) -> List[str]:
+        """
+        Produce candidate keys, not yet checked against the database.
+
+        Args:
+            count: Number of candidates
+
+        Returns:
+            List[str]: Candidate keys
+        """
+
+
+class RandomKeyGenerator(KeyGenerator):
+    """
+    Uniformly random keys drawn with `secrets`.
+
+    Collisions become likely once a noticeable share of the keyspace is used;
+    they are resolved by checking each batch of candidates with one query.
+    """
+
+    def candidates(self, count: int) -> List[str]:
+        return ["".join(secrets.choice(self.char_set) for _ in range(self.length)) for _ in range(count)]
+
+
+class SequenceKeyGenerator(KeyGenerator):
+    """
+    Keys encoding a persistent counter through a keyed Feistel permutation.
+
+    The counter is stored in the key_sequences table and reserved in blocks of
+    `[key_generation] sequence_block_size`, so most keys cost no database round
+    trip. The permutation is a bijection over all `len(char_set) ** length`
+    keys, so generated keys never collide with each other and look random
+    without revealing how many codes exist. Its secret is stored with the
+    counter, so it survives restarts and SECRET_KEY rotation. Changing the
+    charset or length starts a new sequence.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, char_set: str, length: int, block_size: int = 100) -> None:
+        """
+        Initialize the generator without touching the database.
+
+        Args:
+            char_set: Characters keys are made of
+            length: Number of characters per key
+            block_size: Number of counter values reserved per database round trip
+        """
+        super().__init__(char_set, length)
+        self.block_size = block_size
+        self.domain = len(char_set) ** length
+        bits = max(2, (self.domain - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.name = f"keys:{length}:{char_set}"
+        self._secret: Optional[bytes] = None
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _reserve_block(self) -> None:
+        """
+        Reserve the next block of counter values on a separate short transaction.
+
+        The transaction runs on the SQLite writer thread when there is one, like
+        the other writes of the process.
+        """
+        start, secret = run_write(self._reserve)
+        if start >= self.domain:
+            raise RuntimeError(f"Key sequence exhausted all {self.domain} keys of length {self.length}")
+        self._secret = bytes.fromhex(secret)
+        self._next, self._end = start, min(start + self.block_size, self.domain)
+
+    def _reserve(self) -> Tuple[int, str]:
+        """
+        Reserve and commit the next block of counter values, creating the sequence if needed.
+
+        Returns:
+            Tuple[int, str]: First reserved counter value and the hex permutation secret
+        """
+        # The writer's own engine on the SQLite writer thread
+        engine = db.session.get_bind()
+        while True:
+            with engine.begin() as connection:
+                # Update first so the row is write-locked before it is read
+                result = connection.execute(
+                    update(KeySequence)
+                    .where(KeySequence.name == self.name)
+                    .values(next_value=KeySequence.next_value + self.block_size)
+                )
+                if result.rowcount:
+                    row = connection.execute(
+                        select(KeySequence.next_value, KeySequence.secret).where(KeySequence.name == self.name)
+                    ).one()
+                    return row.next_value - self.block_size, row.secret
+            try:
+                with engine.begin() as connection:
+                    secret = secrets.token_hex(32)
+                    connection.execute(insert(KeySequence).values(
+                        name=self.name, next_value=self.block_size, secret=secret
+                    ))
+                return 0, secret
+            except IntegrityError:
+                # Another process created the sequence concurrently, reserve from it
+                continue
+
+    def _round(self, index: int, value: int) -> int:
+        """
+        Feistel round function: a keyed hash of one half.
+
+        Args:
+            index: Round number
+            value: Half block
+
+        Returns:
+            int: Pseudo-random value of `half_bits` bits
+        """
+        message = bytes([index]) + value.to_bytes((self.half_bits + 7) // 8, "big")
+        digest = hmac.new(self._secret, message, hashlib.sha512).digest()
+        return int.from_bytes(digest, "big") & ((1 << self.half_bits) - 1)
+
+    def permute(self, value: int) -> int:
+        """
+        Map a counter value to a unique number below the keyspace size.
+
+        A balanced Feistel network permutes `2 * half_bits`-bit numbers; results
+        outside the keyspace are fed through again (cycle walking), which keeps
+        the mapping a bijection on [0, domain).
+
+        Args:
+            value: Counter value below the keyspace size
+
+        Returns:
+            int: Permuted value below the keyspace size
+        """
+        mask = (1 << self.half_bits) - 1
+        while True:
+            left, right = value >> self.half_bits, value & mask
+            for index in range(self.ROUNDS):
+                left, right = right, left ^ self._round(index, right)
+            value = (left << self.half_bits) | right
+            if value < self.domain:
+                return value
+
+    def encode(self, value: int) -> str:
+        """
+        Write a number as a fixed-length string over the charset.
+
+        Args:
+            value: Number below the keyspace size
+
+        Returns:
+            str: Key of `length` characters
+        """
+        base = len(self.char_set)
+        chars = []
+        for _ in range(self.length):
+            value, digit = divmod(value, base)
+            chars.append(self.char_set[digit])
+        return "".join(reversed(chars))
+
+    def candidates(self, count: int) -> List[str]:
+        keys = []
+        with self._lock:
+            while len(keys) < count:
+                if self._next >= self._end:
+                    self._reserve_block()
+                keys.append(self.encode(self.permute(self._next)))
+                self._next += 1
+        return keys
+
+
+KEY_GENERATORS = {
+    "random": RandomKeyGenerator,
+    "sequence": SequenceKeyGenerator,
+}
+
+_key_generator: Optional[KeyGenerator] = None
+
+
+def get_key_generator() -> KeyGenerator:
+    """
+    Get the key generator selected by `[key_generation] strategy`.
+
+    Returns:
+        KeyGenerator: Shared generator instance
+    """
+    global _key_generator
+    if _key_generator is None:
+        strategy = key_config.get("strategy", "random")
+        if strategy not in KEY_GENERATORS:
+            raise ValueError(f"Unknown key generation strategy: {strategy}. Expected one of {', '.join(KEY_GENERATORS)}")
+        kwargs = {}
+        if strategy == "sequence":
+            kwargs["block_size"] = key_config.get("sequence_block_size", 100)
+        _key_generator = KEY_GENERATORS[strategy](key_charset(), key_config["length"], **kwargs)
+    return _key_generator
+
+
+def existing_keys(keys: Iterable[str]) -> Set[str]:
+    """
+    Find which of the given keys are already used, with one query per chunk of keys.
+
+    Args:
+        keys: Keys to check
+
+    Returns:
+        Set[str]: The keys that already have an association
+    """
+    keys = list(keys)
+    found = set()
+    for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+        chunk = keys[start:start + LOOKUP_CHUNK_SIZE]
+        found.update(db.session.execute(
+            select(Association.key).where(Association.key.in_(chunk))
+        ).scalars())
+    return found
+
+
+def generate_unique_keys(count: int, reserved: Iterable[str] = (), max_rounds: int = 10) -> List[str]:
+    """
+    Generate keys that are unused and distinct from each other.
+
+    All candidates of a round are checked against the database together, so
+    collisions (with custom keys, or between random keys) cost one extra round
+    rather than one query per key.
+
+    Args:
+        count: Number of keys to generate
+        reserved: Keys that must not be returned, e.g. explicit keys of the same batch
+        max_rounds: Number of rounds before giving up
+
+    Returns:
+        List[str]: `count` unused keys
+
+    Raises:
+        RuntimeError: If not enough unused keys were found within `max_rounds`
+    """
+    generator = get_key_generator()
+    taken = set(reserved)
+    keys: List[str] = []
+    for _ in range(max_rounds):
+        missing = count - len(keys)
+        if missing <= 0:
+            break
+        candidates = set(generator.candidates(missing)) - taken
+        fresh = candidates - existing_keys(candidates)
+        keys.extend(fresh)
+        taken.update(candidates)
+    if len(keys) < count:
+        raise RuntimeError(f"Failed to generate {count} unique keys after {max_rounds} rounds")
+    return keys
@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import queue
+import random
+import weakref
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional
+
+from flask import Flask, Response, request
+
+# Logger of the per-scan lines of the redirects, sampled by `[logging] scan_sample_rate`
+SCAN_LOGGER = "qr_tracker.scans"
+
+# Attributes every LogRecord has; any other attribute was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_background_handlers: "weakref.WeakSet[BackgroundHandler]" = weakref.WeakSet()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line, with the fields passed through `extra`.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({name: value for name, value in vars(record).items() if name not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Let a random share of the records through.
+    """
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return random.random() < self.rate
+
+
+class _Listener(QueueListener):
+    """
+    Queue listener that waits for space for its stop sentinel rather than failing on a full queue.
+    """
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Handler passing records to other handlers, which run on a background thread.
+
+    Logging only appends the record to a bounded queue: its message is
+    formatted by the background thread, so log arguments must not be modified
+    afterwards, and records are dropped rather than waited for when the queue
+    is full, e.g. while the disk is full or stdout is slow. Closing the
+    handler, which `logging.shutdown` does at exit, writes the queued records.
+    """
+
+    def __init__(self, handlers: List[logging.Handler], queue_size: int = 10000) -> None:
+        """
+        Start the background thread.
+
+        Args:
+            handlers: Handlers writing the records
+            queue_size: Maximum number of records waiting to be written
+        """
+        super().__init__(queue.Queue(queue_size))
+        self.handlers = handlers
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._listener: Optional[_Listener] = None
+        self._start()
+        _background_handlers.add(self)
+
+    def _start(self) -> None:
+        self._listener = _Listener(self.queue, *self.handlers, respect_handler_level=True)
+        self._listener.start()
+
+    def _restart_after_fork(self) -> None:
+        # Neither the thread nor the queue's lock state survive a fork
+        self.queue = queue.Queue(self.queue_size)
+        self._start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is left to the background thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            # Writes the records still queued
+            listener.stop()
+            for handler in self.handlers:
+                handler.flush()
+        super().close()
+
+    def stats(self) -> Dict:
+        """
+        Get the queue occupancy and the number of dropped records.
+
+        Returns:
+            Dict: Counters suitable for JSON serialization
+        """
+        return {"queued": self.queue.qsize(), "queue_size": self.queue_size, "dropped": self.dropped}
+
+
+def _restart_background_handlers() -> None:
+    for handler in list(_background_handlers):
+        if handler._listener is not None:
+            handler._restart_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_background_handlers)
+
+
+def configure_logging(log_config: Dict) -> None:
+    """
+    Configure the root logger from the `[logging]` section.
+
+    Records are written to the console and to `filename`, as text with
+    `format` and `date_format` or, with `output = "json"`, as JSON lines.
+    With `queued`, they are written from a background thread (see
+    `BackgroundHandler`) so logging never blocks a request. The per-scan
+    lines of the redirects are sampled by `scan_sample_rate`.
+
+    Args:
+        log_config: `[logging]` section of config.toml
+    """
+    if log_config.get("output", "text") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(log_config.get("format"), log_config.get("date_format"))
+    handlers = [logging.StreamHandler(), logging.FileHandler(log_config.get("filename", "logs.log"))]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    if log_config.get("queued", False):
+        handlers = [BackgroundHandler(handlers, log_config.get("queue_size", 10000))]
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.setLevel(log_config.get("level", "INFO"))
+    for handler in handlers:
+        root.addHandler(handler)
+
+    scan_logger = logging.getLogger(SCAN_LOGGER)
+    for log_filter in scan_logger.filters[:]:
+        scan_logger.removeFilter(log_filter)
+    rate = log_config.get("scan_sample_rate", 1.0)
+    scan_logger.disabled = rate <= 0
+    if 0 < rate < 1:
+        scan_logger.addFilter(SampleFilter(rate))
+
+
+def log_requests(app: Flask) -> None:
+    """
+    Log the path, method, status and size of every response of an application.
+
+    The message is formatted lazily, and the fields are also passed separately
+    for `output = "json"`.
+
+    Args:
+        app: Flask application
+    """
+    @app.after_request
+    def log_after_request(response: Response) -> Response:
+        app.logger.info(
+            "path: %s | method: %s | status: %s | size: %s",
+            request.path, request.method, response.status_code, response.content_length,
+            extra={"path": request.path, "method": request.method, "status": response.status_code,
+                   "size": response.content_length},
+        )
+        return response
+
+
+def logging_stats() -> Optional[Dict]:
+    """
+    Get the counters of the background log writer of this process.
+
+    Returns:
+        Optional[Dict]: See `BackgroundHandler.stats`, or None when logging is not queued
+    """
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, BackgroundHandler):
+            return handler.stats()
+    return None
@@ -0,0 +1,57 @@
+"""Add unique key indexes and impressions (stats_id, datetime) index
+
+Revision ID: 8d2c5a7e41f6
+Revises: 
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2c5a7e41f6'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ("ix_associations_key", "associations", ["key"], True),
+    ("ix_stats_key", "stats", ["key"], True),
+    ("ix_impressions_stats_id_datetime", "impressions", ["stats_id", "datetime"], False),
+]
+
+
+def _existing_indexes(table):
+    return {index["name"] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def _check_unique(table, column):
+    # A duplicated key would make the unique index fail with an opaque error
+    duplicates = op.get_bind().execute(
+        sa.text(f"SELECT {column} FROM {table} GROUP BY {column} HAVING COUNT(*) > 1 LIMIT 10")
+    ).scalars().all()
+    if duplicates:
+        raise RuntimeError(f"Cannot add unique index on {table}.{column}, duplicated values: {duplicates}")
+
+
+def upgrade():
+    # Tables are created by db.create_all() at startup, which already adds these
+    # indexes on new databases, so only create the ones that are missing
+    for name, table, columns, unique in INDEXES:
+        if name in _existing_indexes(table):
+            continue
+        if unique:
+            _check_unique(table, columns[0])
+        # Build without holding a write lock on the table, so scans keep being
+        # recorded during the upgrade
+        with op.get_context().autocommit_block():
+            op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True)
+
+
+def downgrade():
+    for name, table, columns, unique in INDEXES:
+        if name in _existing_indexes(table):
+            with op.get_context().autocommit_block():
+                op.drop_index(name, table_name=table, postgresql_concurrently=True)
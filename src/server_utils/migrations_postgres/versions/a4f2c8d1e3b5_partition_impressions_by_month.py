@@ -0,0 +1,96 @@
+"""Convert impressions into a table partitioned by month
+
+Revision ID: a4f2c8d1e3b5
+Revises: 8d2c5a7e41f6
+Create Date: 2026-10-16 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4f2c8d1e3b5'
+down_revision = '8d2c5a7e41f6'
+branch_labels = None
+depends_on = None
+
+
+def _is_partitioned(bind):
+    return bind.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('impressions')"
+    )).first() is not None
+
+
+def _month_starts(first, last):
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        yield year, month
+        year, month = year + month // 12, month % 12 + 1
+
+
+def upgrade():
+    # Tables created by db.create_all() on new databases are already partitioned
+    bind = op.get_bind()
+    if _is_partitioned(bind):
+        return
+
+    # Copies every impression, so run it while the public service is stopped
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('impressions', 'id')")).scalar()
+    op.execute("ALTER TABLE impressions RENAME TO impressions_unpartitioned")
+    op.execute("ALTER INDEX IF EXISTS impressions_pkey RENAME TO impressions_unpartitioned_pkey")
+    op.execute("ALTER INDEX IF EXISTS ix_impressions_stats_id_datetime RENAME TO ix_impressions_unpartitioned_stats_id_datetime")
+    if sequence:
+        op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    else:
+        op.execute("CREATE SEQUENCE IF NOT EXISTS impressions_id_seq")
+        sequence = "impressions_id_seq"
+
+    op.execute(
+        f"CREATE TABLE impressions ("
+        f"id INTEGER NOT NULL DEFAULT nextval('{sequence}'), "
+        f"datetime TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+        f"stats_id INTEGER NOT NULL REFERENCES stats (id), "
+        f"PRIMARY KEY (id, datetime)"
+        f") PARTITION BY RANGE (datetime)"
+    )
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY impressions.id")
+    op.execute("CREATE INDEX ix_impressions_stats_id_datetime ON impressions (stats_id, datetime)")
+
+    first, last = bind.execute(sa.text("SELECT min(datetime), max(datetime) FROM impressions_unpartitioned")).first()
+    if first is not None:
+        for year, month in _month_starts(first, last):
+            next_year, next_month = year + month // 12, month % 12 + 1
+            op.execute(
+                f"CREATE TABLE impressions_{year:04d}_{month:02d} PARTITION OF impressions FOR VALUES "
+                f"FROM ('{year:04d}-{month:02d}-01') TO ('{next_year:04d}-{next_month:02d}-01')"
+            )
+        op.execute(
+            "INSERT INTO impressions (id, datetime, stats_id) "
+            "SELECT id, datetime, stats_id FROM impressions_unpartitioned WHERE datetime IS NOT NULL"
+        )
+    # Partitions of the current and next months are created by the app at startup
+    op.execute("DROP TABLE impressions_unpartitioned")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if not _is_partitioned(bind):
+        return
+
+    # Databases created partitioned have a sequence that is not owned by the column
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('impressions', 'id')")).scalar() or "impressions_id_seq"
+    op.execute("ALTER TABLE impressions RENAME TO impressions_partitioned")
+    op.execute("ALTER INDEX IF EXISTS impressions_pkey RENAME TO impressions_partitioned_pkey")
+    op.execute("ALTER INDEX IF EXISTS ix_impressions_stats_id_datetime RENAME TO ix_impressions_partitioned_stats_id_datetime")
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    op.execute(
+        f"CREATE TABLE impressions ("
+        f"id INTEGER NOT NULL DEFAULT nextval('{sequence}') PRIMARY KEY, "
+        f"datetime TIMESTAMP WITHOUT TIME ZONE, "
+        f"stats_id INTEGER NOT NULL REFERENCES stats (id))"
+    )
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY impressions.id")
+    op.execute("CREATE INDEX ix_impressions_stats_id_datetime ON impressions (stats_id, datetime)")
+    op.execute("INSERT INTO impressions (id, datetime, stats_id) SELECT id, datetime, stats_id FROM impressions_partitioned")
+    op.execute("DROP TABLE impressions_partitioned")
@@ -0,0 +1,59 @@
+"""Move impressions into monthly partition tables
+
+Revision ID: 5c1d7e9a2f40
+Revises: 3b8e1f0c9a27
+Create Date: 2026-10-16 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1d7e9a2f40'
+down_revision = '3b8e1f0c9a27'
+branch_labels = None
+depends_on = None
+
+
+def _bounds(year, month):
+    lower = f"{year:04d}-{month:02d}-01 00:00:00"
+    upper = f"{year + month // 12:04d}-{month % 12 + 1:02d}-01 00:00:00"
+    return lower, upper
+
+
+def _partitions(bind):
+    names = bind.execute(sa.text(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'impressions_[0-9][0-9][0-9][0-9]_[0-9][0-9]'"
+    )).scalars().all()
+    return sorted(names)
+
+
+def upgrade():
+    # Same layout as partitions.partition_table; new months are created by the app
+    bind = op.get_bind()
+    months = bind.execute(sa.text(
+        "SELECT DISTINCT strftime('%Y', datetime), strftime('%m', datetime) FROM impressions "
+        "WHERE datetime IS NOT NULL"
+    )).all()
+    for year, month in sorted((int(year), int(month)) for year, month in months):
+        name = f"impressions_{year:04d}_{month:02d}"
+        lower, upper = _bounds(year, month)
+        op.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} ("
+            f"id INTEGER NOT NULL, datetime DATETIME NOT NULL, stats_id INTEGER NOT NULL, "
+            f"PRIMARY KEY (id), FOREIGN KEY(stats_id) REFERENCES stats (id))"
+        )
+        op.execute(f"CREATE INDEX IF NOT EXISTS ix_{name}_stats_id_datetime ON {name} (stats_id, datetime)")
+        op.execute(
+            f"INSERT INTO {name} (datetime, stats_id) SELECT datetime, stats_id FROM impressions "
+            f"WHERE datetime >= '{lower}' AND datetime < '{upper}' ORDER BY datetime, id"
+        )
+        op.execute(f"DELETE FROM impressions WHERE datetime >= '{lower}' AND datetime < '{upper}'")
+
+
+def downgrade():
+    # Only possible if impressions still has its original single-column primary key
+    for name in _partitions(op.get_bind()):
+        op.execute(f"INSERT INTO impressions (datetime, stats_id) SELECT datetime, stats_id FROM {name} ORDER BY datetime, id")
+        op.execute(f"DROP TABLE {name}")
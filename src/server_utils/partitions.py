@@ -0,0 +1,403 @@
+import logging
+import re
+import threading
+from datetime import datetime
+from itertools import groupby
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, MetaData, Table, insert, select, text, union_all
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlalchemy.sql import FromClause
+
+from src.server_utils.config import get_config
+from src.server_utils.db import Impression, Stats
+
+config = get_config()
+partition_config = config.get("partitions", {})
+
+# Monthly partitions are named impressions_YYYY_MM
+PARTITION_NAME = re.compile(r"^impressions_(\d{4})_(\d{2})$")
+
+# Serializes partition DDL between the processes sharing a PostgreSQL database
+PARTITION_LOCK_ID = 727100001
+
+# Partition tables are kept out of db.metadata, so create_all and migrations ignore them
+_partition_metadata = MetaData()
+_partition_tables: Dict[str, Table] = {}
+# SQLite partitions this process has created or seen, so writes only emit DDL for new months
+_known_partitions: Set[str] = set()
+_lock = threading.Lock()
+
+
+class Partition(NamedTuple):
+    """
+    A table holding the impressions of a time range.
+
+    `lower` and `upper` are None for the unpartitioned `impressions` table,
+    which may hold rows of any time.
+    """
+    table: Table
+    lower: Optional[datetime]
+    upper: Optional[datetime]
+
+    def overlaps(self, start: Optional[datetime], end: Optional[datetime]) -> bool:
+        """
+        Check whether the partition can hold impressions in [start, end).
+
+        Args:
+            start: Inclusive start, or None
+            end: Exclusive end, or None
+
+        Returns:
+            bool: False only if the partition is known to hold no row of the range
+        """
+        if self.lower is None:
+            return True
+        return (end is None or self.lower < end) and (start is None or self.upper > start)
+
+
+def month_start(when: datetime) -> datetime:
+    """
+    Get the start of the month of a timestamp.
+
+    Args:
+        when: Naive server-local timestamp
+
+    Returns:
+        datetime: Midnight on the first day of its month
+    """
+    return datetime(when.year, when.month, 1)
+
+
+def next_month(month: datetime) -> datetime:
+    """
+    Get the start of the month after a month start.
+
+    Args:
+        month: Start of a month
+
+    Returns:
+        datetime: Start of the following month
+    """
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    """
+    Get the name of the partition holding a month.
+
+    Args:
+        month: Any timestamp of the month
+
+    Returns:
+        str: Table name, e.g. impressions_2026_10
+    """
+    return f"impressions_{month.year:04d}_{month.month:02d}"
+
+
+def partition_table(name: str) -> Table:
+    """
+    Get the table of a monthly partition, with the columns and index of `impressions`.
+
+    Args:
+        name: Partition table name
+
+    Returns:
+        Table: Table usable in queries, and to create the partition on SQLite
+    """
+    with _lock:
+        table = _partition_tables.get(name)
+        if table is None:
+            table = Table(
+                name,
+                _partition_metadata,
+                # On SQLite, id is the rowid of the partition; ids are only unique within a partition
+                Column("id", Integer, primary_key=True),
+                Column("datetime", DateTime, nullable=False),
+                Column("stats_id", Integer, ForeignKey(Stats.__table__.c.id), nullable=False),
+                Index(f"ix_{name}_stats_id_datetime", "stats_id", "datetime"),
+            )
+            _partition_tables[name] = table
+        return table
+
+
+def _partition(name: str) -> Optional[Partition]:
+    """
+    Build the Partition of a table name, if it is a monthly partition.
+    """
+    match = PARTITION_NAME.match(name)
+    if match is None:
+        return None
+    lower = datetime(int(match.group(1)), int(match.group(2)), 1)
+    return Partition(partition_table(name), lower, next_month(lower))
+
+
+def is_partitioned(connection: Connection) -> bool:
+    """
+    Check whether new impressions are stored in monthly partitions.
+
+    Always true on SQLite. On PostgreSQL, `impressions` must have been created as
+    a partitioned table, by db.create_all() or by the migration converting it.
+
+    Args:
+        connection: Database connection
+
+    Returns:
+        bool: True if monthly partitions are used
+    """
+    if connection.dialect.name != "postgresql":
+        return True
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('impressions')"
+    )).first() is not None
+
+
+def list_partitions(connection: Connection) -> List[Partition]:
+    """
+    List the tables holding impressions, oldest first.
+
+    On SQLite, the unpartitioned `impressions` table comes first: it holds the
+    rows written before partitioning was introduced, until they are moved by
+    `db upgrade`. On PostgreSQL, the monthly partitions of `impressions` are
+    listed, or `impressions` itself while it is not partitioned.
+
+    Args:
+        connection: Database connection
+
+    Returns:
+        List[Partition]: Tables holding impressions
+    """
+    if connection.dialect.name == "postgresql":
+        if not is_partitioned(connection):
+            return [Partition(Impression.__table__, None, None)]
+        names = connection.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'impressions'::regclass"
+        )).scalars().all()
+        legacy = []
+    else:
+        names = connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'impressions\\_%' ESCAPE '\\'"
+        )).scalars().all()
+        legacy = [Partition(Impression.__table__, None, None)]
+    partitions = [partition for partition in map(_partition, names) if partition is not None]
+    return legacy + sorted(partitions, key=lambda partition: partition.lower)
+
+
+def impression_partitions(connection: Connection, start: Optional[datetime] = None,
+                          end: Optional[datetime] = None) -> List[Partition]:
+    """
+    List the tables that can hold impressions in [start, end), oldest first.
+
+    Args:
+        connection: Database connection
+        start: Inclusive naive server-local start, or None
+        end: Exclusive naive server-local end, or None
+
+    Returns:
+        List[Partition]: Tables to read
+    """
+    return [partition for partition in list_partitions(connection) if partition.overlaps(start, end)]
+
+
+def impression_source(connection: Connection, start: Optional[datetime] = None,
+                      end: Optional[datetime] = None) -> FromClause:
+    """
+    Get a selectable with the `id`, `datetime` and `stats_id` columns of the impressions in [start, end).
+
+    On PostgreSQL this is the partitioned `impressions` table, which prunes
+    partitions itself. On SQLite it is a UNION ALL of the tables overlapping the
+    range, so old months are not touched by queries on recent ones. Callers
+    must still filter on `datetime`.
+
+    Args:
+        connection: Database connection
+        start: Inclusive naive server-local start, or None
+        end: Exclusive naive server-local end, or None
+
+    Returns:
+        FromClause: Table or subquery to select impressions from
+    """
+    if connection.dialect.name == "postgresql":
+        return Impression.__table__
+    partitions = impression_partitions(connection, start, end)
+    if len(partitions) == 1:
+        return partitions[0].table
+    return union_all(*(
+        select(partition.table.c.id, partition.table.c.datetime, partition.table.c.stats_id)
+        for partition in partitions
+    )).subquery("impressions")
+
+
+def _create_sqlite_partition(connection: Connection, month: datetime) -> None:
+    """
+    Create the partition of a month on SQLite, if it does not exist yet.
+    """
+    table = partition_table(partition_name(month))
+    connection.execute(CreateTable(table, if_not_exists=True))
+    for index in table.indexes:
+        connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _create_postgres_partition(connection: Connection, month: datetime) -> None:
+    """
+    Create and attach the partition of a month on PostgreSQL, if it does not exist yet.
+
+    `CREATE TABLE ... PARTITION OF` locks the whole `impressions` table, which
+    would block scans from being recorded. Instead the partition is created on
+    its own, with a CHECK constraint matching its range so attaching it does not
+    scan it, then attached, which only takes a lock that writes do not conflict
+    with. Must run in a transaction.
+    """
+    name = partition_name(month)
+    bounds = f"FROM ('{month.isoformat(' ')}') TO ('{next_month(month).isoformat(' ')}')"
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {name} "
+        f"(LIKE impressions INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING INDEXES)"
+    ))
+    connection.execute(text(
+        f"ALTER TABLE {name} DROP CONSTRAINT IF EXISTS {name}_range, ADD CONSTRAINT {name}_range "
+        f"CHECK (datetime >= '{month.isoformat(' ')}' AND datetime < '{next_month(month).isoformat(' ')}')"
+    ))
+    connection.execute(text(f"ALTER TABLE impressions ATTACH PARTITION {name} FOR VALUES {bounds}"))
+
+
+def create_partitions(engine: Engine, months: Iterable[datetime]) -> List[str]:
+    """
+    Create the monthly partitions of some months that do not exist yet.
+
+    On PostgreSQL, each partition is created in its own transaction that waits
+    at most `[partitions] lock_timeout_ms` for locks; a partition that could not
+    be created is logged and left for the next call. Nothing is created on
+    PostgreSQL while `impressions` is not partitioned.
+
+    Partitions are created on connections of `engine`, so callers serving
+    requests on SQLite run this through `run_write` (see `sweep_impressions`);
+    `create_app` calls it before any request is served. Writes create the
+    partition of their month on the writer thread (see `prepare_partitions`).
+
+    Args:
+        engine: Engine of the database
+        months: Any timestamp of each month
+
+    Returns:
+        List[str]: Names of the partitions created
+    """
+    from sqlalchemy.exc import DBAPIError
+
+    months = sorted({month_start(month) for month in months})
+    with engine.connect() as connection:
+        existing = {partition.table.name for partition in list_partitions(connection)}
+        partitioned = is_partitioned(connection)
+    if not partitioned:
+        logging.warning("impressions is not partitioned yet, run `qr-tracker db upgrade`")
+        return []
+
+    created = []
+    for month in months:
+        name = partition_name(month)
+        if name in existing:
+            continue
+        try:
+            with engine.begin() as connection:
+                if engine.dialect.name == "postgresql":
+                    lock_timeout = int(partition_config.get("lock_timeout_ms", 2000))
+                    connection.execute(text(f"SET LOCAL lock_timeout = {lock_timeout}"))
+                    connection.execute(text(f"SELECT pg_advisory_xact_lock({PARTITION_LOCK_ID})"))
+                    if name in {partition.table.name for partition in list_partitions(connection)}:
+                        continue
+                    _create_postgres_partition(connection, month)
+                else:
+                    _create_sqlite_partition(connection, month)
+        except DBAPIError:
+            logging.exception(f"Failed to create impression partition {name}, retrying at the next sweep")
+            continue
+        created.append(name)
+        logging.info(f"Created impression partition {name}")
+    with _lock:
+        _known_partitions.update(created)
+    return created
+
+
+def ensure_partitions(engine: Engine, now: Optional[datetime] = None) -> List[str]:
+    """
+    Create the partitions of the current month and the next `[partitions] premake_months`.
+
+    Args:
+        engine: Engine of the database
+        now: Current time, defaults to `datetime.now()`
+
+    Returns:
+        List[str]: Names of the partitions created
+    """
+    month = month_start(now or datetime.now())
+    months = [month]
+    for _ in range(int(partition_config.get("premake_months", 2))):
+        months.append(next_month(months[-1]))
+    return create_partitions(engine, months)
+
+
+def _month_groups(rows: Iterable[Tuple[int, datetime]]) -> Iterator[Tuple[datetime, List[Tuple[int, datetime]]]]:
+    """
+    Group rows by the month of their timestamp, oldest month first.
+    """
+    rows = sorted(rows, key=lambda row: (row[1].year, row[1].month))
+    for _, group in groupby(rows, key=lambda row: (row[1].year, row[1].month)):
+        group = list(group)
+        yield month_start(group[0][1]), group
+
+
+def prepare_partitions(connection: Connection, rows: Iterable[Tuple[int, datetime]]) -> None:
+    """
+    Create the SQLite partitions that rows are about to be written to, in the current transaction.
+
+    Does nothing on PostgreSQL, whose partitions are created ahead of time by
+    `ensure_partitions` and routed by the database.
+
+    Args:
+        connection: Connection the rows are written with
+        rows: (stats_id, datetime) tuples to be written
+    """
+    if connection.dialect.name == "postgresql":
+        return
+    for month, _ in _month_groups(rows):
+        name = partition_name(month)
+        if name in _known_partitions:
+            continue
+        _create_sqlite_partition(connection, month)
+        with _lock:
+            _known_partitions.add(name)
+
+
+def forget_partition(name: str) -> None:
+    """
+    Forget that a partition exists after it was dropped, so writes recreate it if needed.
+
+    Args:
+        name: Partition table name
+    """
+    with _lock:
+        _known_partitions.discard(name)
+
+
+def impression_inserts(rows: Iterable[Tuple[int, datetime]], dialect_name: str) -> List[Tuple[Any, List[Dict]]]:
+    """
+    Build the statements inserting a batch of impressions.
+
+    On SQLite, rows are inserted into the partition of their month, which must
+    exist (see `prepare_partitions`); on PostgreSQL into `impressions`.
+
+    Args:
+        rows: (stats_id, datetime) tuples to record
+        dialect_name: SQLAlchemy dialect name of the database
+
+    Returns:
+        List[Tuple[Any, List[Dict]]]: (statement, parameters) pairs to execute in order
+    """
+    if dialect_name == "postgresql":
+        return [(insert(Impression), [{"stats_id": stats_id, "datetime": when} for stats_id, when in rows])]
+    return [
+        (insert(partition_table(partition_name(month))), [{"stats_id": stats_id, "datetime": when} for stats_id, when in group])
+        for month, group in _month_groups(rows)
+    ]
@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from src.server_utils.config import get_config
+
+config = get_config()
+
+# Settings read from [database.pool] / [database.pool.<mode>] and passed to create_engine
+POOL_OPTIONS = (
+    "pool_size",
+    "max_overflow",
+    "pool_timeout",
+    "pool_recycle",
+    "pool_pre_ping",
+)
+
+# Number of recent checkouts the wait time percentiles are computed over
+RECENT_CHECKOUTS = 1000
+
+
+def pool_options(mode: str, overrides: Optional[dict] = None) -> dict:
+    """
+    Build connection pool settings for a server mode.
+
+    Values set directly in `[database.pool]` apply to every mode and are
+    overridden by the `[database.pool.<mode>]` section, then by any non-None
+    value in `overrides` (typically CLI flags).
+
+    Args:
+        mode: "public" or "admin"
+        overrides: Option name to value mapping, None values are ignored
+
+    Returns:
+        dict: Keyword arguments for `create_engine`
+    """
+    section = config.get("database", {}).get("pool", {})
+    options = {name: section[name] for name in POOL_OPTIONS if name in section}
+    mode_section = section.get(mode, {})
+    options.update({name: mode_section[name] for name in POOL_OPTIONS if name in mode_section})
+    for name, value in (overrides or {}).items():
+        if name not in POOL_OPTIONS:
+            raise ValueError(f"Unknown connection pool option: {name}")
+        if value is not None:
+            options[name] = value
+    return options
+
+
+class PoolMetrics:
+    """
+    Thread-safe record of how long connection checkouts waited on a pool.
+    """
+
+    def __init__(self, recent: int = RECENT_CHECKOUTS) -> None:
+        """
+        Initialize empty counters.
+
+        Args:
+            recent: Number of recent wait times kept for percentiles
+        """
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._recent: Deque[float] = deque(maxlen=recent)
+        self._lock = threading.Lock()
+
+    def record(self, wait: float, timed_out: bool = False) -> None:
+        """
+        Record a checkout.
+
+        Args:
+            wait: Seconds the checkout took
+            timed_out: Whether it gave up after `pool_timeout`
+        """
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self._recent.append(wait)
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def stats(self) -> dict:
+        """
+        Get checkout counters and wait times in milliseconds.
+
+        Returns:
+            dict: Counters suitable for JSON serialization
+        """
+        with self._lock:
+            recent = sorted(self._recent)
+            attempts = self.checkouts + self.timeouts
+            counters = {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms_mean": self.wait_total / attempts * 1000 if attempts else 0.0,
+                "wait_ms_max": self.wait_max * 1000,
+            }
+        for name, fraction in (("wait_ms_p50", 0.5), ("wait_ms_p99", 0.99)):
+            counters[name] = recent[max(0, int(len(recent) * fraction) - 1)] * 1000 if recent else 0.0
+        return counters
+
+
+class _TimedPoolMixin:
+    """
+    Times every connection checkout of a queue pool in its `metrics`.
+
+    The time includes waiting for a free connection, opening a new one and the
+    pre-ping, so pool starvation shows up as growing wait times and timeouts.
+    """
+
+    metrics: PoolMetrics
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self):
+        # Keep the counters when the engine is disposed, e.g. before forking workers
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except TimeoutError:
+            self.metrics.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - started)
+        return connection
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    """
+    QueuePool recording checkout wait times.
+    """
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    """
+    AsyncAdaptedQueuePool recording checkout wait times, for async engines.
+    """
+
+
+def pool_stats(engine: Engine) -> Optional[Dict]:
+    """
+    Get the occupancy and checkout wait times of an engine's connection pool.
+
+    Args:
+        engine: Engine created with a timed pool class
+
+    Returns:
+        Optional[Dict]: Pool counters, or None if the pool is not instrumented
+    """
+    pool = engine.pool
+    if not isinstance(pool, _TimedPoolMixin):
+        return None
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        **pool.metrics.stats(),
+    }
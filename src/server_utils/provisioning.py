@@ -0,0 +1,205 @@
+import csv
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from src.server_utils.cache import invalidate_key
+from src.server_utils.config import get_config
+from src.server_utils.db import Association, Stats
+from src.server_utils.keys import existing_keys, generate_unique_keys
+from src.server_utils.shared import db
+from src.server_utils.sqlite import run_write
+from src.server_utils.styles import STYLE_FIELDS
+
+config = get_config()
+provisioning_config = config.get("provisioning", {})
+
+
+class ProvisioningError(ValueError):
+    """
+    Raised when a bulk creation request is invalid or conflicts with existing keys.
+    """
+
+
+def _style_from_item(item: Dict) -> Optional[Dict]:
+    """
+    Extract the QR style options of a request item.
+
+    Style options can be given in a nested "style" object or as top-level fields
+    (the only option for CSV input). Values are converted to the type of the
+    matching config.toml default, and empty values are ignored.
+
+    Args:
+        item: One code of the request
+
+    Returns:
+        Optional[Dict]: Style options, or None if there are none
+    """
+    values = dict(item.get("style") or {})
+    values.update({name: value for name, value in item.items() if name in STYLE_FIELDS})
+
+    style = {}
+    for name, value in values.items():
+        if name not in STYLE_FIELDS:
+            raise ProvisioningError(f"Unknown style option: {name}")
+        if value is None or value == "":
+            continue
+        try:
+            style[name] = STYLE_FIELDS[name](value)
+        except (TypeError, ValueError):
+            raise ProvisioningError(f"Invalid value for {name}: {value!r}")
+    return style or None
+
+
+def parse_items(data: str, data_format: str) -> List[Dict]:
+    """
+    Parse the body of a bulk creation request.
+
+    JSON input is a list of objects, or an object with a "codes" list. CSV input
+    has a header row; "url" is required and "key", "password" and any style
+    option are optional columns.
+
+    Args:
+        data: Request body
+        data_format: "json" or "csv"
+
+    Returns:
+        List[Dict]: One dictionary per code to create
+    """
+    if data_format == "json":
+        try:
+            items = json.loads(data)
+        except ValueError as e:
+            raise ProvisioningError(f"Invalid JSON: {e}")
+        if isinstance(items, dict):
+            items = items.get("codes")
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ProvisioningError("Expected a list of objects or an object with a 'codes' list")
+        return items
+    if data_format == "csv":
+        return list(csv.DictReader(io.StringIO(data)))
+    raise ProvisioningError(f"Unsupported format: {data_format}")
+
+
+def _hash_passwords(passwords: List[Optional[str]]) -> List[Optional[str]]:
+    """
+    Hash passwords on a thread pool.
+
+    Werkzeug's hashing runs in hashlib, which releases the GIL while deriving
+    keys, so the hashes are computed in parallel.
+
+    Args:
+        passwords: Plain text passwords, None for codes without one
+
+    Returns:
+        List[Optional[str]]: Password hashes in the same order
+    """
+    to_hash = [password for password in passwords if password is not None]
+    if not to_hash:
+        return list(passwords)
+    workers = provisioning_config.get("hash_workers", 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        hashes = iter(executor.map(generate_password_hash, to_hash))
+    return [next(hashes) if password is not None else None for password in passwords]
+
+
+def _insert_codes(keys: List[str], urls: List[str], styles: List[Optional[Dict]],
+                  password_hashes: List[Optional[str]]) -> None:
+    """
+    Insert associations and their stats in batches of `[provisioning] insert_batch_size`, then commit once.
+
+    Args:
+        keys: Key of each code
+        urls: Target URL of each code
+        styles: Style options of each code
+        password_hashes: Password hash of each code
+
+    Raises:
+        ProvisioningError: If a key was created by another request since it was checked
+    """
+    batch_size = provisioning_config.get("insert_batch_size", 500)
+    try:
+        for start in range(0, len(keys), batch_size):
+            batch = range(start, min(start + batch_size, len(keys)))
+            for i in batch:
+                association = Association(keys[i], urls[i], styles[i])
+                association.stats = Stats(keys[i], password_hashes[i])
+                db.session.add(association)
+            db.session.flush()
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        conflicts = existing_keys(keys)
+        if not conflicts:
+            raise
+        raise ProvisioningError(f"Keys already exist: {', '.join(sorted(conflicts))}")
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def bulk_create(items: List[Dict], stats_url_for: Callable[[str], str]) -> List[Dict]:
+    """
+    Create many QR code associations in one transaction.
+
+    Explicit keys are checked against existing ones with one set-based query,
+    missing keys are generated in one pass, and rows are inserted in batches of
+    `[provisioning] insert_batch_size` before a single commit. Nothing is
+    created if any item is invalid, or if another request creates one of the
+    keys between the check and the insert.
+
+    Args:
+        items: Codes to create, each with "url" and optional "key", "password" and style options
+        stats_url_for: Function building the stats page URL of a key
+
+    Returns:
+        List[Dict]: One {"key", "url", "stats_url"} mapping per item, in request order
+    """
+    max_items = provisioning_config.get("max_items", 10000)
+    if not items:
+        raise ProvisioningError("No codes to create")
+    if len(items) > max_items:
+        raise ProvisioningError(f"Too many codes in one request: {len(items)} (maximum {max_items})")
+
+    urls = []
+    explicit_keys = []
+    styles = []
+    passwords = []
+    for index, item in enumerate(items):
+        url = (item.get("url") or "").strip()
+        if not url:
+            raise ProvisioningError(f"Item {index}: missing url")
+        urls.append(url)
+        explicit_keys.append((item.get("key") or "").strip() or None)
+        styles.append(_style_from_item({name: value for name, value in item.items() if name not in ("url", "key", "password")}))
+        passwords.append(item.get("password") or None)
+
+    requested = [key for key in explicit_keys if key is not None]
+    if len(set(requested)) != len(requested):
+        raise ProvisioningError("Duplicate keys in request")
+    conflicts = existing_keys(requested)
+    if conflicts:
+        raise ProvisioningError(f"Keys already exist: {', '.join(sorted(conflicts))}")
+
+    try:
+        generated = iter(generate_unique_keys(explicit_keys.count(None), reserved=requested))
+    except RuntimeError as e:
+        raise ProvisioningError(str(e))
+    keys = [key if key is not None else next(generated) for key in explicit_keys]
+    password_hashes = _hash_passwords(passwords)
+
+    run_write(_insert_codes, keys, urls, styles, password_hashes)
+
+    for key in keys:
+        invalidate_key(key)
+    logging.info(f"Bulk created {len(keys)} QR codes")
+
+    return [
+        {"key": key, "url": url, "stats_url": stats_url_for(key)}
+        for key, url in zip(keys, urls)
+    ]
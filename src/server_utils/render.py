@@ -0,0 +1,484 @@
+import base64
+import binascii
+import functools
+import hashlib
+import io
+import json
+import math
+import os
+import tempfile
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from xml.sax.saxutils import quoteattr
+
+from src.server_utils.cache import LRUCache
+from src.server_utils.config import get_config
+
+try:
+    import segno
+except ImportError:
+    segno = None
+
+config = get_config()
+render_config = config.get("render", {})
+
+RENDER_FORMATS = {"png": "image/png", "svg": "image/svg+xml", "pdf": "application/pdf"}
+
+# Part of every cache key: bump it when the drawing code changes the output
+RENDERER_VERSION = 1
+
+DOT_TYPES = ("square", "dots", "rounded", "extra-rounded", "classy", "classy-rounded")
+CORNER_SQUARE_TYPES = ("none", "square", "dot", "extra-rounded")
+CORNER_DOT_TYPES = ("none", "square", "dot")
+CORRECT_LEVELS = ("L", "M", "Q", "H")
+
+# Share of the modules a logo may hide per error correction level, as in qr-code-styling
+LOGO_COVER = {"L": 0.07, "M": 0.15, "Q": 0.25, "H": 0.3}
+
+# PNG shapes are drawn this many times larger, then downscaled to smooth their edges
+SUPERSAMPLING = 4
+
+rendered_cache = LRUCache(
+    max_size=render_config.get("memory_size", 256),
+    ttl=render_config.get("memory_ttl", 3600),
+)
+
+# A rounded rectangle: x, y, width, height and the top-left, top-right,
+# bottom-right and bottom-left corner radii, in pixels
+Shape = Tuple[float, float, float, float, Tuple[float, float, float, float]]
+
+
+class RenderError(ValueError):
+    """
+    Raised when a QR style option cannot be rendered.
+    """
+
+
+def require_segno() -> None:
+    """
+    Check that the optional segno dependency used to encode QR codes is installed.
+
+    Raises:
+        RuntimeError: If segno is not installed
+    """
+    if segno is None:
+        raise RuntimeError("Rendering QR codes requires segno, install the 'render' extra: pip install 'qr-code-tracker[render]'")
+
+
+def require_pillow() -> None:
+    """
+    Check that the optional Pillow dependency used to draw PNG and PDF images is installed.
+
+    Raises:
+        RuntimeError: If Pillow is not installed
+    """
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        raise RuntimeError("Rendering PNG and PDF images requires Pillow, install the 'render' extra: pip install 'qr-code-tracker[render]'")
+
+
+def render_directory() -> str:
+    """
+    Get the directory holding rendered images, from `[render] directory`.
+
+    Relative paths are resolved from the project root, like SQLite database paths.
+
+    Returns:
+        str: Absolute directory path
+    """
+    directory = render_config.get("directory", "data/qr-cache")
+    if not os.path.isabs(directory):
+        directory = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), directory)
+    return directory
+
+
+def normalize_style(style: Dict) -> Dict:
+    """
+    Reduce a merged QR style configuration to the options the renderer uses.
+
+    Options are read with the same fallbacks as the stats page; gradients are
+    ignored there too.
+
+    Args:
+        style: `[qr_code]` defaults updated with the stored style of the key
+
+    Returns:
+        Dict: Validated options
+    """
+    def option(name, default, convert):
+        value = style.get(name)
+        if value in (None, ""):
+            return default
+        try:
+            return convert(value)
+        except (TypeError, ValueError):
+            raise RenderError(f"Invalid {name}: {value}")
+
+    normalized = {
+        "size": option("size", None, int) or option("width", 512, int),
+        "margin": option("margin", 4, int),
+        "color_dark": option("color_dark", "#000000", str),
+        "color_light": option("color_light", "#ffffff", str),
+        "correct_level": option("correct_level", "H", str).upper(),
+        "dot_type": option("dot_type", "square", str),
+        "corner_square_type": option("corner_square_type", "square", str),
+        "corner_dot_type": option("corner_dot_type", "square", str),
+        "logo_image": option("logo_image", "", lambda value: str(value).strip()),
+        "logo_size": option("logo_size", 0.3, float),
+        "logo_margin": option("logo_margin", 3, int),
+    }
+    max_size = render_config.get("max_size", 4096)
+    if not 16 <= normalized["size"] <= max_size:
+        raise RenderError(f"Invalid size: {normalized['size']}. Expected 16 to {max_size}")
+    if not 0 <= normalized["margin"] < normalized["size"] // 2:
+        raise RenderError(f"Invalid margin: {normalized['margin']}")
+    for name, allowed in (("correct_level", CORRECT_LEVELS), ("dot_type", DOT_TYPES),
+                          ("corner_square_type", CORNER_SQUARE_TYPES), ("corner_dot_type", CORNER_DOT_TYPES)):
+        if normalized[name] not in allowed:
+            raise RenderError(f"Invalid {name}: {normalized[name]}. Expected one of {', '.join(allowed)}")
+    if not 0 <= normalized["logo_size"] <= 1:
+        raise RenderError(f"Invalid logo_size: {normalized['logo_size']}. Expected 0 to 1")
+    return normalized
+
+
+def render_hash(data: str, style: Dict, image_format: str) -> str:
+    """
+    Get the content address of a rendered image.
+
+    Args:
+        data: Encoded URL
+        style: Options returned by `normalize_style`
+        image_format: One of RENDER_FORMATS
+
+    Returns:
+        str: Hex SHA-256 of the renderer version, URL, style and format
+    """
+    identity = json.dumps([RENDERER_VERSION, data, style, image_format], sort_keys=True)
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+def _modules(data: str, correct_level: str) -> List[bytearray]:
+    """
+    Encode a URL in byte mode, picking the smallest version as qr-code-styling does.
+
+    Args:
+        data: URL to encode
+        correct_level: One of CORRECT_LEVELS
+
+    Returns:
+        List[bytearray]: Rows of the module matrix, 1 for dark modules, without quiet zone
+    """
+    require_segno()
+    qr = segno.make_qr(data, error=correct_level, mode="byte", boost_error=False)
+    return [bytearray(1 if value else 0 for value in row) for row in qr.matrix]
+
+
+def _dot_radii(dot_type: str, r: float, free: Tuple[bool, bool, bool, bool]) -> Tuple[float, float, float, float]:
+    """
+    Get the corner radii of one dark module.
+
+    Args:
+        dot_type: One of DOT_TYPES
+        r: Half the module size
+        free: Whether the top, right, bottom and left neighbours are light
+
+    Returns:
+        Tuple[float, float, float, float]: Top-left, top-right, bottom-right and bottom-left radii
+    """
+    top, right, bottom, left = free
+    corners = (top and left, top and right, bottom and right, bottom and left)
+    if dot_type == "square":
+        return (0, 0, 0, 0)
+    if dot_type == "dots":
+        return (r, r, r, r)
+    if dot_type in ("rounded", "extra-rounded"):
+        return tuple(r if corner else 0 for corner in corners)
+    # Classy shapes only round the top-left and bottom-right corners fully
+    rounded = (r if corners[0] else 0, 0, r if corners[2] else 0, 0)
+    if dot_type == "classy-rounded":
+        rounded = (rounded[0], r / 2 if corners[1] else 0, rounded[2], r / 2 if corners[3] else 0)
+    return rounded
+
+
+def _layout(modules: List[bytearray], style: Dict) -> Tuple[List[Shape], List[Tuple[Shape, Shape]], Optional[Shape]]:
+    """
+    Lay out the dark modules of a QR code as rounded rectangles, following qr-code-styling.
+
+    Args:
+        modules: Module matrix returned by `_modules`
+        style: Options returned by `normalize_style`
+
+    Returns:
+        Tuple: Filled shapes, (outer, hole) ring shapes of the finder patterns,
+        and the logo area or None
+    """
+    count = len(modules)
+    size = style["size"]
+    unit = (size - 2 * style["margin"]) // count
+    if unit < 1:
+        raise RenderError(f"Size {size} is too small for the {count}x{count} modules of this QR code")
+    origin = (size - count * unit) // 2
+    r = unit / 2
+
+    def square(row: int, column: int, span: int, radius: float) -> Shape:
+        return (origin + column * unit, origin + row * unit, span * unit, span * unit, (radius,) * 4)
+
+    skipped: Set[Tuple[int, int]] = set()
+    shapes: List[Shape] = []
+    rings: List[Tuple[Shape, Shape]] = []
+    for row, column in ((0, 0), (0, count - 7), (count - 7, 0)):
+        corner_square = style["corner_square_type"]
+        if corner_square != "none":
+            ring_radius = {"square": (0, 0), "dot": (3.5 * unit, 2.5 * unit), "extra-rounded": (2.5 * unit, 1.5 * unit)}
+            outer, inner = ring_radius[corner_square]
+            rings.append((square(row, column, 7, outer), square(row + 1, column + 1, 5, inner)))
+            skipped.update((row + y, column + x) for y in range(7) for x in range(7) if not (2 <= y <= 4 and 2 <= x <= 4))
+        corner_dot = style["corner_dot_type"]
+        if corner_dot != "none":
+            shapes.append(square(row + 2, column + 2, 3, 1.5 * unit if corner_dot == "dot" else 0))
+            skipped.update((row + y, column + x) for y in range(2, 5) for x in range(2, 5))
+
+    logo = None
+    if style["logo_image"] and style["logo_size"] > 0:
+        # Largest odd square of modules the error correction can afford to hide
+        hidden = int(math.sqrt(style["logo_size"] * LOGO_COVER[style["correct_level"]] * count * count))
+        hidden -= 1 - hidden % 2
+        if hidden > 0:
+            start = (count - hidden) // 2
+            skipped.update((start + y, start + x) for y in range(hidden) for x in range(hidden))
+            margin = min(style["logo_margin"], hidden * unit // 2 - 1)
+            logo = (origin + start * unit + margin, origin + start * unit + margin,
+                    hidden * unit - 2 * margin, hidden * unit - 2 * margin, (0, 0, 0, 0))
+
+    def dark(row: int, column: int) -> bool:
+        return 0 <= row < count and 0 <= column < count and modules[row][column] == 1 and (row, column) not in skipped
+
+    for row in range(count):
+        for column in range(count):
+            if not dark(row, column):
+                continue
+            free = (not dark(row - 1, column), not dark(row, column + 1), not dark(row + 1, column), not dark(row, column - 1))
+            x, y, width, height, _ = square(row, column, 1, 0)
+            shapes.append((x, y, width, height, _dot_radii(style["dot_type"], r, free)))
+    return shapes, rings, logo
+
+
+def _svg_path(shape: Shape) -> str:
+    """
+    Format a rounded rectangle as SVG path commands.
+    """
+    x, y, width, height, (tl, tr, br, bl) = shape
+
+    def arc(radius: float, end_x: float, end_y: float) -> str:
+        return f"A{radius:g} {radius:g} 0 0 1 {end_x:g} {end_y:g}" if radius else ""
+
+    return (
+        f"M{x + tl:g} {y:g}H{x + width - tr:g}{arc(tr, x + width, y + tr)}"
+        f"V{y + height - br:g}{arc(br, x + width - br, y + height)}"
+        f"H{x + bl:g}{arc(bl, x, y + height - bl)}"
+        f"V{y + tl:g}{arc(tl, x + tl, y)}Z"
+    )
+
+
+def _render_svg(modules: List[bytearray], style: Dict) -> bytes:
+    """
+    Render a QR code as an SVG document.
+
+    The logo is referenced by its URL, so it is loaded by the viewer.
+    """
+    shapes, rings, logo = _layout(modules, style)
+    size = style["size"]
+    dark, light = quoteattr(style["color_dark"]), quoteattr(style["color_light"])
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+        f'width="{size}" height="{size}" viewBox="0 0 {size} {size}">',
+        f'<rect width="{size}" height="{size}" fill={light}/>',
+        f'<path fill={dark} d="{"".join(_svg_path(shape) for shape in shapes)}"/>',
+    ]
+    if rings:
+        parts.append(f'<path fill={dark} fill-rule="evenodd" d="{"".join(_svg_path(outer) + _svg_path(inner) for outer, inner in rings)}"/>')
+    if logo is not None:
+        x, y, width, height, _ = logo
+        parts.append(f'<image x="{x:g}" y="{y:g}" width="{width:g}" height="{height:g}" '
+                     f'preserveAspectRatio="xMidYMid meet" href={quoteattr(style["logo_image"])}/>')
+    parts.append("</svg>")
+    return "".join(parts).encode()
+
+
+def _polygon(shape: Shape, scale: int) -> Iterator[Tuple[float, float]]:
+    """
+    Approximate a scaled rounded rectangle by the points of a polygon, clockwise from the top-left.
+    """
+    x, y, width, height, radii = shape
+    x, y, width, height = x * scale, y * scale, width * scale, height * scale
+    corners = ((x, y, 180), (x + width, y, 270), (x + width, y + height, 0), (x, y + height, 90))
+    signs = ((1, 1), (-1, 1), (-1, -1), (1, -1))
+    for (corner_x, corner_y, angle), (sign_x, sign_y), radius in zip(corners, signs, radii):
+        radius *= scale
+        if not radius:
+            yield corner_x, corner_y
+            continue
+        center_x, center_y = corner_x + sign_x * radius, corner_y + sign_y * radius
+        for step in range(9):
+            theta = math.radians(angle + step * 90 / 8)
+            yield center_x + radius * math.cos(theta), center_y + radius * math.sin(theta)
+
+
+@functools.lru_cache(maxsize=render_config.get("logo_cache_size", 16))
+def _decode_logo(logo_image: str):
+    """
+    Decode a logo given as a base64 data URI, the only kind embedded in PNG images.
+
+    Logos are usually shared by many keys, so the decoded images are kept;
+    they must not be modified.
+
+    Returns:
+        Optional[Image.Image]: The logo, or None for other URLs or undecodable images
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    if not logo_image.startswith("data:") or ";base64," not in logo_image:
+        return None
+    try:
+        return Image.open(io.BytesIO(base64.b64decode(logo_image.split(",", 1)[1]))).convert("RGBA")
+    except (binascii.Error, ValueError, UnidentifiedImageError):
+        return None
+
+
+@functools.lru_cache(maxsize=render_config.get("logo_cache_size", 16))
+def _fit_logo(logo_image: str, width: int, height: int):
+    """
+    Scale a decoded logo to fit a box, keeping its aspect ratio.
+
+    Cached like `_decode_logo`, so rendering many keys of one size and logo
+    resizes the logo once.
+    """
+    from PIL import Image
+
+    logo = _decode_logo(logo_image)
+    scale = min(width / logo.width, height / logo.height)
+    return logo.resize((max(int(logo.width * scale), 1), max(int(logo.height * scale), 1)), Image.LANCZOS)
+
+
+def _render_image(modules: List[bytearray], style: Dict):
+    """
+    Draw a QR code as a Pillow image.
+
+    Only logos given as data URIs are embedded; remote logos are not fetched,
+    and their area is then left as normal modules.
+
+    Returns:
+        Image.Image: RGB image, or RGBA if a color is translucent
+    """
+    require_pillow()
+    from PIL import Image, ImageColor, ImageDraw
+
+    if style["logo_image"] and _decode_logo(style["logo_image"]) is None:
+        style = dict(style, logo_image="")
+    shapes, rings, logo = _layout(modules, style)
+    size = style["size"]
+    try:
+        dark = ImageColor.getcolor(style["color_dark"], "RGBA")
+        light = ImageColor.getcolor(style["color_light"], "RGBA")
+    except ValueError as e:
+        raise RenderError(f"Invalid color: {e}")
+
+    mask = Image.new("L", (size * SUPERSAMPLING, size * SUPERSAMPLING), 0)
+    draw = ImageDraw.Draw(mask)
+    # Rings first, so clearing their holes does not erase the dots inside
+    for outer, inner in rings:
+        draw.polygon(list(_polygon(outer, SUPERSAMPLING)), fill=255)
+        draw.polygon(list(_polygon(inner, SUPERSAMPLING)), fill=0)
+    for shape in shapes:
+        if any(shape[4]):
+            draw.polygon(list(_polygon(shape, SUPERSAMPLING)), fill=255)
+        else:
+            x, y, width, height, _ = shape
+            draw.rectangle((x * SUPERSAMPLING, y * SUPERSAMPLING,
+                            (x + width) * SUPERSAMPLING - 1, (y + height) * SUPERSAMPLING - 1), fill=255)
+    mask = mask.resize((size, size), Image.BOX)
+
+    image = Image.new("RGBA", (size, size), light)
+    image.paste(Image.new("RGBA", (size, size), dark), (0, 0), mask)
+    if logo is not None:
+        x, y, width, height, _ = logo
+        logo_image = _fit_logo(style["logo_image"], int(width), int(height))
+        image.alpha_composite(logo_image, (int(x + (width - logo_image.width) // 2), int(y + (height - logo_image.height) // 2)))
+    if light[3] == 255 and dark[3] == 255:
+        image = image.convert("RGB")
+    return image
+
+
+def _encode_image(image, image_format: str) -> bytes:
+    """
+    Encode an image drawn by `_render_image` as PNG, or as a one-page PDF
+    printing it at `[render] dpi`.
+    """
+    from PIL import Image
+
+    output = io.BytesIO()
+    if image_format == "pdf":
+        if image.mode == "RGBA":
+            # PDF images have no alpha channel: print translucent codes on white
+            image = Image.alpha_composite(Image.new("RGBA", image.size, "white"), image).convert("RGB")
+        image.save(output, format="PDF", resolution=render_config.get("dpi", 300))
+    else:
+        image.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+def _write_atomic(path: str, content: bytes) -> None:
+    """
+    Write a file so that readers never see it partially written.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(content)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def render_qr(data: str, style: Dict, image_format: str) -> Tuple[str, bytes]:
+    """
+    Render a QR code image, reusing a previous rendering of the same URL and style.
+
+    Images are content-addressed by `render_hash`: they are looked up in the
+    in-process LRU cache, then in `[render] directory`, and only rendered when
+    neither has them, so a key is re-rendered only after its style or URL
+    changed.
+
+    Args:
+        data: URL to encode
+        style: `[qr_code]` defaults updated with the stored style of the key
+        image_format: One of RENDER_FORMATS
+
+    Returns:
+        Tuple[str, bytes]: Content hash, usable as a strong ETag, and image content
+
+    Raises:
+        RenderError: If a style option is invalid
+        RuntimeError: If segno or, for PNG and PDF images, Pillow is not installed
+    """
+    style = normalize_style(style)
+    digest = render_hash(data, style, image_format)
+    content = rendered_cache.get(digest)
+    if content is not None:
+        return digest, content
+
+    path = os.path.join(render_directory(), digest[:2], f"{digest}.{image_format}")
+    try:
+        with open(path, "rb") as file:
+            content = file.read()
+    except FileNotFoundError:
+        modules = _modules(data, style["correct_level"])
+        if image_format == "svg":
+            content = _render_svg(modules, style)
+        else:
+            content = _encode_image(_render_image(modules, style), image_format)
+        _write_atomic(path, content)
+    rendered_cache.set(digest, content)
+    return digest, content
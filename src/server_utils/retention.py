@@ -0,0 +1,357 @@
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from flask import Flask
+from sqlalchemy import Table, delete, func, select, text
+from sqlalchemy.engine import Connection
+
+from src.server_utils.archive import archive_partition
+from src.server_utils.config import get_config
+from src.server_utils.db import ImpressionDaily
+from src.server_utils.partitions import (
+    PARTITION_NAME,
+    Partition,
+    ensure_partitions,
+    forget_partition,
+    list_partitions,
+    month_start,
+    next_month,
+    partition_config,
+)
+from src.server_utils.shared import db
+from src.server_utils.sqlite import run_write
+
+config = get_config()
+retention_config = config.get("retention", {})
+maintenance_config = config.get("maintenance", {})
+
+# What happens to expired raw impressions, see `[retention] action`
+RETENTION_ACTIONS = ("drop", "archive")
+
+
+def raw_retention_start(now: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Get the start of the oldest month whose raw impressions are kept.
+
+    Raw impressions are dropped a whole month at a time, once the entire month
+    is older than `[retention] raw_impression_days`.
+
+    Args:
+        now: Current time, defaults to `datetime.now()`
+
+    Returns:
+        Optional[datetime]: Month start, or None if raw impressions are kept forever
+    """
+    days = retention_config.get("raw_impression_days", 0)
+    if not days:
+        return None
+    return month_start((now or datetime.now()) - timedelta(days=days))
+
+
+def retention_action() -> str:
+    """
+    Get what happens to expired raw impressions, from `[retention] action`.
+
+    Returns:
+        str: "drop" to delete them, "archive" to move them to the archive files first
+    """
+    action = retention_config.get("action", "drop")
+    if action not in RETENTION_ACTIONS:
+        raise ValueError(f"Invalid [retention] action: {action}. Expected one of {', '.join(RETENTION_ACTIONS)}")
+    return action
+
+
+def _count_raw(connection: Connection, partitions: List[Partition], start: Optional[datetime], end: datetime) -> int:
+    """
+    Count the raw impressions in [start, end) in some partitions, from the beginning without a start.
+    """
+    total = 0
+    for partition in partitions:
+        column = partition.table.c.datetime
+        condition = column < end if start is None else (column >= start) & (column < end)
+        total += connection.execute(select(func.count()).select_from(partition.table).where(condition)).scalar()
+    return total
+
+
+def _count_rolled_up(connection: Connection, start: Optional[datetime], end: datetime) -> int:
+    """
+    Count the impressions in [start, end) in the daily rollups, from the beginning without a start.
+    """
+    condition = ImpressionDaily.bucket < end
+    if start is not None:
+        condition = (ImpressionDaily.bucket >= start) & condition
+    return connection.execute(select(func.coalesce(func.sum(ImpressionDaily.count), 0)).where(condition)).scalar()
+
+
+def _rolled_up_partitions(connection: Connection, expired: List[Partition], end: datetime) -> List[Partition]:
+    """
+    Keep the expired partitions whose raw impressions are all counted in the daily rollups.
+
+    Each month of a partition is checked against the raw impressions of that
+    month in every expired table, since the unpartitioned table may hold rows
+    of any month; the unpartitioned table is checked month by month from its
+    oldest row up to `end`.
+    """
+    counted = []
+    for partition in expired:
+        if partition.upper is not None:
+            months = [(partition.lower, partition.upper)]
+        else:
+            column = partition.table.c.datetime
+            month = connection.execute(select(func.min(column)).where(column < end)).scalar()
+            months = []
+            month = month_start(month) if month is not None else end
+            while month < end:
+                months.append((month, next_month(month)))
+                month = next_month(month)
+
+        for start, stop in months:
+            raw = _count_raw(connection, [other for other in expired if other.overlaps(start, stop)], start, stop)
+            rolled_up = _count_rolled_up(connection, start, stop) if raw else 0
+            if rolled_up < raw:
+                logging.warning(
+                    f"Not dropping the impressions of {partition.table.name}: the rollups only account for "
+                    f"{rolled_up} of the {raw} raw impressions from {start} to {stop}, "
+                    f"run `qr-tracker db backfill-rollups` first"
+                )
+                break
+        else:
+            counted.append(partition)
+    return counted
+
+
+def _delete_batch(table: Table, end: datetime, batch_size: int) -> int:
+    """
+    Delete and commit up to `batch_size` impressions older than `end` from one table.
+
+    Args:
+        table: Partition to delete from
+        end: Exclusive end of the impressions deleted
+        batch_size: Maximum number of impressions deleted
+
+    Returns:
+        int: Number of impressions deleted
+    """
+    batch = select(table.c.id).where(table.c.datetime < end).limit(batch_size).scalar_subquery()
+    result = db.session.execute(delete(table).where(table.c.datetime < end, table.c.id.in_(batch)))
+    db.session.commit()
+    return result.rowcount
+
+
+def _drop_table(name: str) -> None:
+    """
+    Drop and commit an emptied SQLite partition.
+
+    Args:
+        name: Partition table name
+    """
+    db.session.execute(text(f"DROP TABLE IF EXISTS {name}"))
+    db.session.commit()
+
+
+def _delete_rows(table: Table, end: datetime) -> int:
+    """
+    Delete the impressions older than `end` from a table in `[maintenance] delete_batch_size` batches.
+
+    Each batch is its own short write transaction, so scans are recorded in between.
+
+    Args:
+        table: Partition to delete from
+        end: Exclusive end of the impressions deleted
+
+    Returns:
+        int: Number of impressions deleted
+    """
+    batch_size = maintenance_config.get("delete_batch_size", 5000)
+    deleted = 0
+    while True:
+        rowcount = run_write(_delete_batch, table, end, batch_size)
+        deleted += rowcount
+        if rowcount < batch_size:
+            return deleted
+
+
+def _drop_postgres_partition(name: str) -> None:
+    """
+    Detach a PostgreSQL partition without blocking writes to `impressions`, then drop it.
+
+    On PostgreSQL 14 and later the partition is detached CONCURRENTLY, which
+    never takes a lock that conflicts with inserts. Older servers take a brief
+    exclusive lock, waiting at most `[partitions] lock_timeout_ms` for it.
+
+    Args:
+        name: Partition table name
+    """
+    lock_timeout = int(partition_config.get("lock_timeout_ms", 2000))
+    # DETACH ... CONCURRENTLY cannot run inside a transaction block
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text(f"SET lock_timeout = {lock_timeout}"))
+        attached = connection.execute(text(
+            "SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:name)"
+        ), {"name": name}).first() is not None
+        if attached:
+            if connection.dialect.server_version_info >= (14,):
+                pending = connection.execute(text(
+                    "SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = to_regclass(:name)"
+                ), {"name": name}).scalar()
+                # A previous concurrent detach was interrupted; it can only be finished
+                mode = "FINALIZE" if pending else "CONCURRENTLY"
+                connection.execute(text(f"ALTER TABLE impressions DETACH PARTITION {name} {mode}"))
+            else:
+                connection.execute(text(f"ALTER TABLE impressions DETACH PARTITION {name}"))
+        connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+
+
+def _detached_postgres_partitions(connection: Connection) -> List[str]:
+    """
+    List monthly partition tables that were detached but not dropped by an interrupted sweep.
+    """
+    names = connection.execute(text(
+        "SELECT relname FROM pg_class WHERE relkind = 'r' AND NOT relispartition "
+        "AND relname LIKE 'impressions\\_%' ESCAPE '\\' AND pg_table_is_visible(oid)"
+    )).scalars().all()
+    return [name for name in names if PARTITION_NAME.match(name)]
+
+
+def sweep_impressions(now: Optional[datetime] = None) -> Dict:
+    """
+    Create upcoming monthly partitions and drop raw impressions past the retention period.
+
+    Months entirely older than `[retention] raw_impression_days` are removed:
+    PostgreSQL partitions are detached and dropped, SQLite partitions are
+    emptied in small batches and then dropped, and rows of the unpartitioned
+    `impressions` table are deleted in small batches. A month is only removed
+    if the daily rollups of its range account for all of its raw impressions,
+    so the stats of a key are unchanged; other months are kept until
+    `qr-tracker db backfill-rollups` has counted them.
+
+    With `[retention] action = "archive"`, each month is copied to the archive
+    files (see `archive_partition`) before its partition is dropped. Rows of
+    the unpartitioned `impressions` table are then kept until `db upgrade`
+    moves them to monthly partitions.
+
+    Must be called in an application context.
+
+    Args:
+        now: Current time, defaults to `datetime.now()`
+
+    Returns:
+        Dict: Names of the partitions created and dropped, and number of rows deleted and archived
+    """
+    action = retention_action()
+    result = {"created": run_write(ensure_partitions, db.engine, now), "dropped": [], "deleted": 0, "archived": 0}
+    end = raw_retention_start(now)
+    if end is None:
+        return result
+
+    with db.engine.connect() as connection:
+        expired = [
+            partition for partition in list_partitions(connection)
+            if partition.upper is None or partition.upper <= end
+        ]
+        if action == "archive":
+            unpartitioned = [partition for partition in expired if partition.upper is None]
+            if _count_raw(connection, unpartitioned, None, end):
+                logging.warning("Not archiving impressions of the unpartitioned impressions table, run `qr-tracker db upgrade`")
+        counted = _rolled_up_partitions(connection, expired, end)
+        if action == "archive":
+            counted = [partition for partition in counted if partition.upper is not None]
+        detached = _detached_postgres_partitions(connection) if connection.dialect.name == "postgresql" else []
+
+    for partition in counted:
+        name = partition.table.name
+        if partition.upper is None:
+            deleted = _delete_rows(partition.table, end)
+            result["deleted"] += deleted
+            logging.info(f"Deleted {deleted} impressions before {end} from {name}")
+            continue
+        if action == "archive":
+            result["archived"] += archive_partition(partition)
+        if db.engine.dialect.name == "postgresql":
+            _drop_postgres_partition(name)
+        else:
+            result["deleted"] += _delete_rows(partition.table, partition.upper)
+            run_write(_drop_table, name)
+        forget_partition(name)
+        result["dropped"].append(name)
+        logging.info(f"Dropped impression partition {name}")
+
+    for name in detached:
+        lower = datetime.strptime(name, "impressions_%Y_%m")
+        if lower < end and name not in result["dropped"]:
+            _drop_postgres_partition(name)
+            result["dropped"].append(name)
+            logging.info(f"Dropped detached impression partition {name}")
+    return result
+
+
+class RetentionSweeper:
+    """
+    Background thread running `sweep_impressions` every `interval` seconds.
+    """
+
+    def __init__(self, app: Flask, interval: float) -> None:
+        """
+        Initialize the sweeper without starting its thread.
+
+        Args:
+            app: Flask application whose context the sweep runs in
+            interval: Time in seconds between sweeps
+        """
+        self.app = app
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Start the sweeper thread; the first sweep runs immediately.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="retention-sweeper", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """
+        Stop the sweeper thread, waiting for a running sweep to finish.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        """
+        Sweeper loop, logging instead of raising on failure.
+        """
+        while not self._stopping.is_set():
+            with self.app.app_context():
+                try:
+                    sweep_impressions()
+                except Exception:
+                    db.session.rollback()
+                    logging.exception("Impression retention sweep failed")
+            self._stopping.wait(self.interval)
+
+
+def start_retention_sweeper(app: Flask) -> Optional[RetentionSweeper]:
+    """
+    Start sweeping an application's database every `[retention] sweep_interval_minutes`.
+
+    Args:
+        app: Flask application, typically the admin server
+
+    Returns:
+        Optional[RetentionSweeper]: The started sweeper, or None if periodic sweeps are disabled
+    """
+    interval = retention_config.get("sweep_interval_minutes", 60)
+    if not interval:
+        return None
+    sweeper = RetentionSweeper(app, interval * 60)
+    sweeper.start()
+    app.extensions["retention_sweeper"] = sweeper
+    return sweeper
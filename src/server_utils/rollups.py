@@ -0,0 +1,268 @@
+import logging
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from src.server_utils.archive import iter_archive_pages
+from src.server_utils.db import ImpressionDaily, ImpressionHourly, ImpressionTotal, Stats
+from src.server_utils.partitions import impression_source
+from src.server_utils.shared import db
+
+ROLLUP_MODELS = (ImpressionTotal, ImpressionHourly, ImpressionDaily)
+
+
+def hour_bucket(when: datetime) -> datetime:
+    """
+    Truncate a timestamp to the start of its hour.
+
+    Args:
+        when: Timestamp to truncate
+
+    Returns:
+        datetime: Start of the hour
+    """
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(when: datetime) -> datetime:
+    """
+    Truncate a timestamp to the start of its day.
+
+    Args:
+        when: Timestamp to truncate
+
+    Returns:
+        datetime: Midnight of the same day
+    """
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _upsert(dialect_name: str):
+    """
+    Get the INSERT construct supporting ON CONFLICT for a dialect.
+
+    Args:
+        dialect_name: SQLAlchemy dialect name of the database
+
+    Returns:
+        Callable: `insert` function of the matching dialect
+    """
+    if dialect_name == "postgresql":
+        return postgresql_insert
+    return sqlite_insert
+
+
+def rollup_statements(rows: Iterable[Tuple[int, datetime]], dialect_name: str) -> List[Tuple[Any, List[Dict]]]:
+    """
+    Build the statements that add a batch of impressions to the rollup tables.
+
+    Each statement is an upsert that increments existing counters, so batches
+    can be applied in any order and from several processes.
+
+    Args:
+        rows: Iterable of (stats_id, datetime) tuples being recorded
+        dialect_name: SQLAlchemy dialect name of the database
+
+    Returns:
+        List[Tuple[Any, List[Dict]]]: (statement, parameter list) pairs to execute
+    """
+    totals: Dict[int, List] = {}
+    hourly: Counter = Counter()
+    daily: Counter = Counter()
+    for stats_id, when in rows:
+        total = totals.get(stats_id)
+        if total is None:
+            totals[stats_id] = [1, when, when]
+        else:
+            total[0] += 1
+            total[1] = min(total[1], when)
+            total[2] = max(total[2], when)
+        hourly[(stats_id, hour_bucket(when))] += 1
+        daily[(stats_id, day_bucket(when))] += 1
+
+    if not totals:
+        return []
+
+    totals_stmt, hourly_stmt, daily_stmt = _rollup_upserts(dialect_name)
+    # Sorted so concurrent writers lock rows in the same order
+    statements = [(totals_stmt, [
+        {"stats_id": stats_id, "count": count, "first_seen": first, "last_seen": last}
+        for stats_id, (count, first, last) in sorted(totals.items())
+    ])]
+    for stmt, counter in ((hourly_stmt, hourly), (daily_stmt, daily)):
+        statements.append((stmt, [
+            {"stats_id": stats_id, "bucket": bucket, "count": count}
+            for (stats_id, bucket), count in sorted(counter.items())
+        ]))
+    return statements
+
+
+@lru_cache(maxsize=None)
+def _rollup_upserts(dialect_name: str) -> Tuple[Any, Any, Any]:
+    """
+    Build the upserts of the totals, hourly and daily tables for a dialect.
+
+    The constructs do not depend on the rows being recorded, so they are built
+    once per dialect rather than on every write, which also lets SQLAlchemy
+    reuse their compiled form.
+
+    Args:
+        dialect_name: SQLAlchemy dialect name of the database
+
+    Returns:
+        Tuple[Any, Any, Any]: Totals, hourly and daily upsert statements
+    """
+    insert = _upsert(dialect_name)
+
+    stmt = insert(ImpressionTotal)
+    table = ImpressionTotal.__table__
+    totals_stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.stats_id],
+        set_={
+            "count": table.c.count + stmt.excluded.count,
+            "first_seen": case(
+                (table.c.first_seen <= stmt.excluded.first_seen, table.c.first_seen),
+                else_=stmt.excluded.first_seen,
+            ),
+            "last_seen": case(
+                (table.c.last_seen >= stmt.excluded.last_seen, table.c.last_seen),
+                else_=stmt.excluded.last_seen,
+            ),
+        },
+    )
+
+    counters = []
+    for model in (ImpressionHourly, ImpressionDaily):
+        table = model.__table__
+        stmt = insert(model)
+        counters.append(stmt.on_conflict_do_update(
+            index_elements=[table.c.stats_id, table.c.bucket],
+            set_={"count": table.c.count + stmt.excluded.count},
+        ))
+
+    return (totals_stmt, *counters)
+
+
+def apply_rollups(rows: Iterable[Tuple[int, datetime]]) -> None:
+    """
+    Add a batch of impressions to the rollup tables in the current session.
+
+    The caller is responsible for committing.
+
+    Args:
+        rows: Iterable of (stats_id, datetime) tuples being recorded
+    """
+    dialect_name = db.session.get_bind().dialect.name
+    for stmt, params in rollup_statements(rows, dialect_name):
+        db.session.execute(stmt, params)
+
+
+def clear_rollups(stats_id: int) -> None:
+    """
+    Delete all rollup rows of a stats entry in the current session.
+
+    The caller is responsible for committing.
+
+    Args:
+        stats_id: Stats row whose counters are removed
+    """
+    for model in ROLLUP_MODELS:
+        db.session.execute(delete(model).where(model.stats_id == stats_id))
+
+
+def get_total(stats_id: int) -> Optional[ImpressionTotal]:
+    """
+    Get the lifetime counters of a stats entry.
+
+    Args:
+        stats_id: Stats row to look up
+
+    Returns:
+        Optional[ImpressionTotal]: Counters, or None if the key was never scanned
+    """
+    return db.session.get(ImpressionTotal, stats_id)
+
+
+def _clear_rollups_since(stats_id: int, since: datetime) -> None:
+    """
+    Delete the hourly and daily rollup rows of a stats entry from `since` on, in the current session.
+
+    The totals row is reset to the counters that are kept, so that adding the
+    impressions from `since` on restores the lifetime totals. The caller is
+    responsible for committing.
+
+    Args:
+        stats_id: Stats row whose counters are removed
+        since: Start of the counters removed, at the start of a day
+    """
+    total = get_total(stats_id)
+    kept = db.session.execute(
+        select(func.coalesce(func.sum(ImpressionDaily.count), 0))
+        .where(ImpressionDaily.stats_id == stats_id, ImpressionDaily.bucket < since)
+    ).scalar()
+    for model in (ImpressionHourly, ImpressionDaily):
+        db.session.execute(delete(model).where(model.stats_id == stats_id, model.bucket >= since))
+    db.session.execute(delete(ImpressionTotal).where(ImpressionTotal.stats_id == stats_id))
+    if total is not None and kept:
+        db.session.add(ImpressionTotal(
+            stats_id=stats_id, count=kept, first_seen=total.first_seen, last_seen=total.last_seen,
+        ))
+        db.session.flush()
+
+
+def backfill_rollups(batch_size: int = 10000, since: Optional[datetime] = None) -> int:
+    """
+    Rebuild the rollup tables from the raw impressions.
+
+    Keys are processed one at a time: a key's impressions are streamed and
+    folded into counters, then its rollup rows are replaced and committed.
+    Memory use is bounded by the number of distinct hours of a single key.
+    Scans recorded for a key while it is being rebuilt may be miscounted, so
+    run this while the public service is stopped.
+
+    With `since`, only impressions from then on are read and only the counters
+    from then on are rebuilt, keeping those of older impressions, which may
+    have been dropped by the retention policy. Without it, archived
+    impressions (see `archive_partition`) are read as well.
+
+    Args:
+        batch_size: Number of impressions fetched from the database at a time
+        since: Start of a month from which impressions are rebuilt, or None for all
+
+    Returns:
+        int: Number of impressions processed
+    """
+    dialect_name = db.session.get_bind().dialect.name
+    stats_ids = db.session.execute(select(Stats.id).order_by(Stats.id)).scalars().all()
+    processed = 0
+
+    for stats_id in stats_ids:
+        source = impression_source(db.session.connection(), since)
+        query = select(source.c.datetime).where(source.c.stats_id == stats_id)
+        if since is not None:
+            query = query.where(source.c.datetime >= since)
+        datetimes = db.session.execute(query.execution_options(yield_per=batch_size)).scalars()
+        if since is None:
+            datetimes = chain(chain.from_iterable(iter_archive_pages(stats_id, page_size=batch_size)), datetimes)
+        statements = rollup_statements(((stats_id, when) for when in datetimes), dialect_name)
+
+        if since is None:
+            clear_rollups(stats_id)
+        else:
+            _clear_rollups_since(stats_id, since)
+        for stmt, params in statements:
+            db.session.execute(stmt, params)
+        db.session.commit()
+
+        # The totals upsert comes first and holds the key's impression count
+        count = statements[0][1][0]["count"] if statements else 0
+        processed += count
+        logging.info(f"Rebuilt rollups for stats_id {stats_id} from {count} impressions")
+
+    return processed
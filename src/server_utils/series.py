@@ -0,0 +1,363 @@
+import base64
+import binascii
+import json
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, tzinfo
+from itertools import groupby
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Integer, cast, func, select
+
+from src.server_utils.archive import from_epoch, open_archive
+from src.server_utils.db import ImpressionDaily, ImpressionHourly
+from src.server_utils.partitions import impression_source
+from src.server_utils.shared import db
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:
+    from backports.zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+BUCKETS = ("minute", "hour", "day", "week")
+
+# Minute buckets are computed from raw impressions, so without an explicit
+# start the range is limited to the last day
+DEFAULT_MINUTE_RANGE = timedelta(days=1)
+
+MINUTE_MICROSECONDS = 60 * 1000 * 1000
+
+
+class SeriesError(ValueError):
+    """
+    Raised when the requested bucket, range or time zone is invalid.
+    """
+
+
+def parse_timezone(name: Optional[str]) -> Optional[tzinfo]:
+    """
+    Parse an IANA time zone name.
+
+    Args:
+        name: Time zone name such as "Europe/London", or None/empty for server time
+
+    Returns:
+        Optional[tzinfo]: The time zone, or None to use the server's local time
+    """
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise SeriesError(f"Unknown time zone: {name}")
+
+
+def parse_timestamp(value: Optional[str], tz: Optional[tzinfo]) -> Optional[datetime]:
+    """
+    Parse an ISO 8601 timestamp into the naive server-local time impressions are stored in.
+
+    Naive timestamps are interpreted in `tz` if given, otherwise in server time.
+
+    Args:
+        value: ISO 8601 timestamp or date, or None/empty
+        tz: Time zone of naive timestamps, or None for server time
+
+    Returns:
+        Optional[datetime]: Naive server-local timestamp, or None if no value was given
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise SeriesError(f"Invalid timestamp: {value}")
+    if parsed.tzinfo is None and tz is not None:
+        parsed = parsed.replace(tzinfo=tz)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def truncate(when: datetime, bucket: str) -> datetime:
+    """
+    Truncate a timestamp to the start of its bucket. Weeks start on Monday.
+
+    Args:
+        when: Timestamp to truncate
+        bucket: One of BUCKETS
+
+    Returns:
+        datetime: Start of the bucket, keeping the time zone of `when`
+    """
+    if bucket == "minute":
+        return when.replace(second=0, microsecond=0)
+    if bucket == "hour":
+        return when.replace(minute=0, second=0, microsecond=0)
+    day = when.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        return day
+    return day - timedelta(days=day.weekday())
+
+
+def _as_datetime(value) -> datetime:
+    """
+    Convert a bucket value returned by the database to a datetime.
+
+    SQLite returns string results for date functions, Postgres returns datetimes.
+
+    Args:
+        value: datetime or ISO formatted string
+
+    Returns:
+        datetime: Parsed bucket start
+    """
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _bucket_expression(column, bucket: str, dialect_name: str):
+    """
+    Build a SQL expression truncating a timestamp column to a bucket.
+
+    Args:
+        column: Timestamp column
+        bucket: "minute" or "week"
+        dialect_name: SQLAlchemy dialect name of the database
+
+    Returns:
+        ColumnElement: Truncated timestamp expression
+    """
+    if dialect_name == "postgresql":
+        return func.date_trunc(bucket, column)
+    if bucket == "minute":
+        return func.strftime("%Y-%m-%d %H:%M:00", column)
+    # strftime('%w') is 0 for Sunday; shift so weeks start on Monday
+    days_since_monday = (cast(func.strftime("%w", column), Integer) + 6) % 7
+    return func.date(column, func.printf("-%d days", days_since_monday))
+
+
+def _archived_minute_counts(stats_id: int, start: Optional[datetime], end: Optional[datetime]) -> List[Tuple[datetime, int]]:
+    """
+    Count archived impressions per server-local minute.
+
+    The range is located in the key's memory-mapped archive with binary
+    searches, so only the archived impressions within it are read.
+
+    Args:
+        stats_id: Stats row to aggregate
+        start: Inclusive naive start, or None
+        end: Exclusive naive end, or None
+
+    Returns:
+        List[Tuple[datetime, int]]: (minute start, count) pairs in chronological order
+    """
+    archive = open_archive(stats_id)
+    if archive is None:
+        return []
+    with archive:
+        lower, upper = archive.range(start, end)
+        return [
+            (from_epoch(minute * MINUTE_MICROSECONDS), sum(1 for _ in values))
+            for minute, values in groupby(archive.values[lower:upper], key=lambda value: value // MINUTE_MICROSECONDS)
+        ]
+
+
+def _grouped_counts(bucket: str, stats_id: int, start: Optional[datetime], end: Optional[datetime]) -> List[Tuple[datetime, int]]:
+    """
+    Count impressions per server-local bucket with a GROUP BY in the database.
+
+    Hours and days are read from the rollup tables, weeks are grouped from the
+    daily rollups, and minutes are grouped from the raw impressions, including
+    archived ones.
+
+    Args:
+        bucket: One of BUCKETS
+        stats_id: Stats row to aggregate
+        start: Inclusive naive start, already aligned to the bucket, or None
+        end: Exclusive naive end, or None
+
+    Returns:
+        List[Tuple[datetime, int]]: (bucket start, count) pairs in chronological order
+    """
+    dialect_name = db.session.get_bind().dialect.name
+    if bucket == "minute":
+        source = impression_source(db.session.connection(), start, end)
+        column, count = source.c.datetime, func.count()
+    else:
+        source = (ImpressionHourly if bucket == "hour" else ImpressionDaily).__table__
+        column, count = source.c.bucket, func.sum(source.c.count)
+
+    if bucket in ("minute", "week"):
+        bucket_start = _bucket_expression(column, bucket, dialect_name)
+    else:
+        bucket_start = column
+    bucket_start = bucket_start.label("bucket_start")
+
+    query = select(bucket_start, count.label("count")).where(source.c.stats_id == stats_id)
+    if start is not None:
+        query = query.where(column >= start)
+    if end is not None:
+        query = query.where(column < end)
+    query = query.group_by(bucket_start).order_by(bucket_start)
+
+    grouped = [(_as_datetime(row.bucket_start), int(row.count)) for row in db.session.execute(query)]
+    if bucket == "minute":
+        archived = _archived_minute_counts(stats_id, start, end)
+        if archived:
+            merged = Counter(dict(archived))
+            for bucket_start, count in grouped:
+                merged[bucket_start] += count
+            grouped = sorted(merged.items())
+    return grouped
+
+
+def check_range(bucket: str, start: Optional[datetime], end: Optional[datetime]) -> None:
+    """
+    Validate the bucket and range of a series.
+
+    Args:
+        bucket: Requested bucket
+        start: Inclusive start, or None
+        end: Exclusive end, or None
+
+    Raises:
+        SeriesError: If the bucket is unknown or the range is empty
+    """
+    if bucket not in BUCKETS:
+        raise SeriesError(f"Invalid bucket: {bucket}. Expected one of {', '.join(BUCKETS)}")
+    if start is not None and end is not None and start >= end:
+        raise SeriesError("'from' must be before 'to'")
+
+
+def bucketed_series(stats_id: int, bucket: str = "hour", start: Optional[datetime] = None,
+                    end: Optional[datetime] = None, tz: Optional[tzinfo] = None) -> List[Dict]:
+    """
+    Compute an impression count series for a key.
+
+    Without a time zone, buckets follow server time and are grouped entirely in
+    the database. With a time zone, hour/day/week buckets are grouped per hour in
+    the database and folded into local buckets afterwards, so zones whose UTC
+    offset is not a whole number of hours get their day boundaries rounded to the
+    hour; minute buckets are always exact.
+
+    Args:
+        stats_id: Stats row to aggregate
+        bucket: One of BUCKETS
+        start: Inclusive naive server-local start, or None for the first impression
+        end: Exclusive naive server-local end, or None for now
+        tz: Time zone of the returned bucket starts, or None for server time
+
+    Returns:
+        List[Dict]: Points with "bucket_start", "count" and "cumulative" (running total within the range)
+    """
+    check_range(bucket, start, end)
+    if bucket == "minute" and start is None:
+        start = (end or datetime.now()) - DEFAULT_MINUTE_RANGE
+
+    if tz is None or bucket == "minute":
+        # Align the start to the granularity of the rows being grouped
+        row_bucket = "day" if bucket == "week" else bucket
+        grouped = _grouped_counts(bucket, stats_id, truncate(start, row_bucket) if start is not None else None, end)
+        if tz is not None:
+            grouped = [(bucket_start.astimezone(tz), count) for bucket_start, count in grouped]
+    else:
+        hourly = _grouped_counts("hour", stats_id, truncate(start, "hour") if start is not None else None, end)
+        folded: "OrderedDict[datetime, int]" = OrderedDict()
+        for hour_start, count in hourly:
+            local_start = truncate(hour_start.astimezone(tz), bucket)
+            folded[local_start] = folded.get(local_start, 0) + count
+        grouped = list(folded.items())
+
+    series = []
+    cumulative = 0
+    for bucket_start, count in grouped:
+        cumulative += count
+        series.append({
+            "bucket_start": bucket_start.isoformat(),
+            "count": count,
+            "cumulative": cumulative,
+        })
+    return series
+
+
+def _encode_cursor(bucket: str, resume: Optional[datetime], offset: int) -> str:
+    """
+    Encode where an incremental series resumes as an opaque cursor.
+
+    Args:
+        bucket: Bucket of the series
+        resume: Naive server-local start of the last bucket returned, or None
+        offset: Cumulative count before that bucket
+
+    Returns:
+        str: URL-safe cursor
+    """
+    value = json.dumps([bucket, resume.isoformat() if resume is not None else None, offset])
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+
+def parse_cursor(cursor: str, bucket: str) -> Tuple[Optional[datetime], int]:
+    """
+    Decode a cursor returned by `incremental_series` for the same bucket.
+
+    Args:
+        cursor: Cursor string
+        bucket: Bucket of the requested series
+
+    Returns:
+        Tuple[Optional[datetime], int]: Naive server-local resume point, or None, and cumulative count before it
+    """
+    try:
+        cursor_bucket, resume, offset = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        resume = datetime.fromisoformat(resume) if resume is not None else None
+        offset = int(offset)
+    except (binascii.Error, ValueError, TypeError):
+        raise SeriesError(f"Invalid cursor: {cursor}")
+    if cursor_bucket != bucket:
+        raise SeriesError(f"Cursor was returned for {cursor_bucket} buckets, not {bucket}")
+    return resume, offset
+
+
+def incremental_series(stats_id: int, bucket: str = "hour", start: Optional[datetime] = None,
+                       end: Optional[datetime] = None, tz: Optional[tzinfo] = None,
+                       since: Optional[str] = None) -> Dict:
+    """
+    Compute an impression count series, or only its part changed since a previous call.
+
+    The returned cursor points at the last bucket, which may still grow, so a
+    call with `since` returns that bucket again followed by any newer ones;
+    clients replace their points from the first returned bucket on. Cumulative
+    counts continue from the previous call.
+
+    Args:
+        stats_id: Stats row to aggregate
+        bucket: One of BUCKETS
+        start: Inclusive naive server-local start, or None for the first impression
+        end: Exclusive naive server-local end, or None for now
+        tz: Time zone of the returned bucket starts, or None for server time
+        since: Cursor returned by a previous call with the same bucket and range, or None
+
+    Returns:
+        Dict: "series" points as in `bucketed_series`, "count" (total in the range) and "cursor"
+    """
+    resume, offset = parse_cursor(since, bucket) if since else (None, 0)
+    if resume is not None:
+        if end is not None and resume >= end:
+            return {"series": [], "count": offset, "cursor": since}
+        start = max(start, resume) if start is not None else resume
+
+    series = bucketed_series(stats_id, bucket=bucket, start=start, end=end, tz=tz)
+    if resume is not None:
+        # Time zone buckets are grouped from whole hours, which may reach into the bucket before
+        series = [point for point in series if parse_timestamp(point["bucket_start"], None) >= resume]
+
+    cumulative = offset
+    for point in series:
+        cumulative += point["count"]
+        point["cumulative"] = cumulative
+    if series:
+        last = series[-1]
+        since = _encode_cursor(bucket, parse_timestamp(last["bucket_start"], None), last["cumulative"] - last["count"])
+    elif since is None:
+        since = _encode_cursor(bucket, None, 0)
+    return {"series": series, "count": cumulative, "cursor": since}
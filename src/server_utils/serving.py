@@ -0,0 +1,96 @@
+import logging
+from typing import Optional
+
+from flask import Flask
+
+from src.server_utils.config import get_config
+
+config = get_config()
+
+# Settings read from [server.public] / [server.admin] and passed to waitress
+WAITRESS_OPTIONS = (
+    "threads",
+    "connection_limit",
+    "backlog",
+    "channel_timeout",
+    "asyncore_loop_timeout",
+    "asyncore_use_poll",
+    "send_bytes",
+)
+
+
+def waitress_options(mode: str, overrides: Optional[dict] = None) -> dict:
+    """
+    Build waitress settings for a server mode.
+
+    Values from the `[server.<mode>]` section of config.toml are overridden by
+    any non-None value in `overrides` (typically CLI flags).
+
+    Args:
+        mode: "public" or "admin"
+        overrides: Option name to value mapping, None values are ignored
+
+    Returns:
+        dict: Keyword arguments for `waitress.serve`
+    """
+    section = config.get("server", {}).get(mode, {})
+    options = {name: section[name] for name in WAITRESS_OPTIONS if name in section}
+    for name, value in (overrides or {}).items():
+        if name not in WAITRESS_OPTIONS:
+            raise ValueError(f"Unknown waitress option: {name}")
+        if value is not None:
+            options[name] = value
+    return options
+
+
+def serve_app(app: Flask, host: str, port: int, mode: str, overrides: Optional[dict] = None, **kwargs) -> None:
+    """
+    Serve an application with waitress, tuned for its mode.
+
+    Args:
+        app: Flask application to serve
+        host: Host to bind to
+        port: Port to bind to
+        mode: "public" or "admin", selects the `[server.<mode>]` settings
+        overrides: Option name to value mapping overriding config.toml
+        **kwargs: Extra arguments passed to `waitress.serve` as is
+    """
+    from waitress import serve
+
+    options = waitress_options(mode, overrides)
+    logging.info(f"Serving {mode} app on {host}:{port} with {options}")
+    serve(app, host=host, port=port, **options, **kwargs)
+
+
+def serve_asgi(host: str, port: int, workers: int = 1, overrides: Optional[dict] = None) -> None:
+    """
+    Serve the ASGI redirect application with uvicorn.
+
+    Requires the optional `asgi` dependencies (uvicorn and an async database
+    driver). uvicorn settings are read from `[server.asgi]`; `overrides` can
+    replace its `backlog`.
+
+    Args:
+        host: Host to bind to
+        port: Port to bind to
+        workers: Number of uvicorn worker processes
+        overrides: Option name to value mapping, None values are ignored
+    """
+    try:
+        import uvicorn
+    except ImportError:
+        raise RuntimeError("The ASGI server requires uvicorn, install the 'asgi' extra: pip install 'qr-code-tracker[asgi]'")
+
+    options = dict(config.get("server", {}).get("asgi", {}))
+    if overrides and overrides.get("backlog") is not None:
+        options["backlog"] = overrides["backlog"]
+    logging.info(f"Serving ASGI public app on {host}:{port} with {workers} workers and {options}")
+    uvicorn.run(
+        "src.server_utils.asgi:create_asgi_app",
+        factory=True,
+        host=host,
+        port=port,
+        workers=workers,
+        log_config=None,
+        **options,
+    )
@@ -17,3 +17,18 @@ def string_to_base64(s):
         str: Base64 encoded string
     """
     return base64.b64encode(s.encode('utf-8')).decode('utf-8')
+
+
+def redirect_target(url):
+    """
+    Get the URL a QR code redirects to, assuming https for URLs stored without a scheme.
+    
+    Args:
+        url: Target URL as stored
+        
+    Returns:
+        str: Absolute URL to redirect to
+    """
+    if url.find("http://") != 0 and url.find("https://") != 0:
+        url = "https://" + url
+    return url
@@ -0,0 +1,239 @@
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from flask import Flask, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from src.server_utils.shared import db
+
+# Pragmas set on every connection, in this order, with their config.toml defaults.
+# busy_timeout comes first so switching the journal mode waits for other processes.
+DEFAULT_PRAGMAS = {
+    "busy_timeout": 5000,
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "mmap_size": 268435456,
+    "cache_size": -65536,
+}
+
+
+def sqlite_pragmas(settings: Dict) -> Dict[str, Any]:
+    """
+    Select the pragmas of the SQLite profile from the `[database.sqlite]` settings.
+
+    Args:
+        settings: The `[database.sqlite]` section of config.toml
+
+    Returns:
+        Dict[str, Any]: Pragma name to value, in the order they are applied
+    """
+    return {name: settings.get(name, default) for name, default in DEFAULT_PRAGMAS.items()}
+
+
+def apply_sqlite_profile(engine: Engine, settings: Dict, immediate: bool = False) -> None:
+    """
+    Configure every new connection of a SQLite engine for concurrent use.
+
+    Sets the profile pragmas when a connection is opened, and lets SQLAlchemy
+    emit BEGIN itself instead of relying on the sqlite3 module's implicit
+    transactions. Engines used for writes start transactions with BEGIN
+    IMMEDIATE, so they take the write lock up front (waiting up to
+    `busy_timeout`) rather than failing with "database is locked" when
+    upgrading a read snapshot.
+
+    Args:
+        engine: SQLite engine to configure, before it opens its first connection
+        settings: The `[database.sqlite]` section of config.toml
+        immediate: Whether transactions take the write lock when they begin
+    """
+    pragmas = sqlite_pragmas(settings)
+    begin_statement = "BEGIN IMMEDIATE" if immediate else "BEGIN"
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        connection.exec_driver_sql(begin_statement)
+
+
+class _Write(NamedTuple):
+    """
+    A write queued on the SQLiteWriter.
+    """
+    fn: Callable
+    args: tuple
+    kwargs: dict
+    batched: bool
+    future: Future
+
+
+class SQLiteWriter:
+    """
+    Dedicated thread running all database writes of a process one at a time.
+
+    SQLite allows a single writer per database; funnelling writes through one
+    thread means threads of the same process never compete for the write lock,
+    so only other processes can make a write wait. Each write runs in its own
+    application context, with a session bound to the writer's own engine, so
+    writes never wait for a connection held by a request waiting on them.
+    Consecutive queued batched writes of the same function are merged into one
+    call (group commit). The thread is started lazily on first use.
+    """
+
+    def __init__(self, app: Flask, engine: Engine) -> None:
+        """
+        Initialize the writer without starting its thread.
+
+        Args:
+            app: Flask application whose context writes run in
+            engine: Engine with a single connection used for all writes
+        """
+        self.app = app
+        self.engine = engine
+        self._writes: Deque[_Write] = deque()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def is_current_thread(self) -> bool:
+        """
+        Check whether the caller is the writer thread.
+
+        Returns:
+            bool: True when called from the writer thread
+        """
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a function on the writer thread and wait for its result.
+
+        The function must not rely on objects of the caller's session; it runs
+        with a session of its own and is responsible for committing.
+
+        Args:
+            fn: Function performing the write
+            *args: Positional arguments for `fn`
+            **kwargs: Keyword arguments for `fn`
+
+        Returns:
+            Any: Return value of `fn`, whose exceptions are re-raised here
+        """
+        if self.is_current_thread():
+            return fn(*args, **kwargs)
+        return self._submit(_Write(fn, args, kwargs, False, Future()))
+
+    def run_batched(self, fn: Callable, rows: List) -> None:
+        """
+        Run a function taking a list of rows on the writer thread and wait for it.
+
+        Calls queued back to back for the same function are combined into one
+        call with all their rows, so concurrent small writes share a transaction.
+        If that call fails, every caller whose rows it included gets the exception.
+
+        Args:
+            fn: Function writing a list of rows and committing
+            rows: Rows to write
+        """
+        if self.is_current_thread():
+            fn(rows)
+            return
+        self._submit(_Write(fn, (rows,), {}, True, Future()))
+
+    def _submit(self, write: _Write) -> Any:
+        """
+        Queue a write, starting the thread if needed, and wait for its result.
+        """
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+            self._writes.append(write)
+            self._condition.notify()
+        return write.future.result()
+
+    def _next(self) -> Tuple[_Write, List[_Write]]:
+        """
+        Wait for the next write, and take the batched writes that can be merged into it.
+
+        Returns:
+            Tuple[_Write, List[_Write]]: The write to run, and the writes merged into it
+        """
+        with self._condition:
+            while not self._writes:
+                self._condition.wait()
+            write = self._writes.popleft()
+            merged = []
+            if write.batched:
+                while self._writes and self._writes[0].batched and self._writes[0].fn is write.fn:
+                    merged.append(self._writes.popleft())
+            return write, merged
+
+    def _run(self) -> None:
+        """
+        Writer loop: execute queued writes in order.
+        """
+        while True:
+            write, merged = self._next()
+            writes = [write] + merged
+            if merged:
+                args = ([row for item in writes for row in item.args[0]],)
+            else:
+                args = write.args
+            with self.app.app_context():
+                db.session.registry.set(Session(self.engine))
+                try:
+                    result = write.fn(*args, **write.kwargs)
+                except BaseException as e:
+                    db.session.rollback()
+                    for item in writes:
+                        item.future.set_exception(e)
+                else:
+                    for item in writes:
+                        item.future.set_result(result)
+
+
+def run_write(fn: Callable, *args, **kwargs) -> Any:
+    """
+    Run a database write on the current application's writer thread, if it has one.
+
+    Without a writer (other databases, or the SQLite profile disabled), the
+    function is called directly.
+
+    Args:
+        fn: Function performing the write and committing it
+        *args: Positional arguments for `fn`
+        **kwargs: Keyword arguments for `fn`
+
+    Returns:
+        Any: Return value of `fn`
+    """
+    writer = current_app.extensions.get("sqlite_writer")
+    if writer is None:
+        return fn(*args, **kwargs)
+    return writer.run(fn, *args, **kwargs)
+
+
+def run_batched_write(fn: Callable, rows: List) -> None:
+    """
+    Write a list of rows on the current application's writer thread, if it has one,
+    merged with other writes of the same function waiting at the same time.
+
+    Args:
+        fn: Function writing a list of rows and committing
+        rows: Rows to write
+    """
+    writer = current_app.extensions.get("sqlite_writer")
+    if writer is None:
+        fn(rows)
+    else:
+        writer.run_batched(fn, rows)
@@ -0,0 +1,153 @@
+import json
+import logging
+from typing import Any, Dict, Mapping, NamedTuple, Optional
+
+from src.server_utils.cache import LRUCache
+from src.server_utils.config import get_config
+
+config = get_config()
+cache_config = config.get("cache", {})
+
+
+class QRStyle(NamedTuple):
+    """
+    Effective QR style of a code: the `[qr_code]` defaults overridden by its stored options.
+    """
+    size: int
+    width: int
+    height: int
+    margin: int
+    color_dark: str
+    color_light: str
+    correct_level: str
+    dot_type: str
+    corner_square_type: str
+    corner_dot_type: str
+    logo_image: str
+    logo_margin: int
+    logo_size: float
+    gradient_type: str
+    gradient_color_start: str
+    gradient_color_end: str
+    gradient_rotation: int
+    background_gradient_type: str
+    background_gradient_color_start: str
+    background_gradient_color_end: str
+    background_gradient_rotation: int
+
+
+# Style options a code may store, with their type
+STYLE_FIELDS: Dict[str, type] = dict(QRStyle.__annotations__)
+
+# Used for options missing from [qr_code], matching the defaults of the pages
+_FALLBACKS = {
+    "width": 512, "height": 512, "margin": 4, "color_dark": "#000000", "color_light": "#ffffff",
+    "correct_level": "H", "dot_type": "square", "corner_square_type": "square", "corner_dot_type": "square",
+    "logo_image": "", "logo_margin": 3, "logo_size": 0.3,
+    "gradient_type": "", "gradient_color_start": "", "gradient_color_end": "", "gradient_rotation": 0,
+    "background_gradient_type": "", "background_gradient_color_start": "", "background_gradient_color_end": "",
+    "background_gradient_rotation": 0,
+}
+
+# Effective styles by stored JSON string, and the styles themselves so equal
+# styles stored with different JSON still share one instance. The config is
+# read once, so entries never go stale.
+_styles_by_json = LRUCache(max_size=cache_config.get("style_size", 1024), ttl=float("inf"))
+_interned = LRUCache(max_size=cache_config.get("style_size", 1024), ttl=float("inf"))
+
+
+def _coerce(options: Mapping[str, Any], source: str) -> Dict[str, Any]:
+    """
+    Convert style options to their type, dropping unknown, empty and invalid ones.
+    """
+    coerced = {}
+    for name, value in options.items():
+        if name not in STYLE_FIELDS or value is None or value == "":
+            continue
+        try:
+            coerced[name] = STYLE_FIELDS[name](value)
+        except (TypeError, ValueError):
+            logging.warning(f"Ignoring invalid QR style option {name}={value!r} in {source}")
+    return coerced
+
+
+def _build(options: Dict[str, Any]) -> QRStyle:
+    """
+    Create the effective style of some stored options, reusing an equal interned instance.
+    """
+    values = {**_FALLBACKS, **_DEFAULT_OPTIONS, **options}
+    # Without an explicit size, the code is as wide as configured
+    values.setdefault("size", values["width"])
+    style = QRStyle(**values)
+    interned = _interned.get(style)
+    if interned is not None:
+        return interned
+    _interned.set(style, style)
+    return style
+
+
+_DEFAULT_OPTIONS = _coerce(config.get("qr_code", {}), "[qr_code]")
+DEFAULT_STYLE = _build({})
+
+
+def style_config(stored: Optional[str]) -> QRStyle:
+    """
+    Get the effective style of a code from its stored style JSON.
+
+    The parsed style is memoized by the JSON string, so codes sharing a style
+    parse and merge it once and get the same immutable instance. Invalid
+    stored options are ignored and fall back to the defaults.
+
+    Args:
+        stored: `Association.qr_style_config` of the code, or None
+
+    Returns:
+        QRStyle: `[qr_code]` defaults overridden by the stored options
+    """
+    if not stored:
+        return DEFAULT_STYLE
+    style = _styles_by_json.get(stored)
+    if style is not None:
+        return style
+
+    try:
+        options = json.loads(stored)
+    except ValueError:
+        logging.warning(f"Ignoring invalid stored QR style: {stored[:100]!r}")
+        options = {}
+    style = _build(_coerce(options if isinstance(options, dict) else {}, "stored QR style"))
+    _styles_by_json.set(stored, style)
+    return style
+
+
+def parse_style_form(form: Mapping[str, str]) -> Optional[Dict[str, Any]]:
+    """
+    Read the QR style options of the create and edit forms, given as "qr_style_<option>" fields.
+
+    The size falls back to the "qr_style_width" field. Empty and unparsable
+    fields are ignored, as are gradient colors and rotations without a
+    gradient type.
+
+    Args:
+        form: Submitted form fields
+
+    Returns:
+        Optional[Dict[str, Any]]: Typed options to store, or None if there are none
+    """
+    style = {}
+    for name, kind in STYLE_FIELDS.items():
+        if name in ("width", "height"):
+            continue
+        value = (form.get(f"qr_style_{name}") or "").strip()
+        if name == "size" and not value:
+            value = (form.get("qr_style_width") or "").strip()
+        if not value:
+            continue
+        gradient = "background_gradient" if name.startswith("background_gradient_") else "gradient" if name.startswith("gradient_") else None
+        if gradient is not None and name != f"{gradient}_type" and f"{gradient}_type" not in style:
+            continue
+        try:
+            style[name] = kind(value)
+        except ValueError:
+            continue
+    return style or None
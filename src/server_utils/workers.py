@@ -0,0 +1,200 @@
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, Optional
+
+from flask import Flask
+
+from src.server_utils.config import get_config
+from src.server_utils.serving import waitress_options
+from src.server_utils.shared import db
+
+config = get_config()
+
+# Workers exiting sooner than this after being started are restarted with a delay,
+# so a worker that crashes on startup does not turn into a fork loop
+MIN_WORKER_LIFETIME = 1.0
+
+
+def _dispose_engine(app: Flask) -> None:
+    """
+    Close every pooled database connection of an application.
+
+    Args:
+        app: Application whose engine is disposed
+    """
+    with app.app_context():
+        db.engine.dispose()
+    writer = app.extensions.get("sqlite_writer")
+    if writer is not None:
+        writer.engine.dispose()
+
+
+def _exit_on_signal(signum, frame) -> None:
+    """
+    Signal handler raising SystemExit, on which waitress stops its loop and task threads.
+    """
+    sys.exit(0)
+
+
+def _describe_status(status: int) -> str:
+    """
+    Describe a wait status returned by `os.waitpid`.
+
+    Args:
+        status: Wait status
+
+    Returns:
+        str: Exit code or terminating signal
+    """
+    if os.WIFSIGNALED(status):
+        return f"signal {os.WTERMSIG(status)}"
+    return f"status {os.WEXITSTATUS(status)}"
+
+
+def _run_worker(sock: socket.socket, options: Dict, pool_overrides: Optional[dict] = None) -> None:
+    """
+    Serve requests on an inherited listening socket until SIGTERM.
+
+    Runs in a forked child. The application, and with it the database engine and
+    the impression buffer thread, is created here rather than inherited, since
+    neither pooled connections nor threads survive a fork. Never returns.
+
+    Args:
+        sock: Listening socket shared by all workers
+        options: Keyword arguments for `waitress.serve`
+        pool_overrides: Connection pool option name to value mapping overriding config.toml
+    """
+    from waitress import serve
+
+    from src.server import create_app
+
+    status = 0
+    try:
+        signal.signal(signal.SIGTERM, _exit_on_signal)
+        # Ctrl+C reaches the whole process group; the parent coordinates the shutdown
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        app = create_app(mode="public", pool_overrides=pool_overrides)
+        logging.info(f"Worker {os.getpid()} started")
+        serve(app, sockets=[sock], **options)
+        impression_buffer = app.extensions.get("impression_buffer")
+        if impression_buffer is not None:
+            impression_buffer.stop()
+        _dispose_engine(app)
+        logging.info(f"Worker {os.getpid()} stopped")
+    except SystemExit:
+        pass
+    except BaseException:
+        logging.exception(f"Worker {os.getpid()} failed")
+        status = 1
+    finally:
+        # Skip the parent's atexit handlers and click's cleanup inherited through fork
+        logging.shutdown()
+        os._exit(status)
+
+
+def serve_workers(host: str, port: int, workers: int, overrides: Optional[dict] = None,
+                  pool_overrides: Optional[dict] = None) -> None:
+    """
+    Serve the public application from several pre-forked worker processes.
+
+    The parent binds the listening socket and creates the database tables once,
+    then forks `workers` children which each create their own application and
+    accept connections from the shared socket, so scans are handled by several
+    interpreters rather than threads behind one GIL. Dead workers are restarted.
+    On SIGTERM or SIGINT, workers are asked to stop and given
+    `[server.public] worker_shutdown_timeout` seconds to finish in-flight
+    requests and flush buffered scans before being killed.
+
+    Each worker has its own resolution cache, so changes made on the admin
+    server reach the workers once cached entries expire. With SQLite, workers
+    write to the same database file and wait on its lock in turn.
+
+    Args:
+        host: Host to bind to
+        port: Port to bind to
+        workers: Number of worker processes
+        overrides: Waitress option name to value mapping overriding config.toml
+        pool_overrides: Connection pool option name to value mapping overriding config.toml,
+            for each worker's engine
+    """
+    if not hasattr(os, "fork"):
+        raise RuntimeError("Multiple workers require os.fork, which is not available on this platform")
+
+    from src.server import create_app
+
+    options = waitress_options("public", overrides)
+    shutdown_timeout = config.get("server", {}).get("public", {}).get("worker_shutdown_timeout", 30)
+
+    # Create the tables before forking rather than racing on it in every worker, and
+    # close the connections used for it so no worker inherits an open database handle.
+    # Admin mode is used as it does not start an impression buffer thread.
+    _dispose_engine(create_app(mode="admin"))
+
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.create_server((host, port), family=family, backlog=options.get("backlog", 1024))
+    sock.setblocking(False)
+    logging.info(f"Serving public app on {host}:{port} with {workers} workers and {options}")
+
+    children: Dict[int, float] = {}
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(sock, options, pool_overrides)
+        children[pid] = time.monotonic()
+
+    def request_stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+
+    previous_handlers = {
+        signum: signal.signal(signum, request_stop) for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+    try:
+        for _ in range(workers):
+            spawn()
+
+        while not stopping:
+            # Polled rather than blocking, as a blocking waitpid is resumed after signal handlers
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                time.sleep(0.2)
+                continue
+            started = children.pop(pid, None)
+            if started is None or stopping:
+                continue
+            logging.warning(f"Worker {pid} exited with {_describe_status(status)}, restarting it")
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            spawn()
+    finally:
+        logging.info(f"Stopping {len(children)} workers")
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + shutdown_timeout
+        while children and time.monotonic() < deadline:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+        for pid in children:
+            logging.warning(f"Worker {pid} did not stop within {shutdown_timeout}s, killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+
+        sock.close()
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
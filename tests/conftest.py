@@ -0,0 +1,77 @@
+import os
+from typing import Callable, Dict, Tuple
+
+import pytest
+from sqlalchemy import func, select
+
+from src.server_utils.config import get_config
+
+os.environ.setdefault("SECRET_KEY", "test")
+# Set before src.server configures logging on import
+get_config()["logging"]["filename"] = os.devnull
+
+from src.server import create_app  # noqa: E402
+from src.server_utils import archive, keys, partitions  # noqa: E402
+from src.server_utils.cache import resolution_cache, response_cache, stats_version_cache  # noqa: E402
+from src.server_utils.db import Association, ImpressionTotal, Stats  # noqa: E402
+from src.server_utils.partitions import impression_source  # noqa: E402
+from src.server_utils.shared import db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """
+    Admin application on a fresh SQLite database, with its application context pushed.
+    """
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setitem(archive.archive_config, "directory", str(tmp_path / "archive"))
+    # Process-wide state remembering the database of a previous test
+    partitions._known_partitions.clear()
+    keys._key_generator = None
+    for cache in (resolution_cache, response_cache, stats_version_cache):
+        cache.clear()
+
+    app = create_app(mode="admin")
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+    writer = app.extensions.get("sqlite_writer")
+    if writer is not None:
+        writer.engine.dispose()
+
+
+@pytest.fixture
+def create_code(app) -> Callable[[str], int]:
+    """
+    Function creating a QR code association with its stats entry and returning the stats id.
+    """
+    def create(key: str, url: str = "https://example.com") -> int:
+        association = Association(key, url)
+        association.stats = Stats(key)
+        db.session.add(association)
+        db.session.flush()
+        # Read before committing, refreshing it would leave a read transaction open
+        stats_id = association.stats.id
+        db.session.commit()
+        return stats_id
+
+    return create
+
+
+@pytest.fixture
+def scan_counts(app) -> Callable[[], Tuple[Dict[int, int], Dict[int, int]]]:
+    """
+    Function returning the raw impression count and the lifetime total of each stats id.
+    """
+    def counts() -> Tuple[Dict[int, int], Dict[int, int]]:
+        # End the read transaction, scans may have been written by another thread
+        db.session.rollback()
+        source = impression_source(db.session.connection())
+        raw = dict(db.session.execute(
+            select(source.c.stats_id, func.count()).group_by(source.c.stats_id)
+        ).all())
+        totals = dict(db.session.execute(select(ImpressionTotal.stats_id, ImpressionTotal.count)).all())
+        return raw, totals
+
+    return counts
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.server_utils.archive import to_epoch
+from src.server_utils.impressions import write_impressions
+
+np = pytest.importorskip("numpy")
+
+from src.server_utils.analytics import analyze, load_epochs  # noqa: E402
+
+
+def test_load_epochs_splits_sorted_scans_per_key(create_code):
+    first, second, other = create_code("first"), create_code("second"), create_code("other")
+    # Spread over two monthly partitions, written out of order
+    scans = {
+        first: [datetime(2026, 5, 20, 8), datetime(2026, 4, 2, 9), datetime(2026, 5, 1)],
+        second: [datetime(2026, 4, 30, 23, 59)],
+        other: [datetime(2026, 4, 10)],
+    }
+    write_impressions([(stats_id, when) for stats_id, times in scans.items() for when in times])
+
+    sources = load_epochs([first, second], datetime(2026, 4, 1), datetime(2026, 5, 20, 8))
+
+    assert set(sources) == {first, second}
+    # SQLite converts timestamps with julianday, exact to a few dozen microseconds
+    expected = {
+        first: [datetime(2026, 4, 2, 9), datetime(2026, 5, 1)],
+        second: [datetime(2026, 4, 30, 23, 59)],
+    }
+    for stats_id, times in expected.items():
+        loaded = np.concatenate(sources[stats_id])
+        assert np.all(np.diff(loaded) > 0)
+        assert np.abs(loaded - [to_epoch(when) for when in times]).max() < 100
+
+def test_analyze_counts_loaded_scans(create_code):
+    stats_id = create_code("key")
+    end = datetime(2026, 6, 1)
+    write_impressions([(stats_id, end - timedelta(hours=hours)) for hours in (1, 2, 2, 30)])
+    start = end - timedelta(days=7)
+
+    result = analyze(load_epochs([stats_id], start, end), start, end)[stats_id]
+
+    assert result["count"] == 4
+    assert result["growth"]["current"] == 4
+    assert sum(result["heatmap"]["weekdays"]) == 4
@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import delete
+
+from src.server_utils import asgi
+from src.server_utils.asgi import AsyncImpressionWriter, async_database_url
+from src.server_utils.db import Association, Stats
+from src.server_utils.shared import db
+
+pytest.importorskip("aiosqlite")
+
+
+def _write(rows):
+    """
+    Write rows with an AsyncImpressionWriter on the database of the current app.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    async def run():
+        engine = create_async_engine(async_database_url(str(db.engine.url)))
+        try:
+            await AsyncImpressionWriter(engine)._write(rows)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_writer_drops_scans_of_deleted_keys(create_code, scan_counts):
+    kept = create_code("kept")
+    deleted = create_code("deleted")
+    db.session.execute(delete(Stats).where(Stats.id == deleted))
+    db.session.execute(delete(Association).where(Association.key == "deleted"))
+    db.session.commit()
+
+    now = datetime.now()
+    _write([(kept, now), (deleted, now), (kept, now)])
+
+    raw, totals = scan_counts()
+    assert raw == {kept: 2}
+    assert totals == {kept: 2}
+
+
+def test_writer_retries_failed_batch(create_code, scan_counts, monkeypatch):
+    stats_id = create_code("key")
+    calls = []
+    impression_inserts = asgi.impression_inserts
+
+    def failing_once(rows, dialect_name):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise RuntimeError("transient failure")
+        return impression_inserts(rows, dialect_name)
+
+    monkeypatch.setattr(asgi, "impression_inserts", failing_once)
+    _write([(stats_id, datetime.now())])
+
+    raw, totals = scan_counts()
+    assert calls == [1, 1]
+    assert raw == {stats_id: 1}
+    assert totals == {stats_id: 1}
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.server_utils.dashboard import MAX_LIMIT, SORTS, DashboardError, dashboard_page
+from src.server_utils.impressions import write_impressions
+
+NOW = datetime(2026, 10, 16, 12, 30)
+
+
+@pytest.fixture
+def codes(create_code):
+    """
+    Codes with tied and distinct scan counts, recent and old scans, and no scans.
+    """
+    scans = {
+        "alpha": [NOW - timedelta(hours=1)] * 3,
+        "bravo": [NOW - timedelta(days=3)] * 3,
+        "charlie": [NOW - timedelta(days=30)],
+        "delta": [NOW - timedelta(hours=2), NOW - timedelta(days=10)],
+        "echo": [],
+        "foxtrot": [],
+        "golf": [NOW - timedelta(hours=1)] * 3,
+    }
+    rows = []
+    for key, times in scans.items():
+        stats_id = create_code(key, f"https://example.com/{len(times)}/{key}")
+        rows.extend((stats_id, when) for when in times)
+    write_impressions(rows)
+    return list(scans)
+
+
+def _walk(limit, **options):
+    keys, cursor = [], None
+    while True:
+        page = dashboard_page(cursor=cursor, limit=limit, now=NOW, **options)
+        assert len(page["items"]) <= limit
+        keys.extend(item["key"] for item in page["items"])
+        cursor = page["next"]
+        if cursor is None:
+            return keys
+
+
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("sort", SORTS)
+def test_pages_cover_every_code_once_in_order(codes, sort, descending):
+    expected = [item["key"] for item in dashboard_page(sort=sort, descending=descending, limit=MAX_LIMIT, now=NOW)["items"]]
+    assert sorted(expected) == sorted(codes)
+
+    for limit in (1, 2, 3):
+        assert _walk(limit, sort=sort, descending=descending) == expected
+
+
+def test_ties_are_broken_by_key_in_the_same_direction(codes):
+    items = dashboard_page(sort="total", descending=True, limit=3, now=NOW)["items"]
+
+    assert [(item["key"], item["total"]) for item in items] == [("golf", 3), ("bravo", 3), ("alpha", 3)]
+    assert items[1]["scans_24h"] == 0 and items[1]["scans_7d"] == 3 and items[2]["scans_24h"] == 3
+
+
+def test_search_is_applied_to_every_page(codes):
+    assert _walk(1, sort="total", search="/3/") == ["alpha", "bravo", "golf"]
+
+
+def test_cursor_of_another_sort_is_rejected(codes):
+    cursor = dashboard_page(sort="key", limit=1, now=NOW)["next"]
+
+    with pytest.raises(DashboardError):
+        dashboard_page(sort="nope", now=NOW)
+    with pytest.raises(DashboardError):
+        dashboard_page(sort="total", cursor="not a cursor", now=NOW)
+    assert dashboard_page(sort="key", cursor=cursor, limit=1, now=NOW)["items"][0]["key"] == "bravo"
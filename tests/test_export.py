@@ -0,0 +1,57 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from src.server_utils.export import iter_export, iter_impression_pages
+from src.server_utils.impressions import write_impressions
+
+TIED = datetime(2026, 4, 30, 12)
+
+
+@pytest.fixture
+def scans(create_code):
+    """
+    Scans of a key over two months, with several at the same time, and a scan of another key.
+    """
+    stats_id = create_code("key")
+    other = create_code("other")
+    times = [datetime(2026, 5, 2), TIED, datetime(2026, 4, 3), TIED, TIED, datetime(2026, 5, 1), TIED]
+    write_impressions([(stats_id, when) for when in times] + [(other, TIED)])
+    return stats_id, sorted(times)
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 3, 100])
+def test_pages_list_every_scan_once_in_order(scans, page_size):
+    stats_id, times = scans
+
+    pages = list(iter_impression_pages(stats_id, page_size=page_size))
+
+    assert all(0 < len(page) <= page_size for page in pages)
+    rows = [row for page in pages for row in page]
+    assert [when for _, when in rows] == times
+    # Ties on the timestamp are paged by id, unique within a partition
+    assert len(set(rows)) == len(times)
+    tied_ids = [impression_id for impression_id, when in rows if when == TIED]
+    assert tied_ids == sorted(tied_ids)
+
+
+def test_pages_are_limited_to_the_range(scans):
+    stats_id, times = scans
+
+    pages = iter_impression_pages(stats_id, start=TIED, end=datetime(2026, 5, 2), page_size=2)
+
+    assert [when for page in pages for _, when in page] == [TIED] * 4 + [datetime(2026, 5, 1)]
+
+
+def test_export_formats(scans):
+    stats_id, times = scans
+
+    lines = "".join(iter_export(stats_id, "ndjson", page_size=2)).splitlines()
+    assert [json.loads(line)["datetime"] for line in lines] == [when.isoformat() for when in times]
+
+    rows = "".join(iter_export(stats_id, "csv", page_size=2)).splitlines()
+    assert rows[0] == "id,datetime" and len(rows) == len(times) + 1
+
+    with pytest.raises(ValueError):
+        next(iter_export(stats_id, "xml"))
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from sqlalchemy import delete
+
+from src.server_utils import impressions
+from src.server_utils.db import Association, Stats
+from src.server_utils.impressions import ImpressionBuffer, write_impressions
+from src.server_utils.shared import db
+
+
+def _delete_code(key):
+    db.session.execute(delete(Stats).where(Stats.key == key))
+    db.session.execute(delete(Association).where(Association.key == key))
+    db.session.commit()
+
+
+def test_write_impressions_drops_scans_of_deleted_keys(create_code, scan_counts):
+    kept = create_code("kept")
+    deleted = create_code("deleted")
+    _delete_code("deleted")
+
+    write_impressions([(kept, datetime.now()), (deleted, datetime.now())])
+    write_impressions([(deleted, datetime.now())])
+
+    assert scan_counts() == ({kept: 1}, {kept: 1})
+
+
+def test_buffer_writes_queued_scans_on_stop(app, create_code, scan_counts):
+    stats_id = create_code("key")
+    buffer = ImpressionBuffer(app)
+
+    assert buffer.put(stats_id, datetime.now())
+    assert buffer.put(stats_id, datetime.now())
+    buffer.stop()
+
+    assert scan_counts() == ({stats_id: 2}, {stats_id: 2})
+    assert not buffer.put(stats_id, datetime.now())
+
+
+def test_buffer_refuses_scans_when_full(app, create_code):
+    stats_id = create_code("key")
+    buffer = ImpressionBuffer(app, max_size=1, put_timeout=0.01)
+
+    assert buffer.put(stats_id, datetime.now())
+    assert not buffer.put(stats_id, datetime.now())
+
+
+def test_buffer_flush_keeps_live_scans_of_a_batch_with_deleted_keys(app, create_code, scan_counts):
+    kept = create_code("kept")
+    deleted = create_code("deleted")
+    _delete_code("deleted")
+
+    ImpressionBuffer(app)._flush([(deleted, datetime.now()), (kept, datetime.now()), (kept, datetime.now())])
+
+    assert scan_counts() == ({kept: 2}, {kept: 2})
+
+
+def test_buffer_flush_retries_once(app, create_code, scan_counts, monkeypatch):
+    stats_id = create_code("key")
+    calls = []
+    write = impressions.write_impressions
+
+    def failing_once(rows):
+        calls.append(rows)
+        if len(calls) == 1:
+            raise RuntimeError("transient failure")
+        write(rows)
+
+    monkeypatch.setattr(impressions, "write_impressions", failing_once)
+    ImpressionBuffer(app)._flush([(stats_id, datetime.now())])
+
+    assert len(calls) == 2
+    assert scan_counts() == ({stats_id: 1}, {stats_id: 1})
@@ -0,0 +1,77 @@
+import secrets
+
+import pytest
+
+from src.server_utils import keys
+from src.server_utils.keys import KeyGenerator, SequenceKeyGenerator, generate_unique_keys
+
+
+def _offline_generator(char_set, length):
+    generator = SequenceKeyGenerator(char_set, length)
+    generator._secret = secrets.token_bytes(32)
+    return generator
+
+
+@pytest.mark.parametrize("char_set, length", [("abc", 3), ("ab", 4), ("0123456789", 2), ("abcdefgh", 3)])
+def test_permute_is_a_bijection_on_the_keyspace(char_set, length):
+    generator = _offline_generator(char_set, length)
+
+    permuted = [generator.permute(value) for value in range(generator.domain)]
+
+    assert sorted(permuted) == list(range(generator.domain))
+
+
+def test_permute_walks_cycles_outside_the_keyspace():
+    # 27 keys need 5 bits, so the Feistel network permutes 64 values
+    generator = _offline_generator("abc", 3)
+    assert 1 << (2 * generator.half_bits) > generator.domain
+
+    assert all(generator.permute(value) < generator.domain for value in range(generator.domain))
+
+
+def test_encode_is_fixed_length():
+    generator = _offline_generator("ab", 4)
+
+    assert [generator.encode(value) for value in (0, 1, 15)] == ["aaaa", "aaab", "bbbb"]
+
+
+def test_sequence_keys_are_unique_until_exhausted(app):
+    generator = SequenceKeyGenerator("ab", 4, block_size=5)
+
+    generated = generator.candidates(generator.domain)
+
+    assert len(set(generated)) == generator.domain
+    with pytest.raises(RuntimeError, match="exhausted"):
+        generator.candidates(1)
+
+
+def test_sequence_continues_across_generators(app):
+    first = SequenceKeyGenerator("ab", 4, block_size=5).candidates(6)
+    # A restarted process reserves blocks after the ones already handed out
+    second = SequenceKeyGenerator("ab", 4, block_size=5).candidates(6)
+
+    assert len(set(first) | set(second)) == 12
+
+
+class ScriptedKeyGenerator(KeyGenerator):
+    def __init__(self, batches):
+        super().__init__("ab", 4)
+        self.batches = iter(batches)
+
+    def candidates(self, count):
+        return next(self.batches)
+
+
+def test_key_generator_requires_candidates():
+    class Incomplete(KeyGenerator):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete("ab", 4)
+
+
+def test_generate_unique_keys_skips_used_and_reserved_keys(create_code, monkeypatch):
+    create_code("used")
+    monkeypatch.setattr(keys, "_key_generator", ScriptedKeyGenerator([["used", "mine"], ["new1", "new2"]]))
+
+    assert sorted(generate_unique_keys(2, reserved=["mine"])) == ["new1", "new2"]
@@ -0,0 +1,70 @@
+import pytest
+from sqlalchemy import func, select
+
+from src.server_utils import provisioning
+from src.server_utils.db import Association
+from src.server_utils.provisioning import ProvisioningError, bulk_create, parse_items
+from src.server_utils.shared import db
+
+
+def stats_url_for(key):
+    return f"/stats/{key}"
+
+
+def _association_count():
+    # End the read transaction, the codes are inserted on the SQLite writer thread
+    db.session.rollback()
+    return db.session.execute(select(func.count()).select_from(Association)).scalar()
+
+
+def test_bulk_create_keeps_request_order(app):
+    items = [{"url": "https://a.example", "key": "first"}, {"url": "https://b.example"}, {"url": "https://c.example", "key": "third"}]
+
+    created = bulk_create(items, stats_url_for)
+
+    assert [code["url"] for code in created] == [item["url"] for item in items]
+    assert created[0]["key"] == "first" and created[2]["key"] == "third"
+    assert created[1]["stats_url"] == stats_url_for(created[1]["key"])
+    assert _association_count() == 3
+
+
+def test_bulk_create_rejects_existing_keys(create_code):
+    create_code("taken")
+
+    with pytest.raises(ProvisioningError, match="taken"):
+        bulk_create([{"url": "https://a.example"}, {"url": "https://b.example", "key": "taken"}], stats_url_for)
+    assert _association_count() == 1
+
+
+def test_bulk_create_rejects_duplicate_keys(app):
+    with pytest.raises(ProvisioningError, match="Duplicate"):
+        bulk_create([{"url": "https://a.example", "key": "same"}, {"url": "https://b.example", "key": "same"}], stats_url_for)
+    assert _association_count() == 0
+
+
+def test_bulk_create_reports_keys_created_concurrently(create_code, monkeypatch):
+    existing_keys = provisioning.existing_keys
+    checks = []
+
+    def racing_existing_keys(keys):
+        # The key is created by another request right after the first check
+        checks.append(list(keys))
+        if len(checks) == 1:
+            create_code("raced")
+            return set()
+        return existing_keys(keys)
+
+    monkeypatch.setattr(provisioning, "existing_keys", racing_existing_keys)
+
+    with pytest.raises(ProvisioningError, match="raced"):
+        bulk_create([{"url": "https://a.example", "key": "fresh"}, {"url": "https://b.example", "key": "raced"}], stats_url_for)
+    db.session.rollback()
+    assert db.session.execute(select(Association.key)).scalars().all() == ["raced"]
+
+
+def test_parse_items_csv_with_style_columns():
+    items = parse_items("url,key,size\nhttps://a.example,a,12\nhttps://b.example,,\n", "csv")
+
+    assert [item["key"] for item in items] == ["a", ""]
+    assert provisioning._style_from_item(items[0]) == {"size": 12}
+    assert provisioning._style_from_item(items[1]) is None
@@ -0,0 +1,96 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, text
+
+from src.server_utils import retention
+from src.server_utils.db import ImpressionDaily
+from src.server_utils.impressions import write_impressions
+from src.server_utils.partitions import impression_inserts, list_partitions, prepare_partitions
+from src.server_utils.retention import sweep_impressions
+from src.server_utils.shared import db
+from src.server_utils.sqlite import run_write
+
+# With 30 days of retention, months before September 2026 are expired
+NOW = datetime(2026, 10, 16)
+
+
+@pytest.fixture(autouse=True)
+def retention_config(monkeypatch):
+    monkeypatch.setitem(retention.retention_config, "raw_impression_days", 30)
+    monkeypatch.setitem(retention.retention_config, "action", "drop")
+
+
+def _write_raw(rows):
+    """
+    Insert impressions without counting them in the rollups, as before `db backfill-rollups`.
+    """
+    def write():
+        prepare_partitions(db.session.connection(), rows)
+        for stmt, params in impression_inserts(rows, "sqlite"):
+            db.session.execute(stmt, params)
+        db.session.commit()
+
+    run_write(write)
+
+
+def _partition_names():
+    db.session.rollback()
+    return {partition.table.name for partition in list_partitions(db.session.connection())}
+
+
+def test_sweep_drops_months_counted_in_rollups(create_code, scan_counts):
+    stats_id = create_code("key")
+    write_impressions([(stats_id, datetime(2026, 5, 3)), (stats_id, datetime(2026, 5, 4)), (stats_id, datetime(2026, 9, 2))])
+
+    result = sweep_impressions(NOW)
+
+    assert result["dropped"] == ["impressions_2026_05"]
+    assert result["deleted"] == 2
+    assert "impressions_2026_05" not in _partition_names()
+    # Stats come from the rollups, so the lifetime total is unchanged
+    assert scan_counts() == ({stats_id: 1}, {stats_id: 3})
+
+
+def test_sweep_keeps_months_missing_from_rollups(create_code, scan_counts):
+    stats_id = create_code("key")
+    write_impressions([(stats_id, datetime(2026, 5, 3))])
+    _write_raw([(stats_id, datetime(2026, 6, 3))] * 3)
+    # Rollups of an older month, whose raw impressions were dropped already,
+    # must not make up for the uncounted June impressions
+    db.session.execute(insert(ImpressionDaily), [{"stats_id": stats_id, "bucket": datetime(2026, 1, 1), "count": 1000}])
+    db.session.commit()
+
+    result = sweep_impressions(NOW)
+
+    assert result["dropped"] == ["impressions_2026_05"]
+    assert "impressions_2026_06" in _partition_names()
+    assert scan_counts()[0] == {stats_id: 3}
+
+
+def test_sweep_checks_unpartitioned_rows_month_by_month(create_code, scan_counts):
+    stats_id = create_code("key")
+    db.session.execute(insert(ImpressionDaily), [{"stats_id": stats_id, "bucket": datetime(2026, 1, 1), "count": 5}])
+    db.session.execute(text("INSERT INTO impressions (id, stats_id, datetime) VALUES (1, :stats_id, :datetime)"),
+                       {"stats_id": stats_id, "datetime": datetime(2026, 2, 5)})
+    db.session.commit()
+
+    assert sweep_impressions(NOW)["deleted"] == 0
+    assert scan_counts()[0] == {stats_id: 1}
+
+    db.session.execute(insert(ImpressionDaily), [{"stats_id": stats_id, "bucket": datetime(2026, 2, 5), "count": 1}])
+    db.session.commit()
+
+    assert sweep_impressions(NOW)["deleted"] == 1
+    assert scan_counts()[0] == {}
+
+
+def test_sweep_without_retention_keeps_everything(create_code, scan_counts, monkeypatch):
+    monkeypatch.setitem(retention.retention_config, "raw_impression_days", 0)
+    stats_id = create_code("key")
+    write_impressions([(stats_id, datetime(2020, 5, 3))])
+
+    result = sweep_impressions(NOW)
+
+    assert result["dropped"] == [] and result["deleted"] == 0
+    assert scan_counts()[0] == {stats_id: 1}